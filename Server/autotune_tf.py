@@ -0,0 +1,174 @@
+"""
+Module used to tune TensorFlow's CPU threading settings on the current
+machine. Inference of the denoiser and the OCR model is benchmarked over a
+grid of intra-op and inter-op thread counts, oneDNN on and off, batch sizes
+and numbers of concurrent workers - every setting in fresh processes, since
+the threading settings cannot change after TensorFlow starts. The workers
+of a setting run together, as the workers of the server do: every phase
+of the benchmark starts in all of them at once, and lasts the same time
+in all of them, so every worker is measured under the contention of the
+others from start to end.
+The results are printed as a throughput/latency table, and the best
+profile is saved to `consts.TF_PROFILE_PATH`, which `config_tf` applies
+at startup.
+
+Usage: python autotune_tf.py [--glyphs 1024] [--workers N]
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+import consts
+
+BATCH_SIZES = [16, 64, 256]
+INTER_OP_THREADS = [1, 2]
+PHASE_SECONDS = 3.0  # how long every phase of the benchmark runs, in every worker
+
+
+def _measure(step: Callable[[], int]) -> float:
+    """
+    Wait until every worker is ready for the phase, run the step (which
+    returns the number of glyphs it predicted) again and again for
+    `PHASE_SECONDS`, and get the glyphs predicted per second. No worker
+    stops early, so none of them is measured on a machine the others left.
+    """
+    print('ready', flush=True)
+    sys.stdin.readline()
+    glyphs, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < PHASE_SECONDS:
+        glyphs += step()
+    return glyphs / elapsed
+
+
+def benchmark(glyphs_count: int) -> None:
+    """
+    Benchmark inference in this process (with the settings of the profile
+    in `TF_PROFILE_PATH`), and print the results as JSON. Prints 'ready'
+    before every phase, and waits for a line on stdin before starting it,
+    so concurrent workers are measured together (see `run_setting`).
+    """
+    import config_tf
+    from noise_remover import DenoisingAutoencoder
+    from ocr_model import OCRModel
+
+    model = OCRModel()
+    denoiser = DenoisingAutoencoder()
+    model.load_model()
+    denoiser.load_model()
+    glyphs = np.random.default_rng(0).random((glyphs_count, *consts.IMAGE_SIZE))
+    model.predict_batch(denoiser.denoise_batch(glyphs[:1]))  # warm-up
+
+    def predict_single() -> int:
+        model.predict_batch(denoiser.denoise_batch(glyphs[:1]))
+        return 1
+
+    def predict_all() -> int:
+        model.predict_batch(denoiser.denoise_batch(glyphs))
+        return glyphs_count
+
+    latency = 1 / _measure(predict_single)
+    throughputs = {}
+    for batch_size in BATCH_SIZES:
+        config_tf.predict_batch_size = batch_size
+        throughputs[batch_size] = _measure(predict_all)
+    print(json.dumps({'latency': latency, 'throughputs': throughputs}), flush=True)
+
+
+def run_setting(setting: dict, workers: int, glyphs_count: int) -> list[dict]:
+    """Run the benchmark in `workers` concurrent processes, with the given
+    threading setting, and get the results of every process. Every phase
+    is started in all of the processes at once, after all of them are ready."""
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(setting, f)
+    env = dict(os.environ, TF_PROFILE_PATH=f.name, TF_CPP_MIN_LOG_LEVEL='2')
+    try:
+        processes = [subprocess.Popen([sys.executable, __file__, '--benchmark',
+                                       '--glyphs', str(glyphs_count)],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      env=env, text=True)
+                     for _ in range(workers)]
+        # the latency phase, and a phase for every batch size
+        for _ in range(1 + len(BATCH_SIZES)):
+            for process in processes:
+                # skip the output of Keras while loading the models
+                while (line := process.stdout.readline()).strip() != 'ready':
+                    if not line:
+                        raise RuntimeError(f'The benchmark of {setting} failed.')
+            for process in processes:
+                process.stdin.write('go\n')
+                process.stdin.flush()
+        results = []
+        for process in processes:
+            results.append(json.loads(process.stdout.readlines()[-1]))
+            process.wait()
+        return results
+    finally:
+        os.remove(f.name)
+
+
+def autotune(glyphs_count: int, workers: Optional[int] = None) -> pd.DataFrame:
+    """Benchmark every setting of the grid, and save the best profile (the
+    highest total throughput of all of the workers). If `workers` is given,
+    only that many concurrent workers are tuned for (e.g. the number of
+    workers the server is deployed with), instead of comparing 1, 2 and 4."""
+    cores = os.cpu_count()
+    intra_op_threads = sorted({1, 2, max(1, cores // 2), cores})
+    worker_counts = [workers] if workers else sorted({1, 2, 4} & set(range(1, cores + 1)))
+
+    rows = []
+    for intra, inter, onednn, workers in itertools.product(
+            intra_op_threads, INTER_OP_THREADS, [True, False], worker_counts):
+        if intra * workers > cores:
+            continue  # oversubscribed
+        setting = {'intra_op_threads': intra, 'inter_op_threads': inter, 'onednn': onednn}
+        print(f'Benchmarking {setting} with {workers} workers')
+        results = run_setting(setting, workers, glyphs_count)
+        latency = np.mean([result['latency'] for result in results])
+        for batch_size in BATCH_SIZES:
+            rows.append({**setting, 'workers': workers, 'batch_size': batch_size,
+                         'throughput (glyphs/s)': sum(result['throughputs'][str(batch_size)]
+                                                      for result in results),
+                         'latency, single glyph (ms)': latency * 1000})
+
+    df = pd.DataFrame(rows).sort_values('throughput (glyphs/s)', ascending=False)
+    print(df.to_string(index=False))
+    df.to_csv(f'{consts.EVALUATION_RESULTS_DIR}\\tf_autotune.csv', index=False)
+
+    best = df.iloc[0]
+    profile = {'intra_op_threads': int(best['intra_op_threads']),
+               'inter_op_threads': int(best['inter_op_threads']),
+               'onednn': bool(best['onednn']),
+               'batch_size': int(best['batch_size']),
+               'workers': int(best['workers'])}
+    with open(consts.TF_PROFILE_PATH, 'w') as f:
+        json.dump(profile, f, indent=4)
+    print(f'Saved the best profile to {consts.TF_PROFILE_PATH}: {profile}')
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune the CPU threading settings.')
+    parser.add_argument('--glyphs', type=int, default=1024,
+                        help='number of glyphs predicted for measuring throughput')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='the number of concurrent workers to tune for (by default, '
+                             '1, 2 and 4 are compared)')
+    parser.add_argument('--benchmark', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.glyphs)
+    else:
+        autotune(args.glyphs, args.workers)
+
+
+if __name__ == '__main__':
+    main()
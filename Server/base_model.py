@@ -2,7 +2,10 @@
 from abc import ABCMeta, abstractmethod
 from functools import wraps
 
-from tensorflow.keras.models import Sequential
+from tensorflow.keras.models import Sequential, Model
+from tensorflow.keras.layers import Conv2D, SeparableConv2D, Dense
+
+from model_errors import ModelError, ModelNotLoadedError, ModelNotBuiltError
 
 
 class ABCSingletonMeta(ABCMeta):
@@ -26,6 +29,20 @@ class BaseTFModel(metaclass=ABCSingletonMeta):
         self._model_loaded = False
         self._model_built = False
 
+    @property
+    def model_loaded(self) -> bool:
+        """Whether the model is loaded (or trained) and ready for predictions."""
+        return self._model_loaded
+
+    def count_params(self) -> int:
+        """Get the number of parameters (weights) of the model."""
+        return self._model.count_params()
+
+    def count_flops(self) -> int:
+        """Get the floating point operations of predicting a single image
+        (see `count_flops`)."""
+        return count_flops(self._model)
+
     @abstractmethod
     def build_model(self):
         ...
@@ -47,16 +64,32 @@ class BaseTFModel(metaclass=ABCSingletonMeta):
         ...
 
 
-class ModelError(Exception):
-    """Base model exception"""
-
-
-class ModelNotLoadedError(ModelError):
-    """Exception raised when trying to predict on an unloaded model."""
-
-
-class ModelNotBuiltError(ModelError):
-    """Exception raised when trying to train an un built model."""
+def count_flops(model: Model) -> int:
+    """
+    Count the floating point operations of the convolutions and the dense
+    layers of the model for a single image (a multiply-add is two operations).
+    The other layers (pooling, upsampling, activations) are negligible.
+    """
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, Model):
+            flops += count_flops(layer)
+        elif isinstance(layer, SeparableConv2D):
+            height, width = layer.output_shape[1:3]
+            kernel_h, kernel_w, channels, multiplier = layer.depthwise_kernel.shape
+            flops += 2 * height * width * channels * multiplier * (kernel_h * kernel_w + layer.filters)
+        elif isinstance(layer, Conv2D):
+            height, width = layer.output_shape[1:3]
+            flops += 2 * height * width * layer.kernel.shape.num_elements()
+        elif isinstance(layer, Dense):
+            flops += 2 * layer.kernel.shape.num_elements()
+    return flops
+
+
+def new_instance(cls: type, *args, **kwargs):
+    """Create a new instance of a model class, bypassing the singleton (e.g. to
+    load another version of the model while the current one is in use)."""
+    return type.__call__(cls, *args, **kwargs)
 
 
 def singleton(cls):
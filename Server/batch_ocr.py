@@ -0,0 +1,201 @@
+"""
+Module for extracting the text from many images at once, outside of the
+server - e.g. for backfilling an archive. The images are spread over a
+pool of processes, each of which loads the models once, and the results
+are written to a JSONL file as soon as they are ready, so an interrupted
+run can be resumed without processing the same images again.
+
+Usage: python batch_ocr.py INPUT OUTPUT [--workers N] [--threads N] [--tier full]
+                          [--engine character]
+  INPUT is a directory of images (searched recursively), a single image, or
+  a manifest - a text file listing the paths of the images, one per line.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import consts
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff')
+REPORT_EVERY = 10  # images between throughput reports
+
+
+def find_images(path: str) -> list[str]:
+    """Get the (absolute) paths of the images in the directory, in the
+    manifest, or of the single image."""
+    if os.path.isdir(path):
+        return sorted(os.path.abspath(os.path.join(root, name))
+                      for root, _, names in os.walk(path) for name in names
+                      if name.lower().endswith(IMAGE_EXTENSIONS))
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        return [os.path.abspath(path)]
+    # a manifest, its relative paths are relative to the manifest itself
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.abspath(os.path.join(os.path.dirname(path), line)) for line in lines if line]
+
+
+def load_image(path: str) -> np.ndarray:
+    """Load the image as a 2D grayscale array (the same as the server decodes it)."""
+    with Image.open(path) as pil_image:
+        return np.asarray(ImageOps.exif_transpose(pil_image.convert('L')))
+
+
+def processed_paths(output_path: str) -> set[str]:
+    """Get the paths of the images already processed successfully, according
+    to the results written to the output file (by a previous run)."""
+    if not os.path.exists(output_path):
+        return set()
+    paths = set()
+    with open(output_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut off when the run was interrupted
+            if 'text' in result:
+                paths.add(result['path'])
+    return paths
+
+
+def drop_partial_line(output_path: str) -> None:
+    """Cut off the last line of the output file if it is incomplete (the
+    run was interrupted while writing it), so the next result appended to
+    the file does not continue it."""
+    with open(output_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        # search backwards for the last newline, a block at a time
+        while position > 0:
+            block_start = max(0, position - 4096)
+            f.seek(block_start)
+            block = f.read(position - block_start)
+            if (newline := block.rfind(b'\n')) != -1:
+                f.truncate(block_start + newline + 1)
+                return
+            position = block_start
+        f.truncate(0)
+
+
+def _init_worker(threads: int) -> None:
+    """Load the models once per worker process (importing `ocr` loads them),
+    with `threads` TensorFlow threads - the CPUs are divided between the
+    workers, instead of every worker running a thread per CPU."""
+    global ocr, preprocessing
+    if not consts.INFERENCE_DAEMON_ENABLED:
+        import config_tf
+        import tensorflow as tf
+        # replacing the threads of the profile (see `config_tf.py`), tuned for the server
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    import ocr
+    import preprocessing
+
+
+def _process_image(task: tuple[str, str, str]) -> dict:
+    path, tier, engine = task
+    start = time.perf_counter()
+    try:
+        preprocessed = preprocessing.preprocess_image(load_image(path))
+        text = ocr.text_from_image(preprocessed, tier, engine)
+    except Exception as e:  # a single bad image should not stop the whole run
+        return {'path': path, 'error': f'{type(e).__name__}: {e}'}
+    return {'path': path, 'text': text, 'seconds': time.perf_counter() - start}
+
+
+class OCRPipeline:
+    """
+    Extracts the text from many images, on a pool of worker processes, each
+    with its own copy of the models, and `threads` TensorFlow threads (by
+    default, the CPUs divided between the workers).
+    """
+
+    def __init__(self, workers: Optional[int] = None, tier: str = consts.DEFAULT_MODEL_TIER,
+                 engine: str = consts.DEFAULT_RECOGNITION_ENGINE, threads: Optional[int] = None):
+        self._workers = workers or os.cpu_count()
+        self._threads = threads or max(1, os.cpu_count() // self._workers)
+        self._tier = tier
+        self._engine = engine
+
+    def run_many(self, paths: Iterable[str], output_path: Optional[str] = None) -> Iterator[dict]:
+        """
+        Extract the text from the images, yielding the result of every image
+        as soon as it is ready (in no particular order): `{'path', 'text',
+        'seconds'}`, or `{'path', 'error'}` if the image failed.
+
+        Args:
+            paths (Iterable[str]): The paths of the images.
+            output_path (Optional[str]): A JSONL file, which every result is
+              appended to. Images whose results are already in the file are
+              skipped (failed images are tried again), and a line cut off
+              by an interrupted run is removed.
+        Yields:
+            dict: The result of every image.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        skipped = processed_paths(output_path) if output_path else set()
+        paths = [path for path in paths if path not in skipped]
+        if skipped:
+            print(f'Skipping {len(skipped)} images already processed')
+        if not paths:
+            return
+
+        if output_path and os.path.exists(output_path):
+            drop_partial_line(output_path)
+        output = open(output_path, 'a') if output_path else None
+        start = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(min(self._workers, len(paths)), initializer=_init_worker,
+                                     initargs=(self._threads,)) as pool:
+                futures = [pool.submit(_process_image, (path, self._tier, self._engine))
+                           for path in paths]
+                try:
+                    for done, future in enumerate(as_completed(futures), 1):
+                        result = future.result()
+                        if output:
+                            output.write(json.dumps(result) + '\n')
+                            output.flush()
+                        if done % REPORT_EVERY == 0 or done == len(paths):
+                            elapsed = time.perf_counter() - start
+                            print(f'{done}/{len(paths)} images, {done / elapsed:.2f} images/s')
+                        yield result
+                finally:
+                    # when stopped early, do not wait for the rest of the images
+                    for future in futures:
+                        future.cancel()
+        finally:
+            if output:
+                output.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract the text from many images.')
+    parser.add_argument('input', help='a directory of images, an image or a manifest file')
+    parser.add_argument('output', help='the JSONL file the results are appended to')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (by default, the number of CPUs)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='TensorFlow threads of every worker (by default, the number of '
+                             'CPUs divided between the workers)')
+    parser.add_argument('--tier', default=consts.DEFAULT_MODEL_TIER, choices=consts.MODEL_TIERS)
+    parser.add_argument('--engine', default=consts.DEFAULT_RECOGNITION_ENGINE,
+                        choices=consts.RECOGNITION_ENGINES)
+    args = parser.parse_args()
+
+    pipeline = OCRPipeline(args.workers, args.tier, args.engine, args.threads)
+    failed = 0
+    for result in pipeline.run_many(find_images(args.input), args.output):
+        if 'error' in result:
+            failed += 1
+            print(f'Failed {result["path"]}: {result["error"]}')
+    print(f'Done, {failed} images failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Module for comparing the denoising backends (see `denoising.py`): the
+accuracy of `OCRModel` on the test set after denoising the glyphs with
+every backend (the slim autoencoder only if it was trained) and without
+denoising at all, on the clean glyphs and on glyphs with added noise, and
+the CPU latency of every backend per glyph.
+The report is printed and saved as a CSV file in the evaluation results.
+
+Usage: python benchmark_denoisers.py
+"""
+import os
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+import config_tf
+import consts
+from denoising import MorphologicalDenoiser
+from model_evaluator import load_labeled_images
+from noise_remover import DenoisingAutoencoder
+from ocr_model import OCRModel
+from slim_noise_remover import SlimDenoisingAutoencoder
+
+LATENCY_REPEATS = 50
+THROUGHPUT_BATCH_SIZE = 256
+
+
+def measure_latency(denoiser, imgs: np.ndarray) -> tuple[float, float]:
+    """
+    Measure the latency of denoising a single glyph, and the time per glyph
+    when denoising a large batch, both in milliseconds.
+    """
+    denoiser.denoise_batch(imgs[:1])  # warm-up
+    start = time.perf_counter()
+    for img in imgs[:LATENCY_REPEATS]:
+        denoiser.denoise_batch(img[np.newaxis])
+    single = (time.perf_counter() - start) / min(LATENCY_REPEATS, len(imgs))
+
+    batch = imgs[:THROUGHPUT_BATCH_SIZE]
+    start = time.perf_counter()
+    denoiser.denoise_batch(batch)
+    batched = (time.perf_counter() - start) / len(batch)
+    return single * 1000, batched * 1000
+
+
+def benchmark(model: OCRModel, denoisers: dict[str, Optional[object]]) -> pd.DataFrame:
+    """Compare the accuracy and latency of the denoisers (None - no denoising)."""
+    imgs, labels = load_labeled_images(consts.TEST_CATEGORICAL_PATH)
+    imgs = imgs.reshape((len(imgs),) + consts.IMAGE_SIZE)
+    noisy = DenoisingAutoencoder._add_gaussian_noise(imgs)
+
+    rows = []
+    for name, denoiser in denoisers.items():
+        row = {'denoiser': name}
+        for condition, condition_imgs in [('clean', imgs), ('noisy', noisy)]:
+            denoised = condition_imgs if denoiser is None else denoiser.denoise_batch(condition_imgs)
+            predictions = model.predict_batch(denoised)
+            row[f'accuracy, {condition} (%)'] = np.mean(np.argmax(predictions, axis=1) == labels) * 100
+        if denoiser is not None:
+            single, batched = measure_latency(denoiser, imgs)
+            row['latency, single glyph (ms)'] = single
+            row[f'latency per glyph, batch of {THROUGHPUT_BATCH_SIZE} (ms)'] = batched
+        rows.append(row)
+    df = pd.DataFrame(rows).set_index('denoiser')
+    print(df.T)
+    df.to_csv(f'{consts.EVALUATION_RESULTS_DIR}\\denoisers_report.csv')
+    return df
+
+
+def main():
+    model = OCRModel()
+    model.load_model()
+    autoencoder = DenoisingAutoencoder()
+    autoencoder.load_model()
+    denoisers = {'none': None, 'autoencoder': autoencoder, 'classical': MorphologicalDenoiser()}
+    if os.path.exists(SlimDenoisingAutoencoder.MODEL_NAME):
+        denoisers['slim'] = SlimDenoisingAutoencoder()
+        denoisers['slim'].load_model()
+    benchmark(model, denoisers)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,162 +2,246 @@
 Module used for getting the letters bounding rects.
 """
 from collections import namedtuple
+from typing import Optional, Union
 
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
 
+import consts
+from packed_image import (PackedImage, as_packed, column_projection, crop, erode,
+                          row_projection, unpack)
+
 Rect = namedtuple('Rect', 'x y w h')
+# the rects of a whole page as a table - a record per character, with the
+# index of its row of text (in the segmented image) and of its word
+RECT_DTYPE = np.dtype([('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+                       ('row', np.int32), ('word', np.int32)])
+
+
+def rects_to_table(rects: list[Rect], row: int = 0, word: int = 0) -> np.ndarray:
+    """Get a table of the rects (see `RECT_DTYPE`), all in the given row and word."""
+    return np.array([(*rect, row, word) for rect in rects], dtype=RECT_DTYPE)
+
+
+def table_to_rects(table: np.ndarray) -> list[Rect]:
+    """Get the rects of the table as a list of `Rect`."""
+    return [Rect(*fields) for fields in table[['x', 'y', 'w', 'h']].tolist()]
+
+
+def word_starts(table: np.ndarray) -> np.ndarray:
+    """Get the indices of the first rect of every word in the table."""
+    if not len(table):
+        return np.empty(0, int)
+    return np.concatenate(([0], np.flatnonzero(np.diff(table['word'])) + 1))
+
+
+def split_words(table: np.ndarray) -> list[np.ndarray]:
+    """Split the table into the tables of its words (views of the same table)."""
+    if not len(table):
+        return []
+    return np.split(table, word_starts(table)[1:])
+
+
+def table_to_words(table: np.ndarray) -> list[list[Rect]]:
+    """Get the words of the table, as lists of `Rect`."""
+    return [table_to_rects(word) for word in split_words(table)]
+
+
+def median_width(widths: np.ndarray) -> float:
+    """Get the (upper) median of the widths, in linear time."""
+    middle = len(widths) // 2
+    return np.partition(widths, middle)[middle]
 
 
 def get_median_width(rects: list[Rect]) -> float:
     """Get the median of the widths."""
-    widths = [rect.w for rect in rects]
-    widths.sort()
-    median_width = widths[int(len(widths) / 2)]
-    return median_width
+    return median_width(np.array([rect.w for rect in rects]))
+
+
+def word_ids(table: np.ndarray) -> np.ndarray:
+    """
+    Get the index of the word of every rect in the (sorted) table, by
+    detecting spaces between rects, which is done by measuring the
+    horizontal distance between adjacent rects, and comparing it to the
+    median width of a rect.
+    """
+    if len(table) <= 1:
+        return np.zeros(len(table), np.int32)
+    median = median_width(table['w'])
+    distances = table['x'][1:] - (table['x'][:-1] + table['w'][:-1])
+    spaces = (distances > median / 1.5) | (distances < -2 * median)
+    return np.concatenate(([0], np.cumsum(spaces))).astype(np.int32)
 
 
 def divide_into_words(rects: list[Rect]) -> list[list[Rect]]:
     """
-    Divide the rects into words, by detecting spaces between rects, which
-    is done by measuring the horizontal distance between adjacent rects,
-    and comparing it to the median width of a rect.
+    Divide the rects into words, by detecting spaces between rects (see
+    `word_ids`).
     """
     if len(rects) <= 1:
         return [rects]
+    table = rects_to_table(rects)
+    table['word'] = word_ids(table)
+    return table_to_words(table)
 
-    median_width = get_median_width(rects)
-    words, word = [], []
-    horizontal_distance = lambda r1, r2: r2.x - (r1.x + r1.w)
 
-    for rect1, rect2 in zip(rects[:-1], rects[1:]):
-        word.append(rect1)
-        if horizontal_distance(rect1, rect2) > median_width / 1.5 \
-                or horizontal_distance(rect1, rect2) < -2 * median_width:
-            words.append(word)
-            word = []
-    words.append(word + [rect2])
-    return words
-
-
-def black_in_row(img: np.ndarray, row: int, from_col: int, to_col: int) -> bool:
+def split_lines(table: np.ndarray) -> list[np.ndarray]:
     """
-    Returns whether there is a black pixel in row `row` from column
-    `from_col` to column `to_col`.
+    Split the (sorted) table into the tables of its lines of text: a word
+    starts a new line if it does not overlap vertically with the line
+    before it (the same as `group_words_into_lines`).
     """
-    for pix in img[row, from_col:to_col]:
-        if pix == 0:
-            return True
-    return False
-
-
-def black_in_column(img: np.ndarray, from_row: int, to_row: int, col: int) -> bool:
+    if not len(table):
+        return []
+    starts = word_starts(table)
+    tops = np.minimum.reduceat(table['y'], starts).tolist()
+    bottoms = np.maximum.reduceat(table['y'] + table['h'], starts).tolist()
+    line_starts = []
+    line_top = line_bottom = 0
+    for start, top, bottom in zip(starts.tolist(), tops, bottoms):
+        if not line_starts or top >= line_bottom or bottom <= line_top:
+            line_starts.append(start)
+            line_top, line_bottom = top, bottom
+        line_top, line_bottom = min(line_top, top), max(line_bottom, bottom)
+    return np.split(table, line_starts[1:])
+
+
+def group_words_into_lines(words: list[list[Rect]]) -> list[list[list[Rect]]]:
     """
-    Returns whether there is a black pixel in column `col` from row
-    `from_row` to row `to_row`.
+    Group the (sorted) words into lines of text: a word starts a new line
+    if it does not overlap vertically with the line before it.
     """
-    for row in range(from_row, to_row):
-        if img[row, col] == 0:
-            return True
-    return False
-
-
-def get_rows(img: np.ndarray) -> list[tuple[int, int]]:
+    lines = []
+    line_top = line_bottom = 0
+    for word in words:
+        if not word:
+            continue
+        top = min(rect.y for rect in word)
+        bottom = max(rect.y + rect.h for rect in word)
+        if not lines or top >= line_bottom or bottom <= line_top:
+            lines.append([])
+            line_top, line_bottom = top, bottom
+        lines[-1].append(word)
+        line_top, line_bottom = min(line_top, top), max(line_bottom, bottom)
+    return lines
+
+
+def ink_runs(has_ink: np.ndarray) -> list[tuple[int, int]]:
+    """Get the (start, end) of the runs of lines (rows or columns) with ink."""
+    edges = np.flatnonzero(np.diff(has_ink.astype(np.int8), prepend=0, append=0))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def get_rows(img: Union[np.ndarray, PackedImage]) -> list[tuple[int, int]]:
     """
     Get the borders of the rows in the text.
 
     Args:
-        img (np.ndarray): The source image.
+        img (Union[np.ndarray, PackedImage]): The source image (thresholded,
+          or packed - see `packed_image.py`).
 
     Returns:
         list[tuple[int, int]]: A list of tuples with two values,
           representing the first index where the row starts, and the
           last index where the row ends.
     """
-    rows = []
-    h, w = img.shape
-    row = 0
-    while row < h:
-        # skip all of the empty rows
-        while row < h and not black_in_row(img, row, 0, w):
-            row += 1
-        # loop until the row does not have a black pixel in it anymore
-        start = row
-        while row < h and black_in_row(img, row, 0, w):
-            row += 1
-        if start != h:
-            rows.append((start, row))
-    return rows
-
-
-def rects_from_row(img: np.ndarray, start_row: int, end_row: int) -> list[Rect]:
+    return ink_runs(row_projection(as_packed(img)))
+
+
+def rects_from_row(img: Union[np.ndarray, PackedImage], start_row: int,
+                   end_row: int) -> list[Rect]:
     """Get a list of the rects enclosing the letters from all sides,
-     within a certain row."""
+     within a certain row. Rects smaller than `consts.MIN_LETTER_AREA_RATIO`
+     of the square of the height of the row are dropped as noise, so the
+     same characters are kept at any resolution."""
+    page = as_packed(img)
+    min_area = consts.MIN_LETTER_AREA_RATIO * (end_row - start_row) ** 2
     rects = []
-    h, w = img.shape
-    col = 0
-    while col < w:
-        # skip all of the empty columns
-        while col < w and not black_in_column(img, start_row, end_row, col):
-            col += 1
-
-        # mark the beginning of the letter, and loop until the column does
-        # not have a black pixel in it anymore
-        start_col = col
-        while col < w and black_in_column(img, start_row, end_row, col):
-            col += 1
-
-        # find the top and bottom of the letter
-        top = start_row
-        while top < h and not black_in_row(img, top, start_col, col):
-            top += 1
-        bottom = end_row - 1
-        while bottom > 0 and not black_in_row(img, bottom, start_col, col):
-            bottom -= 1
-
-        letter_w = col - start_col
+    for start_col, end_col in ink_runs(column_projection(page, start_row, end_row)):
+        # find the top and bottom of the letter, within the row
+        letter = crop(page, (start_col, start_row, end_col - start_col, end_row - start_row))
+        rows = np.flatnonzero(row_projection(letter))
+        top, bottom = start_row + int(rows[0]), start_row + int(rows[-1])
+
+        letter_w = end_col - start_col
         letter_h = bottom - top
-        if start_col != w and letter_w * letter_h > 200:
+        if letter_w * letter_h > min_area:
             rects.append(Rect(start_col, top, letter_w, letter_h))
     return rects
 
 
-def get_rects_not_seperated(img: np.ndarray) -> list[Rect]:
-    """Loop through every row, and obtain all of the rectangles in the row."""
-    h, w = img.shape
-    rows = get_rows(img)
-    rects = []
-    for start, end in rows:
-        if end - start > 0.05 * h:  # if the row is not tiny (probably noise)
-            rects += rects_from_row(img, start, end)
-    return rects
+def get_rects_table(img: Union[np.ndarray, PackedImage],
+                    page_height: Optional[int] = None) -> np.ndarray:
+    """Loop through every row, and obtain all of the rectangles in the row,
+    as a table (see `RECT_DTYPE`). Rows are compared to the height of the
+    page (if the image is only a part of the page), to filter out noise."""
+    page = as_packed(img)
+    h, w = page.shape
+    page_height = page_height or h
+    rows = get_rows(page)
+    records = []
+    for row, (start, end) in enumerate(rows):
+        if end - start > 0.05 * page_height:  # if the row is not tiny (probably noise)
+            records += [(*rect, row, 0) for rect in rects_from_row(page, start, end)]
+    return np.array(records, dtype=RECT_DTYPE)
+
+
+def get_rects_not_seperated(img: Union[np.ndarray, PackedImage],
+                            page_height: Optional[int] = None) -> list[Rect]:
+    """Loop through every row, and obtain all of the rectangles in the row.
+    Rows are compared to the height of the page (if the image is only a
+    part of the page), to filter out noise."""
+    return table_to_rects(get_rects_table(img, page_height))
+
+
+def get_letters_bounding_rects_table(img: Union[np.ndarray, PackedImage],
+                                     page_height: Optional[int] = None) -> np.ndarray:
+    """
+    Get the enclosing rects of the letters in the image, in a sorted order,
+    as a table (see `RECT_DTYPE`), with the index of the word of every rect.
 
+    Args:
+        img (Union[np.ndarray, PackedImage]): The source image (thresholded,
+          or packed - see `packed_image.py`).
+        page_height (Optional[int]): The height of the whole page, in case
+          the image is only a block of the page.
 
-def get_letters_bounding_rects_as_words(img: np.ndarray) -> list[list[Rect]]:
+    Returns:
+       np.ndarray: The table of the bounding rectangles of every character.
+    """
+    # thin the strokes, the same as blurring the image and keeping only the
+    # pixels that are still black
+    page = erode(as_packed(img))
+    # obtain the enclosing rectangles
+    table = get_rects_table(page, page_height)
+
+    # ---------------- FOR DEBUGGING ---------------
+    if consts.DEBUG_SHOW_RECTS:
+        img2 = cv2.cvtColor(unpack(page), cv2.COLOR_GRAY2RGB)
+        for i in table_to_rects(table):
+            img2 = cv2.rectangle(img2, (i.x, i.y), (i.x + i.w, i.y + i.h), (0, 255, 0), 2)
+        plt.imshow(img2)
+        plt.show()
+    # ----------------------------------------------
+    table['word'] = word_ids(table)
+    return table
+
+
+def get_letters_bounding_rects_as_words(img: Union[np.ndarray, PackedImage],
+                                        page_height: Optional[int] = None) -> list[list[Rect]]:
     """
     Get the enclosing rects of the letters in the image, in a sorted order,
     as a list of lists of rects.
 
     Args:
-        img (np.ndarray): The source image.
+        img (Union[np.ndarray, PackedImage]): The source image (thresholded,
+          or packed - see `packed_image.py`).
+        page_height (Optional[int]): The height of the whole page, in case
+          the image is only a block of the page.
 
     Returns:
        list[list[Rect]]: A list of words, where a word is a list of the
          bounding rectangles of every character.
     """
-    img = img.copy()  # np arrays are mutable and are passed by reference
-    # blur the image
-    img = cv2.GaussianBlur(img, (3, 3), 0)
-    # obtain the enclosing rectangles
-    rects = get_rects_not_seperated(img)
-
-    # ---------------- FOR DEBUGGING ---------------
-    img2 = cv2.cvtColor(img.copy(), cv2.COLOR_GRAY2RGB)
-    for i in rects:
-        img2 = cv2.rectangle(img2, (i.x, i.y), (i.x + i.w, i.y + i.h), (0, 255, 0), 2)
-    plt.imshow(img2)
-    plt.show()
-    # ----------------------------------------------
-    words = divide_into_words(rects)
-    return words
+    return table_to_words(get_letters_bounding_rects_table(img, page_height))
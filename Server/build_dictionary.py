@@ -0,0 +1,38 @@
+"""
+Module used to build the binary word-frequency dictionary used for
+spellchecking (see `frequency_dictionary.py`), from the English
+dictionary of pyspellchecker. Run it once (e.g. when deploying the
+server), and every worker memory-maps the built file.
+
+Usage: python build_dictionary.py [--output PATH]
+"""
+import argparse
+import os
+import time
+
+from spellchecker import SpellChecker
+
+import consts
+from frequency_dictionary import build_dictionary, FrequencyDictionary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the binary spellchecking dictionary.')
+    parser.add_argument('--output', default=consts.DICTIONARY_PATH,
+                        help='path of the built dictionary file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frequencies = dict(SpellChecker().word_frequency.dictionary)
+    print(f'Loaded pyspellchecker\'s dictionary in {time.perf_counter() - start:.3f}s')
+
+    build_dictionary(frequencies, args.output)
+    start = time.perf_counter()
+    dictionary = FrequencyDictionary(args.output)
+    print(f'Built {args.output}: {len(dictionary)} words, '
+          f'{os.path.getsize(args.output) / 2**20:.1f} MB, '
+          f'mapped in {time.perf_counter() - start:.4f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Module used to calibrate the confidence threshold of the cascade mode
+(see `cascade.py`) on a labeled set of images.
+Prints the threshold that skips the denoiser for the most glyphs while
+still reaching the target accuracy, to be set as `CASCADE_THRESHOLD` in
+`consts.py`.
+
+Usage: python calibrate_cascade.py [--target-accuracy 0.92] [--folder-path PATH]
+"""
+import argparse
+
+import numpy as np
+
+import config_tf
+import consts
+from cascade import calibrate_threshold, prediction_confidence
+from model_evaluator import load_labeled_images
+from ocr_model import OCRModel
+from noise_remover import DenoisingAutoencoder
+
+REPORTED_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the cascade threshold.')
+    parser.add_argument('--folder-path', default=consts.VALIDATION_CATEGORICAL_PATH,
+                        help='folder of labeled images (a sub-folder per class)')
+    parser.add_argument('--target-accuracy', type=float, default=None,
+                        help='minimal accuracy, defaults to the accuracy when '
+                             'de-noising every glyph')
+    parser.add_argument('--measure', default=consts.CASCADE_CONFIDENCE,
+                        choices=['probability', 'margin'])
+    args = parser.parse_args()
+
+    model = OCRModel()
+    denoiser = DenoisingAutoencoder()
+    model.load_model()
+    denoiser.load_model()
+
+    imgs, labels = load_labeled_images(args.folder_path)
+    raw_predictions = model.predict_batch(imgs)
+    denoised_predictions = model.predict_batch(denoiser.denoise_batch(imgs))
+
+    denoised_accuracy = np.mean(np.argmax(denoised_predictions, axis=1) == labels)
+    target_accuracy = args.target_accuracy or denoised_accuracy
+    print(f'Accuracy when de-noising every glyph: {denoised_accuracy * 100:.2f}%')
+
+    confidence = prediction_confidence(raw_predictions, args.measure)
+    raw_correct = np.argmax(raw_predictions, axis=1) == labels
+    denoised_correct = np.argmax(denoised_predictions, axis=1) == labels
+    print(f'{"threshold":>10} {"skipped":>10} {"accuracy":>10}')
+    for threshold in REPORTED_THRESHOLDS:
+        skipped = confidence >= threshold
+        accuracy = np.mean(np.where(skipped, raw_correct, denoised_correct))
+        print(f'{threshold:>10.2f} {skipped.mean() * 100:>9.2f}% {accuracy * 100:>9.2f}%')
+
+    threshold, skipped, accuracy = calibrate_threshold(
+        raw_predictions, denoised_predictions, labels, target_accuracy, args.measure
+    )
+    print(f'Target accuracy {target_accuracy * 100:.2f}%: CASCADE_THRESHOLD = {threshold:.4f} '
+          f'({skipped * 100:.2f}% of glyphs skip the denoiser, '
+          f'accuracy is {accuracy * 100:.2f}%)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Module used to calibrate the sharpness threshold of the triage (see
+`triage.py`) on two folders of photos of pages - ones that can be read and
+ones too blurred to be read.
+Prints the threshold that rejects the most blurred photos while rejecting
+at most the given fraction of the sharp ones, to be set as
+`TRIAGE_MIN_SHARPNESS` in `consts.py`.
+
+Usage: python calibrate_triage.py SHARP_FOLDER BLURRY_FOLDER [--max-rejected 0.01]
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from batch_ocr import load_image
+from triage import EMPTY, calibrate_sharpness, measure
+
+REPORTED_THRESHOLDS = [0.05, 0.08, 0.1, 0.12, 0.15, 0.2, 0.25]
+
+
+def measure_folder(folder_path: str) -> np.ndarray:
+    """Measure the sharpness of every photo in the folder (skipping the
+    files which are not images, and the photos without ink)."""
+    sharpness = []
+    for path in sorted(glob.glob(os.path.join(folder_path, '*'))):
+        try:
+            result = measure(load_image(path))
+        except OSError:
+            continue
+        if result.route != EMPTY:
+            sharpness.append(result.sharpness)
+    print(f'Measured {len(sharpness)} photos in {folder_path}')
+    return np.array(sharpness)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the triage sharpness threshold.')
+    parser.add_argument('sharp_folder', help='folder of photos which can be read')
+    parser.add_argument('blurry_folder', help='folder of photos too blurred to be read')
+    parser.add_argument('--max-rejected', type=float, default=0.01,
+                        help='the fraction of the sharp photos that may be rejected')
+    args = parser.parse_args()
+
+    sharp = measure_folder(args.sharp_folder)
+    blurry = measure_folder(args.blurry_folder)
+    if not len(sharp) or not len(blurry):
+        print('Both folders must have photos with text.')
+        return
+
+    print(f'{"threshold":>10} {"sharp rejected":>15} {"blurry rejected":>16}')
+    for threshold in REPORTED_THRESHOLDS:
+        print(f'{threshold:>10.2f} {np.mean(sharp < threshold) * 100:>14.2f}% '
+              f'{np.mean(blurry < threshold) * 100:>15.2f}%')
+
+    threshold, sharp_rejected, blurry_rejected = calibrate_sharpness(sharp, blurry,
+                                                                     args.max_rejected)
+    print(f'TRIAGE_MIN_SHARPNESS = {threshold:.4f} ({sharp_rejected * 100:.2f}% of the sharp '
+          f'photos and {blurry_rejected * 100:.2f}% of the blurred photos are rejected)')
+
+
+if __name__ == '__main__':
+    main()
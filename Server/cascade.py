@@ -0,0 +1,98 @@
+"""
+Module for the confidence-gated cascade of the models: the raw glyphs
+are classified first, and only the glyphs the classifier is not confident
+about are passed through the (much more expensive) denoising autoencoder
+and classified again.
+"""
+from typing import Callable
+
+import numpy as np
+
+import consts
+import metrics
+
+
+def prediction_confidence(predictions: np.ndarray,
+                          measure: str = consts.CASCADE_CONFIDENCE) -> np.ndarray:
+    """
+    Get the confidence of every prediction - either the top-1 probability,
+    or the margin between the top-1 and top-2 probabilities.
+    """
+    if measure == 'probability':
+        return predictions.max(axis=1)
+    if measure == 'margin':
+        top2 = np.sort(predictions, axis=1)[:, -2:]
+        return top2[:, 1] - top2[:, 0]
+    raise ValueError("Confidence measure must be 'probability' or 'margin'")
+
+
+def cascade_predict(glyphs: np.ndarray,
+                    classify: Callable[[np.ndarray], np.ndarray],
+                    denoise: Callable[[np.ndarray], np.ndarray],
+                    threshold: float = consts.CASCADE_THRESHOLD,
+                    measure: str = consts.CASCADE_CONFIDENCE) -> np.ndarray:
+    """
+    Predict the probabilities of a batch of glyphs, de-noising only the
+    glyphs whose raw prediction is less confident than the threshold.
+
+    Args:
+        glyphs (np.ndarray): The batch of normalized glyphs.
+        classify (Callable[[np.ndarray], np.ndarray]): Predicts a batch of glyphs.
+        denoise (Callable[[np.ndarray], np.ndarray]): De-noises a batch of glyphs.
+        threshold (float): The minimal confidence for skipping the denoiser.
+        measure (str): The confidence measure ('probability' or 'margin').
+
+    Returns:
+        np.ndarray: The predictions over the glyphs.
+    """
+    predictions = np.array(classify(glyphs))
+    uncertain = prediction_confidence(predictions, measure) < threshold
+    if uncertain.any():
+        predictions[uncertain] = classify(denoise(glyphs[uncertain]))
+
+    skipped = len(glyphs) - int(uncertain.sum())
+    metrics.increment('cascade.glyphs', len(glyphs))
+    metrics.increment('cascade.skipped_denoiser', skipped)
+    print(f'Cascade: {skipped} of {len(glyphs)} glyphs skipped the denoiser')
+    return predictions
+
+
+def calibrate_threshold(raw_predictions: np.ndarray, denoised_predictions: np.ndarray,
+                        labels: np.ndarray, target_accuracy: float,
+                        measure: str = consts.CASCADE_CONFIDENCE) -> tuple[float, float, float]:
+    """
+    Find the lowest threshold (the one that skips the denoiser for the
+    most glyphs) for which the cascade still reaches the target accuracy.
+
+    Args:
+        raw_predictions (np.ndarray): The predictions over the raw glyphs.
+        denoised_predictions (np.ndarray): The predictions over the de-noised glyphs.
+        labels (np.ndarray): The true class index of every glyph.
+        target_accuracy (float): The minimal accuracy (between 0.0 and 1.0).
+        measure (str): The confidence measure ('probability' or 'margin').
+
+    Returns:
+        tuple[float, float, float]: The threshold, the fraction of glyphs
+          that skip the denoiser and the accuracy of the cascade.
+    """
+    confidence = prediction_confidence(raw_predictions, measure)
+    raw_correct = np.argmax(raw_predictions, axis=1) == labels
+    denoised_correct = np.argmax(denoised_predictions, axis=1) == labels
+
+    # skipping the denoiser for the k most confident glyphs
+    order = np.argsort(-confidence, kind='stable')
+    sorted_confidence = confidence[order]
+    raw_correct_skipped = np.concatenate(([0], np.cumsum(raw_correct[order])))
+    denoised_correct_skipped = np.concatenate(([0], np.cumsum(denoised_correct[order])))
+    accuracy = (raw_correct_skipped + denoised_correct.sum() - denoised_correct_skipped) \
+        / len(labels)
+
+    # a threshold can only separate glyphs with different confidences
+    valid = np.ones(len(labels) + 1, dtype=bool)
+    valid[1:-1] = sorted_confidence[:-1] > sorted_confidence[1:]
+    candidates = np.flatnonzero(valid & (accuracy >= target_accuracy))
+    if not len(candidates):
+        return np.inf, 0.0, float(accuracy[0])
+    k = candidates[-1]
+    threshold = float(sorted_confidence[k - 1]) if k else np.inf
+    return threshold, float(k / len(labels)), float(accuracy[k])
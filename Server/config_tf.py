@@ -1,9 +1,25 @@
 """
-Module used to config TensorFlow to run properly with a GPU.
+Module used to config TensorFlow to run properly with a GPU, and with the
+CPU threading settings of the profile found by `autotune_tf.py` (if any).
 To use, just type `import config_tf`.
 """
+import os
+
+# the profile of the CPU threading settings, chosen by `autotune_tf.py`
+from tf_profile import profile
+
+# oneDNN is configured by an environment variable, read when TensorFlow is imported
+if 'onednn' in profile:
+    os.environ['TF_ENABLE_ONEDNN_OPTS'] = '1' if profile['onednn'] else '0'
+
 import tensorflow as tf
 
+if 'intra_op_threads' in profile:
+    tf.config.threading.set_intra_op_parallelism_threads(profile['intra_op_threads'])
+if 'inter_op_threads' in profile:
+    tf.config.threading.set_inter_op_parallelism_threads(profile['inter_op_threads'])
+predict_batch_size = profile.get('batch_size', 32)  # the batch size of `Model.predict`
+
 # configure tensorflow for running on GPU, if present
 gpus = tf.config.experimental.list_physical_devices('GPU')
 if gpus:
@@ -13,3 +13,81 @@ DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml
 CHARACTER_PADDING_RATIO = 0.25
 INFINITY = 2**64
 EVALUATION_RESULTS_DIR = '.\\evaluation_results'
+GLYPH_CACHE_SIZE = 4096  # max number of glyph predictions kept in cache (per process)
+GLYPH_HASH_MODE = 'exact'  # 'exact' (binarized glyph) or 'perceptual' (average hash)
+GLYPH_HASH_MAX_DISTANCE = 4  # max differing bits (of 256) between similar perceptual hashes
+CASCADE_ENABLED = False  # classify the raw glyph first, de-noise only the uncertain ones
+CASCADE_CONFIDENCE = 'probability'  # 'probability' (top-1) or 'margin' (top-1 minus top-2)
+CASCADE_THRESHOLD = 0.9  # glyphs less confident than this are de-noised (see calibrate_cascade.py)
+FAST_IMAGE_SIZE = (32, 32)  # input size of the distilled "fast tier" classifier
+MODEL_TIERS = ('full', 'fast')
+DEFAULT_MODEL_TIER = 'full'
+RECOGNITION_ENGINES = ('character', 'crnn')  # per-character classification or word-level CRNN
+DEFAULT_RECOGNITION_ENGINE = 'character'
+FONTS_DIR = 'C:\\Windows\\Fonts'  # fonts used for rendering synthetic words (CRNN training)
+DEBUG_SHOW_RECTS = False  # plot the bounding rects of the characters (blocks the request)
+LAYOUT_MIN_ROW_GAP_RATIO = 0.015  # min blank gap between blocks, relative to page height
+LAYOUT_MIN_COLUMN_GAP_RATIO = 0.03  # min blank gap between columns, relative to page width
+LAYOUT_WORKERS = None  # threads segmenting the blocks of a page (None - by number of CPUs)
+RESULTS_TTL_SECONDS = 60 * 60  # how long the extracted texts are kept for exporting them
+RESULTS_MAX_ITEMS = 1000
+SESSIONS_TTL_SECONDS = 10 * 60  # how long uploaded images are kept for later requests
+SESSIONS_MAX_ITEMS = 100
+SESSIONS_MAX_BYTES = 512 * 2**20  # total size of the (pickled) decoded images kept
+# the directory of the sessions and the results, shared by all of the workers of the server -
+# preferably on a memory-backed filesystem (e.g. /dev/shm)
+SHARED_STORE_DIR = 'shared_store'
+PAGE_DETECTION_WIDTH = 500  # width of the downscaled image searched for the contour of the page
+MIN_PAGE_AREA_RATIO = 0.1  # min area of the page, relative to the area of the image
+PAGE_QUALITY_THRESHOLD = 0.85  # stop the cascade of page detectors at a rect this good (0-1)
+TRACKING_KEYFRAME_INTERVAL = 15  # preview frames between full detections of the page
+TRACKING_WINDOW_SIZE = (21, 21)  # search window of the optical flow, around every corner
+TRACKING_MIN_QUALITY = 0.7  # tracked corners scoring lower than this are re-detected
+DICTIONARY_PATH = 'dictionary.bin'  # binary spellchecking dictionary (see build_dictionary.py)
+LEXICON_DECODING_ENABLED = False  # decode words over the dictionary, instead of argmax + spellcheck
+LEXICON_BEAM_WIDTH = 10  # prefixes kept at every character of the word
+LEXICON_BRANCHING = 6  # most probable characters tried for every prefix
+LEXICON_PRIOR_WEIGHT = 0.3  # weight of the (log) word frequency against the character probabilities
+LEXICON_MIN_CONFIDENCE = 0.5  # less confident words fall back to argmax + spellcheck
+INFERENCE_DAEMON_ENABLED = False  # predict through the inference daemon, instead of in every worker
+INFERENCE_SOCKET_PATH = 'ocr_inference.sock'  # the Unix socket of the inference daemon
+INFERENCE_MAX_BATCH = 2048  # max glyphs predicted together by the daemon
+INFERENCE_BATCH_WAIT = 0.005  # seconds the daemon waits for more requests to join a batch
+TF_PROFILE_PATH = 'tf_profile.json'  # CPU threading settings applied by config_tf (see autotune_tf.py)
+DEFAULT_TIME_BUDGET = 10.0  # seconds a request may take, unless the X-Time-Budget-Ms header is sent
+# optional stages are skipped if less than this many seconds are left when they start
+STAGE_MIN_REMAINING_TIME = {'hough': 2.0, 'denoiser': 1.0, 'spellcheck': 0.3}
+WARP_NORMALIZATION = 'line_height'  # resolution of the warped page - 'line_height', 'dpi' or None
+# pixels, the smallest height at which blurring the page before cutting the characters
+# neither erodes narrow characters (e.g. 'l', 'i', '1') away nor splits them - measured on
+# rendered pages (12 pt text scanned at 300 dpi is about 44 pixels high)
+WARP_TARGET_LINE_HEIGHT = 64
+WARP_TARGET_DPI = 200  # used when no lines of text are found (or in 'dpi' mode)
+PAGE_WIDTH_INCHES = 8.27  # A4
+WARP_PROBE_WIDTH = 600  # width of the small warp used for estimating the height of the lines
+WARP_MAX_SCALE = 2.0  # max enlargement of the region-of-interest
+WARP_MIN_DPI = 100  # the warped page is never smaller than if it was scanned at this resolution
+LINE_HEIGHT_MIN_LINES = 3  # fewer lines of text are not enough to estimate their height
+LINE_HEIGHT_MAX_RATIO = 0.1  # higher lines (of the height of the page) are not lines of text
+MEMORY_SAMPLE_RATE = 0.0  # fraction of the requests whose memory is traced (see memory_accounting.py)
+MEMORY_RECENT_REQUESTS = 200  # traced requests kept for the /admin/memory endpoint
+TRAINING_BACKUP_DIR = 'training_backup'  # backups of interrupted distributed training (see distributed_training.py)
+TRIAGE_ENABLED = True  # triage the images before the full pipeline (see triage.py)
+TRIAGE_WIDTH = 400  # the width of the thumbnail the images are triaged on
+TRIAGE_BLOCK_SIZE = 15  # the neighbourhood ink is compared to, in pixels of the thumbnail
+TRIAGE_INK_CONTRAST = 25  # how much darker than its neighbourhood ink is
+TRIAGE_MIN_INK_COVERAGE = 0.002  # images with less ink are empty
+# the sharpness of the edges of the ink, below it images are too blurry - None (the default)
+# never rejects images, calibrate it on photos first (see calibrate_triage.py)
+TRIAGE_MIN_SHARPNESS = None
+TRIAGE_BORDER_RATIO = 0.03  # the width of the border of the image, relative to its shorter side
+TRIAGE_MAX_BORDER_INK = 0.001  # a border with no more ink than this may be blank paper...
+TRIAGE_MIN_BORDER_BRIGHTNESS = 0.9  # ...if it is at least as bright, relative to the paper
+MODELS_DIR = 'models'  # the versions of the models, a directory for each (see model_registry.py)
+MODELS_POLL_INTERVAL = 5.0  # seconds between checks for a new version of the models
+MODELS_WARM_UP_BATCH = 32  # the size of the batch predicted to warm up a new version
+DENOISERS = ('autoencoder', 'classical', 'slim')  # the denoising backends of the full tier (see denoising.py)
+DEFAULT_DENOISER = 'autoencoder'
+CLASSICAL_MEDIAN_SIZE = 3  # the size of the median filter of the classical denoiser
+CLASSICAL_KERNEL_SIZE = 3  # the size of the (cross-shaped) morphological kernel of the classical denoiser
+MIN_LETTER_AREA_RATIO = 0.02  # smaller rects are noise, relative to the square of the height of their row
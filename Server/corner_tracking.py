@@ -0,0 +1,76 @@
+"""
+Module for tracking the corners of the page along a stream of (low
+resolution) preview frames. The page is detected from scratch only on
+keyframes, and the four corners are followed between them with sparse
+(Lucas-Kanade) optical flow, which costs a fraction of a full detection.
+"""
+from typing import Optional
+
+import numpy as np
+import cv2
+
+import consts
+import metrics
+from hough_rect import order_points
+from page_detection import detect_page, rect_quality
+
+
+class CornerTracker:
+    """
+    Tracks the page along the frames of a single preview stream. A full
+    detection runs on the first frame, every `keyframe_interval` frames,
+    and whenever the tracking is lost (a corner could not be followed,
+    or the tracked corners no longer look like a page).
+    """
+
+    def __init__(self, keyframe_interval: int = consts.TRACKING_KEYFRAME_INTERVAL):
+        self._keyframe_interval = keyframe_interval
+        self._previous: Optional[np.ndarray] = None
+        self._rect: Optional[np.ndarray] = None
+        self._frames_since_keyframe = 0
+
+    def update(self, frame: np.ndarray) -> tuple[Optional[np.ndarray], bool]:
+        """
+        Find the page in the next frame of the stream.
+
+        Args:
+            frame (np.ndarray): The (grayscale) frame.
+        Returns:
+            tuple[Optional[np.ndarray], bool]: The ordered four points of the
+              page (or None if no page is found), and whether the frame was
+              a keyframe.
+        """
+        if self._previous is None or self._previous.shape != frame.shape \
+                or self._frames_since_keyframe + 1 >= self._keyframe_interval:
+            return self._keyframe(frame), True
+
+        self._frames_since_keyframe += 1
+        if self._rect is None:
+            # no page to follow, wait for the next keyframe
+            self._previous = frame
+            return None, False
+        if (rect := self._track(frame)) is None:
+            metrics.increment('tracking.lost')
+            return self._keyframe(frame), True
+        metrics.increment('tracking.tracked')
+        self._previous, self._rect = frame, rect
+        return rect, False
+
+    def _keyframe(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        metrics.increment('tracking.keyframes')
+        self._previous, self._rect = frame, detect_page(frame)
+        self._frames_since_keyframe = 0
+        return self._rect
+
+    def _track(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """Follow the corners from the previous frame into this one, or
+        return None if the tracking is lost."""
+        points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self._previous, frame, self._rect.reshape((4, 1, 2)).astype(np.float32), None,
+            winSize=consts.TRACKING_WINDOW_SIZE, maxLevel=3)
+        if points is None or not status.all():
+            return None
+        rect = order_points(points.reshape((4, 2)))
+        if rect_quality(rect, frame.shape) < consts.TRACKING_MIN_QUALITY:
+            return None
+        return rect
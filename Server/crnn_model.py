@@ -0,0 +1,272 @@
+"""
+Module for the word-level recognition model - a compact convolutional-
+recurrent neural network (CRNN), which reads a whole word in a single
+pass and is trained with connectionist temporal classification (CTC)
+loss, on words rendered synthetically from the locally installed fonts.
+"""
+import glob
+import os
+import random
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import cv2
+import tensorflow as tf
+from PIL import Image, ImageDraw, ImageFont
+from spellchecker import SpellChecker
+from tensorflow.keras.models import Sequential, load_model
+from tensorflow.keras.layers import (InputLayer, Conv2D, MaxPooling2D, Permute,
+                                     Reshape, Dense, Dropout, Bidirectional, LSTM)
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.activations import relu, softmax
+from tensorflow.keras.backend import ctc_batch_cost
+from tensorflow.keras.callbacks import CSVLogger, EarlyStopping, Callback
+from tensorflow.keras.utils import Sequence
+
+import config_tf
+import consts
+from base_model import ModelNotLoadedError, ModelNotBuiltError, BaseTFModel
+
+BLANK = len(consts.CLASSES)  # the index of the CTC blank label, also used as label padding
+MAX_LABEL_LENGTH = 24
+WORD_PADDING_RATIO = 0.1
+
+
+def fit_word_image(img: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    Fit the (tightly cropped) image of a word into the input of the model:
+    add white padding around it, resize it to the given height while
+    keeping its aspect ratio (squeezing it if it is too wide), and pad it
+    with white on the right. Pixel values are rescaled between 0.0 and 1.0.
+    """
+    pad = max(1, int(img.shape[0] * WORD_PADDING_RATIO))
+    img = cv2.copyMakeBorder(img, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=255)
+    h, w = img.shape
+    new_width = min(width, max(1, round(w * height / h)))
+    resized = cv2.resize(img, (new_width, height), interpolation=cv2.INTER_AREA)
+    fitted = np.ones((height, width)) * 255
+    fitted[:, :new_width] = resized
+    return fitted / 255
+
+
+def render_word(text: str, font_path: str, font_size: int) -> np.ndarray:
+    """Render the text in black over white, threshold it (like a preprocessed
+    page) and crop it tightly around the ink."""
+    font = ImageFont.truetype(font_path, font_size)
+    left, top, right, bottom = font.getbbox(text)
+    pil_image = Image.new('L', (right - left + 2 * font_size, bottom - top + 2 * font_size), 255)
+    ImageDraw.Draw(pil_image).text((font_size - left, font_size - top), text, font=font, fill=0)
+    _, threshed = cv2.threshold(np.asarray(pil_image), 255 // 2, 255, cv2.THRESH_BINARY)
+    ys, xs = np.nonzero(threshed == 0)
+    if not len(xs):
+        return threshed
+    return threshed[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+
+
+def ctc_greedy_decode(predictions: np.ndarray) -> list[str]:
+    """Decode the predictions of the model (of shape `(n, time steps, classes)`)
+    by taking the most probable label at every time step, collapsing repeated
+    labels and removing the blanks."""
+    texts = []
+    for path in np.argmax(predictions, axis=-1):
+        keep = np.ones(len(path), dtype=bool)
+        keep[1:] = path[1:] != path[:-1]
+        texts.append(''.join(consts.CLASSES[label] for label in path[keep] if label != BLANK))
+    return texts
+
+
+def ctc_loss(y_true: tf.Tensor, y_pred: tf.Tensor) -> tf.Tensor:
+    """CTC loss, where the labels are padded with `BLANK`."""
+    y_true = tf.cast(y_true, tf.int32)
+    batch_size = tf.shape(y_pred)[0]
+    input_length = tf.fill([batch_size, 1], tf.shape(y_pred)[1])
+    label_length = tf.reduce_sum(tf.cast(y_true != BLANK, tf.int32), axis=1, keepdims=True)
+    return ctc_batch_cost(y_true, y_pred, input_length, label_length)
+
+
+class SyntheticWordSequence(Sequence):
+    """
+    Batches of images of random words, rendered with random fonts and
+    sizes, and their labels (padded with `BLANK`).
+    """
+
+    def __init__(self, fonts: list[str], words: list[str], batch_size: int, steps: int,
+                 height: int, width: int, seed: int = None):
+        self._fonts = fonts
+        self._words = words
+        self._batch_size = batch_size
+        self._steps = steps
+        self._height = height
+        self._width = width
+        self._seed = seed  # a fixed seed renders the same batches every epoch
+
+    def __len__(self) -> int:
+        return self._steps
+
+    def __getitem__(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        rng = random.Random(None if self._seed is None else self._seed * self._steps + index)
+        imgs = np.zeros((self._batch_size, self._height, self._width, 1))
+        labels = np.full((self._batch_size, MAX_LABEL_LENGTH), BLANK)
+        for i in range(self._batch_size):
+            word = rng.choice(self._words)
+            # the model outputs lowercase only, but the input may also be uppercase
+            text = rng.choice([word, word, word.capitalize(), word.upper()])
+            img = render_word(text, rng.choice(self._fonts), rng.randint(20, 64))
+            imgs[i, :, :, 0] = fit_word_image(img, self._height, self._width)
+            labels[i, :len(word)] = [consts.CLASSES.index(c) for c in word]
+        return imgs, labels
+
+
+class CRNNModel(BaseTFModel):
+    """
+    Class for building, training, and loading a word-level recognition
+    model: convolutional layers extract features from the image of the
+    word, recurrent layers read them from left to right (as a sequence
+    of time steps), and every time step is classified into a character
+    or a blank.
+    """
+    BATCH_SIZE = 64
+    LR = 1e-3
+    MAX_EPOCHS = 50
+    STEPS_PER_EPOCH = 1000
+    VALIDATION_STEPS = 50
+    MODEL_NAME = 'crnn_model.h5'
+    LOG_DIR = 'logs\\crnn-training-history'
+    HEIGHT = 32
+    WIDTH = 256
+
+    def __init__(self):
+        super().__init__()
+
+    def build_model(self) -> None:
+        """
+        Build and compile the CRNN. Pooling halves the width only twice,
+        so every time step covers 4 columns of the image.
+        """
+        time_steps = self.WIDTH // 4
+        model = Sequential([
+            InputLayer(input_shape=(self.HEIGHT, self.WIDTH, 1)),
+            Conv2D(filters=32, kernel_size=(3, 3), activation=relu, padding='same'),
+            MaxPooling2D(pool_size=(2, 2)),
+            Conv2D(filters=64, kernel_size=(3, 3), activation=relu, padding='same'),
+            MaxPooling2D(pool_size=(2, 2)),
+            Conv2D(filters=128, kernel_size=(3, 3), activation=relu, padding='same'),
+            MaxPooling2D(pool_size=(2, 1)),
+            Conv2D(filters=128, kernel_size=(3, 3), activation=relu, padding='same'),
+            MaxPooling2D(pool_size=(2, 1)),
+            # turn the features into a sequence of time steps, from left to right
+            Permute((2, 1, 3)),
+            Reshape((time_steps, (self.HEIGHT // 16) * 128)),
+            Dense(units=128, activation=relu),
+            Dropout(0.25),
+            Bidirectional(LSTM(units=128, return_sequences=True, dropout=0.25)),
+            Bidirectional(LSTM(units=64, return_sequences=True, dropout=0.25)),
+            # a probability for every character and for the blank
+            Dense(units=len(consts.CLASSES) + 1, activation=softmax),
+        ])
+
+        print(model.summary())
+
+        model.compile(optimizer=Adam(learning_rate=self.LR), loss=ctc_loss)
+        self._model = model
+        self._model_built = True
+
+    def train_model(self) -> None:
+        """
+        Train the model on synthetic words, rendered with the fonts found in
+        `consts.FONTS_DIR`, and log training progress to disk.
+
+        Raises:
+            ModelNotBuiltError: when trying to train an un built model.
+        """
+        if not self._model_built:
+            raise ModelNotBuiltError('The model has to be built before training it.')
+
+        fonts, words = self._load_fonts(), self._load_words()
+        print(f'Rendering {len(words)} words with {len(fonts)} fonts.')
+        training_data = SyntheticWordSequence(fonts, words, self.BATCH_SIZE,
+                                              self.STEPS_PER_EPOCH, self.HEIGHT, self.WIDTH)
+        validation_data = SyntheticWordSequence(fonts, words, self.BATCH_SIZE,
+                                                self.VALIDATION_STEPS, self.HEIGHT,
+                                                self.WIDTH, seed=0)
+        self._model.fit(training_data,
+                        epochs=self.MAX_EPOCHS,
+                        verbose=1,
+                        validation_data=validation_data,
+                        callbacks=self._setup_training_callbacks())
+        self._model_loaded = True
+
+    def save_model(self) -> None:
+        """Save the model to disk as a HDF5 file."""
+        self._model.save(self.MODEL_NAME)
+
+    def load_model(self, path: Optional[str] = None) -> None:
+        """Load the model from disk into memory (for predictions only, from
+        `MODEL_NAME` by default)."""
+        self._model = load_model(path or self.MODEL_NAME, compile=False)
+        self._model_loaded = True
+
+    def read_words(self, imgs: np.ndarray) -> list[str]:
+        """
+        Read the words in the images.
+
+        Args:
+            imgs (np.ndarray): The images of the words, fitted to the input of
+              the model (see `fit_word_image`), of shape `(n, HEIGHT, WIDTH)`.
+        Returns:
+            list[str]: The decoded words.
+        Raises:
+            ModelNotLoadedError: If model was not loaded before trying to predict.
+        """
+        if not self._model_loaded:
+            raise ModelNotLoadedError('You have to load the model before'
+                                      ' performing predictions')
+        if len(imgs) == 0:
+            return []
+        batch = imgs.reshape((len(imgs), self.HEIGHT, self.WIDTH, 1))
+        return ctc_greedy_decode(self._model.predict(batch))
+
+    def evaluate(self, images: SyntheticWordSequence = None) -> None:
+        """Calculate the word accuracy over (by default, the validation) synthetic words."""
+        if not self._model_loaded:
+            raise ModelNotLoadedError('You have to load the model before evaluating it.')
+        images = images or SyntheticWordSequence(self._load_fonts(), self._load_words(),
+                                                 self.BATCH_SIZE, self.VALIDATION_STEPS,
+                                                 self.HEIGHT, self.WIDTH, seed=0)
+        correct = total = 0
+        for i in range(len(images)):
+            imgs, labels = images[i]
+            for predicted, label in zip(self.read_words(imgs), labels):
+                correct += predicted == ''.join(consts.CLASSES[c] for c in label if c != BLANK)
+                total += 1
+        print(f'Word accuracy is: {correct / total * 100:.2f}%')
+
+    @staticmethod
+    def _load_fonts() -> list[str]:
+        """Get the paths of the fonts that can render the characters."""
+        fonts = []
+        for path in glob.glob(os.path.join(consts.FONTS_DIR, '*.[ot]tf')):
+            try:
+                ImageFont.truetype(path, 12).getbbox(consts.CLASSES[0])
+            except OSError:
+                continue
+            fonts.append(path)
+        return fonts
+
+    @staticmethod
+    def _load_words() -> list[str]:
+        """Get the words of the spellchecker's dictionary, and random numbers."""
+        words = [word for word in SpellChecker().word_frequency.keys()
+                 if len(word) <= MAX_LABEL_LENGTH and all(c in consts.CLASSES for c in word)]
+        rng = random.Random(0)
+        numbers = [str(rng.randint(0, 10 ** rng.randint(1, 8))) for _ in range(len(words) // 20)]
+        return words + numbers
+
+    def _setup_training_callbacks(self) -> list[Callback]:
+        time = datetime.now().strftime(consts.DATETIME_FORMAT)
+        csv_logger = CSVLogger(f'{self.LOG_DIR}-{time}.csv',
+                               separator=',', append=False)
+        early_stop = EarlyStopping(monitor='val_loss', patience=5, mode='min',
+                                   restore_best_weights=True)
+        return [csv_logger, early_stop]
@@ -0,0 +1,46 @@
+"""
+Module for the time budget of a request. The optional stages of the
+pipeline (finding the page with Hough Line Transform, denoising the
+characters, spellchecking) check the remaining budget before they start,
+and are skipped when it is too short - so an overloaded server still
+returns a (less accurate) result in time, instead of timing out.
+"""
+import math
+import time
+from typing import Optional
+
+import consts
+import metrics
+
+
+class Deadline:
+    """
+    The deadline of a single request, and the optional stages that were
+    skipped to meet it. A budget of None never runs out.
+    """
+
+    def __init__(self, budget: Optional[float] = consts.DEFAULT_TIME_BUDGET):
+        self._end = None if budget is None else time.monotonic() + budget
+        self.skipped: list[str] = []
+
+    def remaining(self) -> float:
+        """Get the seconds left until the deadline."""
+        return math.inf if self._end is None else self._end - time.monotonic()
+
+    def allows(self, stage: str) -> bool:
+        """
+        Check whether the optional stage can run - whether at least
+        `consts.STAGE_MIN_REMAINING_TIME[stage]` seconds are left for it and
+        the stages after it. If not, the stage is recorded as skipped.
+        """
+        if self.remaining() >= consts.STAGE_MIN_REMAINING_TIME[stage]:
+            return True
+        self.skipped.append(stage)
+        metrics.increment(f'deadline.skipped.{stage}')
+        print(f'Skipping {stage}, {self.remaining():.3f}s left')
+        return False
+
+
+def allows(deadline: Optional[Deadline], stage: str) -> bool:
+    """Check whether the optional stage can run (always, without a deadline)."""
+    return deadline is None or deadline.allows(stage)
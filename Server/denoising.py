@@ -0,0 +1,57 @@
+"""
+Module for the denoising backends - the ways the glyphs are cleaned
+before classifying them (in the full tier). Every backend has a
+`denoise_batch(glyphs)` method, which takes normalized glyphs of shape
+`(n, *consts.IMAGE_SIZE)` (or with a color channel), and returns them
+denoised, of shape `(n, *consts.IMAGE_SIZE, 1)`:
+'autoencoder' - the neural `DenoisingAutoencoder`, 'slim' - the small
+`SlimDenoisingAutoencoder` (see `slim_noise_remover.py`, available after
+training it), and 'classical' - `MorphologicalDenoiser`, which is much
+cheaper and enough for clean scans.
+"""
+import numpy as np
+import cv2
+
+import consts
+
+
+class MorphologicalDenoiser:
+    """
+    Classical denoising of glyphs: a median filter, re-binarization, and
+    morphological opening and closing of the ink - which remove specks of
+    ink and fill small gaps in the strokes. All of the glyphs of a batch
+    are stacked into a single image and filtered at once (the glyphs are
+    padded with white, so they do not affect each other).
+    """
+
+    def __init__(self, median_size: int = consts.CLASSICAL_MEDIAN_SIZE,
+                 kernel_size: int = consts.CLASSICAL_KERNEL_SIZE):
+        self._median_size = median_size
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_CROSS, (kernel_size, kernel_size))
+
+    def denoise_page(self, img: np.ndarray) -> np.ndarray:
+        """Denoise a (grayscale, 8-bit) image of black ink on white background."""
+        img = cv2.medianBlur(img, self._median_size)
+        _, img = cv2.threshold(img, 255 // 2, 255, cv2.THRESH_BINARY)
+        # the ink is black, so closing the image is opening the ink, and vice versa
+        img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, self._kernel)
+        return cv2.morphologyEx(img, cv2.MORPH_OPEN, self._kernel)
+
+    def denoise_batch(self, glyphs: np.ndarray) -> np.ndarray:
+        """
+        Remove the noise from multiple glyphs at once.
+
+        Args:
+            glyphs (np.ndarray): The glyphs to denoise, of shape
+             `(n, *consts.IMAGE_SIZE)` or `(n, *consts.IMAGE_SIZE, 1)`.
+        Returns:
+            np.ndarray: The denoised glyphs, of shape `(n, *consts.IMAGE_SIZE, 1)`,
+              with pixel values of either 0.0 or 1.0.
+        """
+        n, h, w = glyphs.shape[:3]
+        if n == 0:
+            return np.empty((0, h, w, 1))
+        if glyphs.max() <= 1.0:
+            glyphs = glyphs * 255
+        page = np.rint(glyphs.reshape(n * h, w)).astype(np.uint8)
+        return (self.denoise_page(page) / 255).reshape(n, h, w, 1)
@@ -0,0 +1,109 @@
+"""
+Module for training the "fast tier" classifier by distillation from the
+OCR model (which has to be trained first), and comparing the two models:
+accuracy on the test set, size and CPU latency. The teacher predicts the
+images denoised by the backend the full tier is served with, and the
+student the images downscaled the way the fast tier is served.
+The report is printed and saved as a CSV file in the evaluation results.
+
+Usage: python distill_fast_model.py [--report-only] [--denoiser {autoencoder,classical,slim}]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import config_tf
+import consts
+from denoising import MorphologicalDenoiser
+from model_evaluator import load_labeled_images
+from noise_remover import DenoisingAutoencoder
+from ocr_model import OCRModel
+from fast_ocr_model import FastOCRModel
+from preprocessing import downscale_glyphs
+from slim_noise_remover import SlimDenoisingAutoencoder
+
+LATENCY_REPEATS = 50
+THROUGHPUT_BATCH_SIZE = 256
+
+
+def measure_latency(model: OCRModel, imgs: np.ndarray) -> tuple[float, float]:
+    """
+    Measure the latency of predicting a single glyph, and the time per
+    glyph when predicting a large batch, both in milliseconds.
+    """
+    model.predict_batch(imgs[:1])  # warm-up
+    start = time.perf_counter()
+    for img in imgs[:LATENCY_REPEATS]:
+        model.predict_batch(img[np.newaxis])
+    single = (time.perf_counter() - start) / min(LATENCY_REPEATS, len(imgs))
+
+    batch = imgs[:THROUGHPUT_BATCH_SIZE]
+    start = time.perf_counter()
+    model.predict_batch(batch)
+    batched = (time.perf_counter() - start) / len(batch)
+    return single * 1000, batched * 1000
+
+
+def load_denoiser(name: str) -> object:
+    """Load the denoising backend of the full tier by its name (see `denoising.py`)."""
+    if name == 'classical':
+        return MorphologicalDenoiser()
+    denoiser = SlimDenoisingAutoencoder() if name == 'slim' else DenoisingAutoencoder()
+    denoiser.load_model()
+    return denoiser
+
+
+def report(teacher: OCRModel, student: FastOCRModel, denoiser: object) -> pd.DataFrame:
+    """Compare the accuracy, size and latency of the teacher (on the denoised
+    images) and the student."""
+    imgs, labels = load_labeled_images(consts.TEST_CATEGORICAL_PATH)
+    denoised_imgs = denoiser.denoise_batch(imgs)
+    small_imgs = downscale_glyphs(imgs, student.IMAGE_SIZE)
+
+    rows = []
+    for name, model, model_imgs in [('teacher', teacher, denoised_imgs),
+                                    ('student (fast tier)', student, small_imgs)]:
+        predictions = model.predict_batch(model_imgs)
+        accuracy = np.mean(np.argmax(predictions, axis=1) == labels) * 100
+        single, batched = measure_latency(model, model_imgs)
+        rows.append({
+            'model': name,
+            'input size': 'x'.join(map(str, model.IMAGE_SIZE)),
+            'parameters': model.count_params(),
+            'file size (MB)': os.path.getsize(model.MODEL_NAME) / 2**20,
+            'accuracy (%)': accuracy,
+            'latency, single glyph (ms)': single,
+            f'latency per glyph, batch of {THROUGHPUT_BATCH_SIZE} (ms)': batched,
+        })
+    df = pd.DataFrame(rows).set_index('model')
+    print(df.T)
+    df.to_csv(f'{consts.EVALUATION_RESULTS_DIR}\\fast_tier_report.csv')
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill the fast tier classifier.')
+    parser.add_argument('--report-only', action='store_true',
+                        help='only compare the models, without training the student')
+    parser.add_argument('--denoiser', choices=consts.DENOISERS, default=consts.DEFAULT_DENOISER,
+                        help='the denoising backend the full tier is served with')
+    args = parser.parse_args()
+
+    teacher = OCRModel()
+    teacher.load_model()
+    denoiser = load_denoiser(args.denoiser)
+    student = FastOCRModel()
+    if args.report_only:
+        student.load_model()
+    else:
+        student.build_model()
+        student.train_model(teacher, denoiser)
+        student.save_model()
+    report(teacher, student, denoiser)
+
+
+if __name__ == '__main__':
+    main()
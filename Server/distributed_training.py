@@ -0,0 +1,243 @@
+"""
+Module for training the OCR model or the denoising autoencoder with data
+parallelism, over several worker processes - on one machine or on several
+nodes (`tf.distribute.MultiWorkerMirroredStrategy`). Every worker trains a
+replica of the model on its own shard of the training set, and the
+gradients of all of the workers are averaged on every step.
+The cluster is described by the TF_CONFIG environment variable of every
+worker (worker 0 is the chief, which logs and saves the model). The state
+of the training is backed up at the end of every epoch, so an interrupted
+run resumes from the last epoch when the workers are started again.
+
+Usage: python distributed_training.py {ocr,denoiser} [--slice N]
+       python distributed_training.py {ocr,denoiser} --launch WORKERS [--slice N]
+  --launch starts the workers on this machine (e.g. for testing on a small
+  slice of the dataset), instead of running a single worker.
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+
+import config_tf
+import tensorflow as tf
+from tensorflow.keras.callbacks import BackupAndRestore, CSVLogger, EarlyStopping
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+import consts
+from noise_remover import DenoisingAutoencoder, load_images
+from ocr_model import OCRModel
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.ppm', '.tif', '.tiff')
+SHUFFLE_SEED = 0  # the same on every worker, so they all agree on the shards
+
+
+def cluster_info() -> tuple[int, int]:
+    """Get the number of workers in the cluster, and the index of this worker
+    (according to TF_CONFIG - a single worker if it is not set)."""
+    tf_config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    workers = len(tf_config.get('cluster', {}).get('worker', [])) or 1
+    return workers, tf_config.get('task', {}).get('index', 0)
+
+
+def shard(items: list, workers: int, index: int, slice_size: Optional[int] = None) -> list:
+    """
+    Get the shard of the items for this worker. The items are shuffled the
+    same on every worker first, and optionally cut to a slice of them. All
+    of the shards are of the same size, so every worker runs the same
+    number of steps.
+
+    Raises:
+        ValueError: If there are fewer items than workers, so the shards
+          would be empty.
+    """
+    items = sorted(items)
+    random.Random(SHUFFLE_SEED).shuffle(items)
+    if slice_size:
+        items = items[:slice_size]
+    per_worker = len(items) // workers
+    if not per_worker:
+        raise ValueError(f'Cannot shard {len(items)} items between {workers} workers, every '
+                         f'worker needs at least one - use a larger slice, or fewer workers.')
+    return items[index * per_worker:(index + 1) * per_worker]
+
+
+def list_images(directory: str) -> list[str]:
+    return [path for path in glob.glob(os.path.join(directory, '*'))
+            if path.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def batch_shard(dataset: tf.data.Dataset, batch_size: int, workers: int) -> tf.data.Dataset:
+    """
+    Batch the shard of this worker by the global batch size (the batch size
+    of a single worker, times the workers), which the strategy splits back
+    between the workers. The shard is already of this worker only, so
+    TensorFlow should not shard it again.
+    """
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    dataset = dataset.batch(batch_size * workers, drop_remainder=True)
+    return dataset.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+
+def ocr_dataset(directory: str, workers: int, index: int, slice_size: Optional[int] = None,
+                augment: bool = False) -> tf.data.Dataset:
+    """
+    Load the shard of this worker of a categorical dataset (a directory per
+    class), the same as `OCRModel` does with `ImageDataGenerator`: grayscale,
+    resized, scaled to be between 0.0 and 1.0, and randomly augmented if
+    `augment`.
+    """
+    samples = shard([(path, label) for label, name in enumerate(consts.CLASSES)
+                     for path in list_images(os.path.join(directory, name))],
+                    workers, index, slice_size)
+    paths, labels = zip(*samples)
+    dataset = tf.data.Dataset.from_tensor_slices((list(paths), list(labels)))
+    if augment:
+        dataset = dataset.shuffle(len(samples), seed=SHUFFLE_SEED + index)
+
+    augmenter = ImageDataGenerator(**OCRModel.AUGMENTATION)
+
+    def random_transform(img: np.ndarray) -> np.ndarray:
+        return augmenter.random_transform(img).astype(np.float32)
+
+    def load(path: tf.Tensor, label: tf.Tensor) -> tuple[tf.Tensor, tf.Tensor]:
+        img = tf.io.decode_image(tf.io.read_file(path), channels=1, expand_animations=False)
+        img = tf.image.resize(img, OCRModel.IMAGE_SIZE, method='nearest') / 255
+        if augment:
+            img = tf.numpy_function(random_transform, [img], tf.float32)
+            img.set_shape(OCRModel.IMAGE_SIZE + (1,))
+        return img, tf.one_hot(label, len(consts.CLASSES))
+
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+    return batch_shard(dataset, OCRModel.BATCH_SIZE, workers)
+
+
+def denoiser_dataset(directory: str, workers: int, index: int,
+                     slice_size: Optional[int] = None) -> tf.data.Dataset:
+    """Load the shard of this worker of a non-categorical dataset, as pairs
+    of (noisy, original) images for training `DenoisingAutoencoder`."""
+    imgs = load_images(shard(list_images(directory), workers, index, slice_size))
+    noisy = DenoisingAutoencoder._add_gaussian_noise(imgs)
+    dataset = tf.data.Dataset.from_tensor_slices((noisy, imgs[..., np.newaxis]))
+    dataset = dataset.shuffle(len(imgs), seed=SHUFFLE_SEED + index)
+    return batch_shard(dataset, DenoisingAutoencoder.BATCH_SIZE, workers)
+
+
+def train(model_name: str, slice_size: Optional[int] = None) -> None:
+    """Run a single worker of the distributed training of the model."""
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    workers, index = cluster_info()
+    is_chief = index == 0
+    print(f'Worker {index} of {workers} training the {model_name} model')
+
+    with strategy.scope():
+        model = OCRModel() if model_name == 'ocr' else DenoisingAutoencoder()
+        model.build_model()
+
+    # the backups of the other workers are written to temporary directories
+    callbacks = [BackupAndRestore(os.path.join(consts.TRAINING_BACKUP_DIR, model_name))]
+    if model_name == 'ocr':
+        training_data = ocr_dataset(consts.TRAIN_CATEGORICAL_PATH, workers, index,
+                                    slice_size, augment=True)
+        validation_data = ocr_dataset(consts.VALIDATION_CATEGORICAL_PATH, workers, index,
+                                      slice_size)
+        callbacks.append(EarlyStopping(monitor='val_accuracy', patience=7, mode='max',
+                                       restore_best_weights=True))
+        if is_chief:
+            # appended to, so a resumed run continues the same log
+            callbacks.append(CSVLogger(f'{OCRModel.LOG_DIR}-distributed.csv', append=True))
+    else:
+        training_data = denoiser_dataset(consts.TRAIN_NON_CATEGORICAL_PATH, workers, index,
+                                         slice_size)
+        validation_data = denoiser_dataset(consts.VALIDATION_NON_CATEGORICAL_PATH, workers,
+                                           index, slice_size)
+    model.train_model(training_data, validation_data, callbacks)
+
+    # every worker has to save the model, but only the chief saves it for real
+    if is_chief:
+        model.save_model()
+        print(f'Saved the model to {model.MODEL_NAME}')
+    else:
+        temp_dir = tempfile.mkdtemp()
+        model.save_model(os.path.join(temp_dir, model.MODEL_NAME))
+        shutil.rmtree(temp_dir)
+
+
+def free_ports(count: int) -> list[int]:
+    """Get ports on localhost that are not in use."""
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(('localhost', 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def launch(model_name: str, workers: int, slice_size: Optional[int] = None) -> None:
+    """
+    Run the distributed training with the given number of workers on this
+    machine, each in its own process (with its share of the CPUs, unless a
+    profile is set in TF_PROFILE_PATH). If a worker fails, the others are
+    stopped - run the same command again to resume.
+    """
+    cluster = {'worker': [f'localhost:{port}' for port in free_ports(workers)]}
+    env = dict(os.environ)
+    profile_path = None
+    if 'TF_PROFILE_PATH' not in env:
+        threads = max(1, os.cpu_count() // workers)
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump({'intra_op_threads': threads, 'inter_op_threads': 1}, f)
+        profile_path = env['TF_PROFILE_PATH'] = f.name
+
+    command = [sys.executable, __file__, model_name]
+    if slice_size:
+        command += ['--slice', str(slice_size)]
+    processes = []
+    try:
+        for index in range(workers):
+            tf_config = {'cluster': cluster, 'task': {'type': 'worker', 'index': index}}
+            processes.append(subprocess.Popen(command,
+                                              env=dict(env, TF_CONFIG=json.dumps(tf_config))))
+        while any(process.poll() is None for process in processes):
+            if any(process.returncode for process in processes):
+                raise RuntimeError('A worker failed, stopping the training.')
+            time.sleep(1)
+        if any(process.returncode for process in processes):
+            raise RuntimeError('A worker failed.')
+        print(f'Finished training with {workers} workers')
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        if profile_path:
+            os.remove(profile_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train a model on several workers.')
+    parser.add_argument('model', choices=['ocr', 'denoiser'])
+    parser.add_argument('--slice', type=int, default=None,
+                        help='train on only this many images of every set (for testing)')
+    parser.add_argument('--launch', type=int, default=None, metavar='WORKERS',
+                        help='start this many workers on this machine')
+    args = parser.parse_args()
+    if args.launch:
+        launch(args.model, args.launch, args.slice)
+    else:
+        train(args.model, args.slice)
+
+
+if __name__ == '__main__':
+    main()
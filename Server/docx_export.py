@@ -0,0 +1,48 @@
+"""
+Module for exporting text to Microsoft Word (DOCX) documents.
+The styled template document is built once, and every export starts
+from an in-memory copy of it, instead of reading and styling the
+default template from disk every time.
+"""
+import io
+
+from docx import Document
+from docx.shared import Pt
+
+
+def _build_template() -> bytes:
+    """Build the empty, styled, document, and save it into bytes."""
+    document = Document()
+    font = document.styles['Normal'].font
+    font.name = 'Calibri'
+    font.size = Pt(12)
+    stream = io.BytesIO()
+    document.save(stream)
+    return stream.getvalue()
+
+
+_TEMPLATE = _build_template()
+
+
+def pages_to_docx(pages: list[str]) -> io.BytesIO:
+    """
+    Put the pages of text in a docx document, each page starting on a new
+    page of the document.
+
+    Args:
+        pages (list[str]): The text of every page.
+
+    Returns:
+        io.BytesIO: A stream of the saved document, positioned at its start.
+    """
+    document = Document(io.BytesIO(_TEMPLATE))
+    for i, page in enumerate(pages):
+        if i:
+            document.add_page_break()
+        for paragraph in page.split('\n'):
+            document.add_paragraph(paragraph, style='Normal')
+
+    stream = io.BytesIO()
+    document.save(stream)
+    stream.seek(0)
+    return stream
@@ -0,0 +1,145 @@
+"""
+Module for the "fast tier" character classifier - a much smaller model
+working on low-resolution images, which is trained by distilling the
+knowledge of the full `OCRModel` (the teacher) into it.
+"""
+from typing import Callable, Optional
+
+import numpy as np
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.layers import (Dense, Conv2D, SeparableConv2D, Flatten,
+                                     MaxPooling2D, Dropout, InputLayer)
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.preprocessing.image import DirectoryIterator
+from tensorflow.keras.losses import categorical_crossentropy
+from tensorflow.keras.activations import relu, softmax
+from tensorflow.keras.utils import Sequence
+
+import config_tf
+import consts
+from base_model import ModelNotBuiltError, ModelNotLoadedError
+from ocr_model import OCRModel
+from preprocessing import downscale_glyphs
+
+
+class DistillationSequence(Sequence):
+    """
+    Batches of downscaled images for the student model, labeled with a mix
+    of the true labels and the softened predictions of the teacher model.
+    The images are downscaled the same way as when serving the fast tier
+    (see `downscale_glyphs`), and the teacher predicts the denoised images,
+    as it does when serving the full tier.
+    """
+
+    def __init__(self, data: DirectoryIterator, image_size: tuple[int, int],
+                 teacher: OCRModel = None, temperature: float = 1.0, alpha: float = 1.0,
+                 denoise: Optional[Callable[[np.ndarray], np.ndarray]] = None):
+        self._data = data
+        self._image_size = image_size
+        self._teacher = teacher
+        self._denoise = denoise
+        self._temperature = temperature
+        self._alpha = alpha
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __getitem__(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        imgs, labels = self._data[index]
+        if self._teacher is not None:
+            # soften the probabilities of the teacher, to expose the similarities
+            # it has learned between the characters
+            teacher_imgs = self._denoise(imgs) if self._denoise is not None else imgs
+            soft = self._teacher.predict_batch(teacher_imgs) ** (1 / self._temperature)
+            soft /= soft.sum(axis=1, keepdims=True)
+            labels = self._alpha * labels + (1 - self._alpha) * soft
+        return downscale_glyphs(imgs, self._image_size), labels
+
+    def on_epoch_end(self) -> None:
+        self._data.on_epoch_end()
+
+
+class FastOCRModel(OCRModel):
+    """
+    Class used for building a small classifier of characters, working on
+    images of size `consts.FAST_IMAGE_SIZE` using depthwise separable
+    convolutions, and training it by distillation from `OCRModel`.
+    """
+    LR = 1e-3
+    MAX_EPOCHS = 20
+    MODEL_NAME = 'fast_ocr_model.h5'
+    LOG_DIR = 'logs\\fast-training-history'
+    IMAGE_SIZE = consts.FAST_IMAGE_SIZE
+    TEMPERATURE = 4.0
+    ALPHA = 0.3  # the weight of the true labels, the rest is the teacher's
+
+    def build_model(self) -> None:
+        """
+        Build and compile a small sequential model, where every
+        convolution (except the first) is split into a depthwise and a
+        pointwise convolution, which is much cheaper than a full convolution.
+        """
+        model = Sequential()
+        model.add(InputLayer(input_shape=self.IMAGE_SIZE + (1,)))
+        model.add(Conv2D(filters=16, kernel_size=(3, 3), activation=relu, padding='same'))
+        model.add(SeparableConv2D(filters=32, kernel_size=(3, 3), activation=relu,
+                                  padding='same'))
+        model.add(MaxPooling2D(pool_size=(2, 2), strides=2))
+
+        model.add(SeparableConv2D(filters=64, kernel_size=(3, 3), activation=relu,
+                                  padding='same'))
+        model.add(MaxPooling2D(pool_size=(2, 2), strides=2))
+
+        model.add(SeparableConv2D(filters=128, kernel_size=(3, 3), activation=relu,
+                                  padding='same'))
+        model.add(Dropout(0.15))
+        model.add(MaxPooling2D(pool_size=(2, 2), strides=2))
+
+        model.add(Flatten())
+        model.add(Dense(units=128, activation=relu))
+        model.add(Dropout(0.3))
+        model.add(Dense(units=len(consts.CLASSES), activation=softmax))
+
+        print(model.summary())
+
+        model.compile(optimizer=Adam(learning_rate=self.LR),
+                      loss=categorical_crossentropy,
+                      metrics=['accuracy'])
+
+        self._model = model
+        self._model_built = True
+
+    def train_model(self, teacher: OCRModel = None,
+                    denoiser: Optional[object] = None) -> None:
+        """
+        Train the model on the downscaled training set, with the targets
+        being a mix of the true labels and the predictions of the teacher.
+
+        Args:
+            teacher (OCRModel): The loaded teacher model, defaults to `OCRModel()`.
+            denoiser (Optional[object]): The (loaded) denoising backend the
+              teacher is served with (see `denoising.py`), which denoises the
+              images the teacher predicts - without it, the teacher predicts
+              the raw images.
+        Raises:
+            ModelNotBuiltError: when trying to train an un built model.
+            ModelNotLoadedError: when the teacher model is not loaded.
+        """
+        if not self._model_built:
+            raise ModelNotBuiltError('The model has to be built before training it.')
+        teacher = teacher or OCRModel()
+        if not teacher.model_loaded:
+            raise ModelNotLoadedError('The teacher model has to be loaded before'
+                                      ' distilling it.')
+
+        # the data is loaded in the size of the teacher's input
+        training_data, validation_data = self._load_data()
+        denoise = denoiser.denoise_batch if denoiser is not None else None
+        self._model.fit(DistillationSequence(training_data, self.IMAGE_SIZE, teacher,
+                                             self.TEMPERATURE, self.ALPHA, denoise),
+                        epochs=self.MAX_EPOCHS,
+                        verbose=1,
+                        validation_data=DistillationSequence(validation_data,
+                                                             self.IMAGE_SIZE),
+                        callbacks=self._setup_training_callbacks())
+        self._model_loaded = True
@@ -0,0 +1,163 @@
+"""
+Module for the prebuilt binary word-frequency dictionary used for
+spellchecking. The words are kept sorted in a fixed-width string table,
+followed by their frequencies, in a single file which is memory-mapped
+read-only - so all of the server's workers share the same pages through
+the OS page cache, instead of every worker decompressing and loading the
+dictionary into a Python dict. Lookups are binary searches directly on
+the mapped table (see `build_dictionary.py` for building the file).
+"""
+import string
+from typing import Iterable
+
+import numpy as np
+
+MAGIC = b'OCRDICT1'
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('count', '<u4'), ('width', '<u4')])
+FREQUENCY_DTYPE = np.dtype('<u4')
+LETTERS = string.ascii_lowercase  # the letters used for generating the candidates of a word
+
+
+class InvalidDictionaryError(Exception):
+    """Exception raised when the file is not a dictionary built by `build_dictionary`."""
+
+
+def build_dictionary(frequencies: dict[str, int], path: str) -> None:
+    """
+    Build the binary dictionary file: a header (magic, number of words and
+    the width of the string table), the words sorted by their UTF-8 bytes
+    (padded with null bytes to the width of the longest word), and then
+    the frequency of every word (aligned to 4 bytes).
+    """
+    encoded = sorted((word.encode(), count) for word, count in frequencies.items() if word)
+    width = max((len(word) for word, _ in encoded), default=1)
+    words = np.array([word for word, _ in encoded], dtype=f'S{width}')
+    counts = np.array([min(count, np.iinfo(FREQUENCY_DTYPE).max) for _, count in encoded],
+                      dtype=FREQUENCY_DTYPE)
+    header = np.array([(MAGIC, len(words), width)], dtype=HEADER_DTYPE)
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(words.tobytes())
+        f.write(b'\0' * (-f.tell() % FREQUENCY_DTYPE.itemsize))
+        f.write(counts.tobytes())
+
+
+class FrequencyDictionary:
+    """
+    A read-only word-frequency dictionary, memory-mapped from the file
+    built by `build_dictionary`. Corrects words the same way as
+    pyspellchecker's `SpellChecker.correction`: the most frequent known
+    word among the word itself, the words one edit away, and the words
+    two edits away (only the first of which that has known words).
+    """
+
+    def __init__(self, path: str):
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) != 1 or header['magic'][0] != MAGIC:
+            raise InvalidDictionaryError(f'{path} is not a binary dictionary.')
+        count, width = int(header['count'][0]), int(header['width'][0])
+        self._width = width
+        self._words = np.memmap(path, dtype=f'S{width}', mode='r',
+                                offset=HEADER_DTYPE.itemsize, shape=(count,))
+        words_end = HEADER_DTYPE.itemsize + count * width
+        self._frequencies = np.memmap(path, dtype=FREQUENCY_DTYPE, mode='r',
+                                      offset=words_end + (-words_end % FREQUENCY_DTYPE.itemsize),
+                                      shape=(count,))
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def __contains__(self, word: str) -> bool:
+        return bool(self.frequencies([word])[0])
+
+    @property
+    def words(self) -> np.ndarray:
+        """The sorted (UTF-8 encoded) string table."""
+        return self._words
+
+    @property
+    def word_frequencies(self) -> np.ndarray:
+        """The frequency of every word of the string table."""
+        return self._frequencies
+
+    def frequencies(self, words: Iterable[str]) -> np.ndarray:
+        """Get the frequency of every word (0 for unknown words), using a
+        single vectorized binary search over the string table."""
+        encoded = [word.encode() for word in words]
+        result = np.zeros(len(encoded), dtype=FREQUENCY_DTYPE)
+        # longer words cannot be in the table (and would be truncated by NumPy)
+        fits = np.array([0 < len(word) <= self._width for word in encoded], dtype=bool)
+        if not fits.any():
+            return result
+        keys = np.array([word for word, fit in zip(encoded, fits) if fit],
+                        dtype=f'S{self._width}')
+        indices = np.searchsorted(self._words, keys)
+        found = indices < len(self._words)
+        found[found] = self._words[indices[found]] == keys[found]
+        result[np.flatnonzero(fits)[found]] = self._frequencies[indices[found]]
+        return result
+
+    def known(self, words: Iterable[str]) -> list[str]:
+        """Get the words (of the given ones) that are in the dictionary."""
+        words = sorted(set(words))
+        return [word for word, frequency in zip(words, self.frequencies(words)) if frequency]
+
+    def prefix_ranges(self, prefixes: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the ranges `[first, last)` of the indices of the words that start
+        with every prefix (empty ranges for prefixes no word starts with) -
+        so the sorted table can be walked like a trie of the words, a whole
+        level at a time.
+        """
+        encoded = [prefix.encode() for prefix in prefixes]
+        first = np.zeros(len(encoded), dtype=np.int64)
+        last = np.zeros(len(encoded), dtype=np.int64)
+        fits = np.array([len(prefix) < self._width for prefix in encoded], dtype=bool)
+        if fits.any():
+            keys = [prefix for prefix, fit in zip(encoded, fits) if fit]
+            first[fits] = np.searchsorted(self._words, np.array(keys, dtype=f'S{self._width}'))
+            # the words starting with the prefix are sorted before the prefix
+            # followed by the largest byte
+            last[fits] = np.searchsorted(self._words, np.array([key + b'\xff' for key in keys],
+                                                                dtype=f'S{self._width}'))
+        return first, last
+
+    def correction(self, word: str) -> str:
+        """Get the most probable spelling of the word (the word itself if it
+        is known, is a number or punctuation, or no candidate is known)."""
+        word = word.lower()
+        if not self._should_check(word):
+            return word
+        for candidates in (lambda: [word], lambda: edits1(word), lambda: edits2(word)):
+            candidates = sorted(set(candidates()))
+            frequencies = self.frequencies(candidates)
+            if frequencies.any():
+                return candidates[int(np.argmax(frequencies))]
+        return word
+
+    def _should_check(self, word: str) -> bool:
+        if not word or (len(word) == 1 and word in string.punctuation):
+            return False
+        if len(word.encode()) > self._width + 2:  # up to 2 letters may be removed
+            return False
+        try:  # numbers are not spellchecked
+            float(word)
+            return word in ('nan', 'inf', 'infinity')
+        except ValueError:
+            return True
+
+
+def edits1(word: str) -> set[str]:
+    """Get all of the strings one edit (deletion, transposition,
+    replacement or insertion of a letter) away from the word."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [left + right[1:] for left, right in splits if right]
+    transposes = [left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1]
+    replaces = [left + c + right[1:] for left, right in splits if right for c in LETTERS]
+    inserts = [left + c + right for left, right in splits for c in LETTERS]
+    return set(deletes + transposes + replaces + inserts)
+
+
+def edits2(word: str) -> set[str]:
+    """Get all of the strings two edits away from the word."""
+    return {e2 for e1 in edits1(word) for e2 in edits1(e1)}
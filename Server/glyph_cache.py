@@ -0,0 +1,196 @@
+"""
+Module for caching the predictions of glyphs (the normalized images of
+single characters). Printed documents repeat the same glyphs many times,
+so only the unique glyphs are passed through the models, and their
+predictions are reused for every other occurrence, on the same page and
+across requests.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+import cv2
+
+import consts
+import metrics
+
+PERCEPTUAL_HASH_SIZE = (16, 16)  # 256 bit hash
+# the number of set bits of every byte
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], np.int32)
+
+
+class GlyphCache:
+    """
+    A bounded least-recently-used cache, mapping the hash of a normalized
+    glyph to the prediction of the models over it.
+    The hash is either exact (over the binarized glyph), or perceptual,
+    in which case glyphs whose hashes differ by at most `max_distance`
+    bits are treated as the same glyph.
+    """
+    EXACT = 'exact'
+    PERCEPTUAL = 'perceptual'
+
+    def __init__(self, max_size: int = consts.GLYPH_CACHE_SIZE,
+                 mode: str = consts.GLYPH_HASH_MODE,
+                 max_distance: int = consts.GLYPH_HASH_MAX_DISTANCE):
+        if mode not in (self.EXACT, self.PERCEPTUAL):
+            raise ValueError(f'Glyph hash mode must be {self.EXACT!r} or {self.PERCEPTUAL!r}')
+        self._max_size = max_size
+        self._mode = mode
+        self._max_distance = max_distance if mode == self.PERCEPTUAL else 0
+        self._entries: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        # in perceptual mode, the cached hashes as a matrix (a row of bytes per
+        # slot, allocated with the first hash) and the key in every slot - updated
+        # in place as entries are stored and evicted, never rebuilt
+        self._hash_matrix: Optional[np.ndarray] = None
+        self._slot_keys: list[Optional[bytes]] = []
+        self._slots: dict[bytes, int] = {}
+        self._free_slots: list[int] = []
+
+    def glyph_hash(self, glyph: np.ndarray) -> bytes:
+        """Hash a normalized glyph (pixel values between 0.0 and 1.0)."""
+        if self._mode == self.EXACT:
+            binarized = np.packbits(glyph > 0.5)
+            return hashlib.blake2b(binarized.tobytes(), digest_size=16).digest()
+        # average the glyph over a small grid, and mark the cells holding ink
+        small = cv2.resize(glyph.astype(np.float32), PERCEPTUAL_HASH_SIZE,
+                           interpolation=cv2.INTER_AREA)
+        return np.packbits(small < 0.5).tobytes()
+
+    def glyph_hashes(self, glyphs: np.ndarray) -> list[bytes]:
+        """Hash all of the normalized glyphs (the same as `glyph_hash`), binarizing
+        them at once in exact mode."""
+        if self._mode == self.EXACT:
+            binarized = np.packbits((glyphs > 0.5).reshape(len(glyphs), -1), axis=1)
+            return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in binarized]
+        return [self.glyph_hash(glyph) for glyph in glyphs]
+
+    def predict(self, glyphs: np.ndarray,
+                predict_fn: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        Get the predictions over all of the glyphs, passing only the unique
+        glyphs which are not already cached through the models.
+
+        Args:
+            glyphs (np.ndarray): The normalized glyphs, of shape `(n, *image_size)`.
+            predict_fn (Callable[[np.ndarray], np.ndarray]): A function that
+              receives a batch of glyphs and returns their predictions.
+
+        Returns:
+            np.ndarray: The predictions, in the same order as the glyphs.
+        """
+        if not len(glyphs):
+            return np.empty((0, len(consts.CLASSES)))
+
+        keys = self.glyph_hashes(glyphs)
+        # the index of the first occurrence of every unique glyph on the page
+        first_occurrence = {}
+        for i, key in enumerate(keys):
+            first_occurrence.setdefault(key, i)
+
+        predictions_by_key = {}
+        with self._lock:
+            for key in first_occurrence:
+                if (cached_key := self._find(key)) is not None:
+                    self._entries.move_to_end(cached_key)
+                    predictions_by_key[key] = self._entries[cached_key]
+
+        missing = [key for key in first_occurrence if key not in predictions_by_key]
+        representatives = self._group_similar(missing)
+        to_predict = list(dict.fromkeys(representatives.values()))
+        if to_predict:
+            batch = np.array([glyphs[first_occurrence[key]] for key in to_predict])
+            predictions = predict_fn(batch)
+            with self._lock:
+                for key, prediction in zip(to_predict, predictions):
+                    self._store(key, prediction)
+            predictions_by_key.update(zip(to_predict, predictions))
+        for key, representative in representatives.items():
+            predictions_by_key[key] = predictions_by_key[representative]
+
+        cached = sum(1 for key in keys if key not in representatives)
+        metrics.increment('glyph_cache.glyphs', len(glyphs))
+        metrics.increment('glyph_cache.hits', cached)
+        metrics.increment('glyph_cache.predicted', len(to_predict))
+        print(f'Glyph cache: {len(glyphs)} glyphs, {len(first_occurrence)} unique, '
+              f'{cached} cached, {len(to_predict)} passed through the models')
+        return np.array([predictions_by_key[key] for key in keys])
+
+    def clear(self) -> None:
+        """Remove all of the cached predictions (e.g. after the models change)."""
+        with self._lock:
+            self._entries.clear()
+            self._hash_matrix = None
+            self._slot_keys, self._slots, self._free_slots = [], {}, []
+
+    def _find(self, key: bytes) -> Optional[bytes]:
+        """Find the cached key matching the given key, if there is any."""
+        if key in self._entries:
+            return key
+        if not self._max_distance or not self._slots:
+            return None
+        distances = _hamming_distances(self._hash_matrix[:len(self._slot_keys)], key)
+        # the free slots never match
+        distances[self._free_slots] = self._max_distance + 1
+        closest = int(np.argmin(distances))
+        if distances[closest] <= self._max_distance:
+            return self._slot_keys[closest]
+        return None
+
+    def _store(self, key: bytes, prediction: np.ndarray) -> None:
+        if key not in self._entries:
+            while self._entries and len(self._entries) >= self._max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                if self._max_distance:
+                    self._free_slot(evicted)
+            if self._max_distance:
+                self._fill_slot(key)
+        self._entries[key] = prediction
+        self._entries.move_to_end(key)
+
+    def _fill_slot(self, key: bytes) -> None:
+        """Put the hash into a free slot of the matrix."""
+        if self._hash_matrix is None:
+            self._hash_matrix = np.zeros((max(1, self._max_size), len(key)), np.uint8)
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_keys[slot] = key
+        else:
+            slot = len(self._slot_keys)
+            self._slot_keys.append(key)
+        self._hash_matrix[slot] = np.frombuffer(key, np.uint8)
+        self._slots[key] = slot
+
+    def _free_slot(self, key: bytes) -> None:
+        slot = self._slots.pop(key)
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    def _group_similar(self, keys: list[bytes]) -> dict[bytes, bytes]:
+        """Map every key to the key of a similar glyph, that will be
+        predicted in its place."""
+        if not self._max_distance or not keys:
+            return {key: key for key in keys}
+        # the hashes of the representatives, a row each, filled as they are found
+        matrix = np.empty((len(keys), len(keys[0])), np.uint8)
+        representatives, groups = [], {}
+        for key in keys:
+            if representatives:
+                distances = _hamming_distances(matrix[:len(representatives)], key)
+                closest = int(np.argmin(distances))
+                if distances[closest] <= self._max_distance:
+                    groups[key] = representatives[closest]
+                    continue
+            matrix[len(representatives)] = np.frombuffer(key, np.uint8)
+            representatives.append(key)
+            groups[key] = key
+        return groups
+
+
+def _hamming_distances(hashes: np.ndarray, key: bytes) -> np.ndarray:
+    """Count the bits that differ between the key and every row of the
+    matrix of hashes (the bytes of a hash in every row)."""
+    return POPCOUNT[hashes ^ np.frombuffer(key, np.uint8)].sum(axis=1)
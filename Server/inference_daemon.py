@@ -0,0 +1,260 @@
+"""
+Module for the local inference daemon - a single process that owns the
+models, and serves the predictions of the server's workers over a Unix
+socket. The glyphs and the predictions travel through shared memory
+(only a small JSON message goes through the socket), and the requests of
+all of the workers are gathered into micro-batches, so the models run in
+one well-tuned, batch-friendly process instead of a copy in every worker.
+
+Usage: python inference_daemon.py  (and set `INFERENCE_DAEMON_ENABLED` in `consts.py`)
+"""
+import functools
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import consts
+from model_errors import ModelNotLoadedError
+
+PREDICTION_DTYPE = np.float32
+# the full tier, with the slim denoiser instead of the autoencoder
+SLIM_DAEMON_TIER = 'slim'
+
+
+class InferenceError(Exception):
+    """Exception raised when the inference daemon fails to serve a request."""
+
+
+def _attach(name: str) -> SharedMemory:
+    """Attach to a shared memory block created by another process. The
+    block is owned (and unlinked) by its creator, so it should not be
+    tracked (and unlinked when this process exits) by this process."""
+    shm = SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class _Request:
+    """A request waiting to be predicted, as part of a micro-batch."""
+
+    def __init__(self, tier: str, glyphs: np.ndarray, output: np.ndarray):
+        self.tier = tier
+        self.glyphs = glyphs
+        self.output = output
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves predictions over a Unix socket. Every connection is handled by
+    its own thread, which queues its requests, and a single batching
+    thread predicts the queued requests of every tier together - waiting
+    up to `consts.INFERENCE_BATCH_WAIT` seconds for more requests to
+    join, up to `consts.INFERENCE_MAX_BATCH` glyphs in a batch.
+    """
+    daemon_threads = True
+
+    def __init__(self, path: str, predict_fns: dict):
+        if os.path.exists(path):
+            os.remove(path)  # left over by a previous run
+        super().__init__(path, _ConnectionHandler)
+        self._predict_fns = predict_fns
+        self._queue: queue.Queue[_Request] = queue.Queue()
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+
+    def predict(self, tier: str, glyphs: np.ndarray, output: np.ndarray) -> None:
+        """Queue the glyphs, and wait until their predictions are written
+        into the output."""
+        if tier not in self._predict_fns:
+            raise ModelNotLoadedError(f'The model of the {tier} tier is not loaded.')
+        request = _Request(tier, glyphs, output)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+    def _batch_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].glyphs)
+            deadline = time.monotonic() + consts.INFERENCE_BATCH_WAIT
+            while size < consts.INFERENCE_MAX_BATCH:
+                try:
+                    request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.glyphs)
+            for tier in {request.tier for request in batch}:
+                self._predict_batch([request for request in batch if request.tier == tier])
+
+    def _predict_batch(self, requests: list[_Request]) -> None:
+        """Predict the glyphs of all of the requests (of the same tier) at once."""
+        try:
+            predictions = self._predict_fns[requests[0].tier](
+                np.concatenate([request.glyphs for request in requests]))
+            ends = np.cumsum([len(request.glyphs) for request in requests])
+            for request, request_predictions in zip(requests, np.split(predictions, ends[:-1])):
+                request.output[:] = request_predictions
+        except Exception as e:  # the error is raised in the thread of every request
+            for request in requests:
+                request.error = e
+        print(f'Inference: {len(requests)} requests, '
+              f'{sum(len(request.glyphs) for request in requests)} glyphs')
+        for request in requests:
+            request.done.set()
+
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    """
+    Handles the requests of a single connection (a thread of a worker).
+    Every request is a line of JSON: the tier, the name of the shared
+    memory block and the shape of the glyphs at its start. The predictions
+    are written into the block right after the glyphs, and the response
+    is a line of JSON - `{}`, or `{'error': ...}` if the request failed.
+    """
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                self._serve(json.loads(line))
+                response = {}
+            except ModelNotLoadedError as e:
+                response = {'error': str(e), 'model_not_loaded': True}
+            except Exception as e:
+                response = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+    def _serve(self, request: dict) -> None:
+        shm = _attach(request['shm'])
+        try:
+            shape = tuple(request['shape'])
+            glyphs = np.ndarray(shape, dtype=PREDICTION_DTYPE, buffer=shm.buf)
+            output = np.ndarray((shape[0], len(consts.CLASSES)), dtype=PREDICTION_DTYPE,
+                                buffer=shm.buf, offset=glyphs.nbytes)
+            self.server.predict(request['tier'], glyphs, output)
+            # the views have to be released before closing the block
+            del glyphs, output
+        finally:
+            shm.close()
+
+
+class InferenceClient:
+    """
+    Sends predictions to the inference daemon. Every thread has its own
+    connection, so the requests of concurrent threads are not serialized
+    (and are batched together by the daemon).
+    """
+
+    def __init__(self, path: str = consts.INFERENCE_SOCKET_PATH):
+        self._path = path
+        self._local = threading.local()
+
+    def predict(self, glyphs: np.ndarray, tier: str = consts.DEFAULT_MODEL_TIER) -> np.ndarray:
+        """
+        Predict the probabilities of the glyphs, with the models of the tier.
+
+        Args:
+            glyphs (np.ndarray): The glyphs, prepared for the model of the tier.
+            tier (str): The tier of models to use.
+        Returns:
+            np.ndarray: The predictions, of shape `(n, len(consts.CLASSES))`.
+        Raises:
+            ModelNotLoadedError: If the daemon did not load the model of the tier.
+            InferenceError: If the daemon cannot be reached, or failed to
+              predict the glyphs.
+        """
+        glyphs = np.asarray(glyphs, dtype=PREDICTION_DTYPE)
+        if len(glyphs) == 0:
+            return np.empty((0, len(consts.CLASSES)), dtype=PREDICTION_DTYPE)
+        output_bytes = len(glyphs) * len(consts.CLASSES) * PREDICTION_DTYPE().itemsize
+        shm = SharedMemory(create=True, size=glyphs.nbytes + output_bytes)
+        try:
+            np.ndarray(glyphs.shape, dtype=PREDICTION_DTYPE, buffer=shm.buf)[:] = glyphs
+            response = self._send({'tier': tier, 'shm': shm.name, 'shape': list(glyphs.shape)})
+            if response.get('model_not_loaded'):
+                raise ModelNotLoadedError(response['error'])
+            if 'error' in response:
+                raise InferenceError(response['error'])
+            return np.ndarray((len(glyphs), len(consts.CLASSES)), dtype=PREDICTION_DTYPE,
+                              buffer=shm.buf, offset=glyphs.nbytes).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _send(self, request: dict) -> dict:
+        """Send the request over the connection of this thread (connecting
+        if needed), and wait for the response."""
+        try:
+            if getattr(self._local, 'stream', None) is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self._path)
+                self._local.stream = sock.makefile('rwb')
+            stream = self._local.stream
+            stream.write(json.dumps(request).encode() + b'\n')
+            stream.flush()
+            line = stream.readline()
+        except OSError as e:
+            self._local.stream = None
+            raise InferenceError(f'Cannot reach the inference daemon: {e}') from e
+        if not line:
+            self._local.stream = None
+            raise InferenceError('The inference daemon closed the connection.')
+        return json.loads(line)
+
+
+def main():
+    # the models are imported here, so the workers can import the client
+    # without TensorFlow (see `model_registry.py`)
+    import config_tf
+    from cascade import cascade_predict
+    from fast_ocr_model import FastOCRModel
+    from noise_remover import DenoisingAutoencoder
+    from model_registry import ModelRegistry
+    from ocr_model import OCRModel
+    from slim_noise_remover import SlimDenoisingAutoencoder
+
+    # the same version the workers report (see `ModelRegistry.start`)
+    registry = ModelRegistry()
+    version = registry.startup_version()
+    directory = registry.directory(version)
+
+    model = OCRModel()
+    denoiser = DenoisingAutoencoder()
+    model.load_model(os.path.join(directory, OCRModel.MODEL_NAME))
+    denoiser.load_model(os.path.join(directory, DenoisingAutoencoder.MODEL_NAME))
+
+    def predict_full(glyphs: np.ndarray, denoiser: DenoisingAutoencoder = denoiser) -> np.ndarray:
+        # the same as `predict_glyphs` in `ocr.py`
+        if consts.CASCADE_ENABLED:
+            return cascade_predict(glyphs, model.predict_batch, denoiser.denoise_batch)
+        return model.predict_batch(denoiser.denoise_batch(glyphs))
+
+    # 'raw' - the classifier of the full tier without denoising (when a deadline is close)
+    predict_fns = {'full': predict_full, 'raw': model.predict_batch}
+    if os.path.exists(os.path.join(directory, SlimDenoisingAutoencoder.MODEL_NAME)):
+        slim_denoiser = SlimDenoisingAutoencoder()
+        slim_denoiser.load_model(os.path.join(directory, SlimDenoisingAutoencoder.MODEL_NAME))
+        predict_fns[SLIM_DAEMON_TIER] = functools.partial(predict_full, denoiser=slim_denoiser)
+    if os.path.exists(os.path.join(directory, FastOCRModel.MODEL_NAME)):
+        fast_model = FastOCRModel()
+        fast_model.load_model(os.path.join(directory, FastOCRModel.MODEL_NAME))
+        predict_fns['fast'] = fast_model.predict_batch
+
+    with InferenceDaemon(consts.INFERENCE_SOCKET_PATH, predict_fns) as daemon:
+        print(f'Serving the {", ".join(predict_fns)} tiers of version {version!r} '
+              f'on {consts.INFERENCE_SOCKET_PATH}')
+        daemon.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
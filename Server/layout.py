@@ -0,0 +1,111 @@
+"""
+Module for analysing the layout of the page - splitting the thresholded
+page into blocks of text (columns, paragraphs) in reading order, using
+recursive cuts along blank rows and columns (whitespace projection).
+"""
+from typing import Union
+
+import numpy as np
+
+import consts
+from bounding_rects import Rect
+from packed_image import PackedImage, as_packed, column_projection, crop, row_projection
+
+BLOCK_MARGIN = 2  # blank pixels kept around every block (at most half the gap to the next block)
+
+
+def find_text_blocks(img: Union[np.ndarray, PackedImage]) -> list[Rect]:
+    """
+    Split the page into blocks of text, in reading order: blocks separated
+    by blank rows are read from top to bottom, and blocks separated by
+    blank columns (within the same rows) from left to right. The widest
+    gaps are cut first, so columns are separated before their lines.
+
+    Args:
+        img (Union[np.ndarray, PackedImage]): The thresholded page (black
+          text over white), or the packed page (see `packed_image.py`).
+
+    Returns:
+        list[Rect]: The blocks, as rects within the page.
+    """
+    page = as_packed(img)
+    h, w = page.shape
+    min_row_gap = max(1, int(h * consts.LAYOUT_MIN_ROW_GAP_RATIO))
+    min_column_gap = max(1, int(w * consts.LAYOUT_MIN_COLUMN_GAP_RATIO))
+    blocks = []
+    _cut(page, Rect(0, 0, w, h), Rect(0, 0, w, h), min_row_gap, min_column_gap, blocks)
+    if not blocks:
+        return [Rect(0, 0, w, h)]
+    return [_add_margin(block, bounds) for block, bounds in blocks]
+
+
+def _cut(page: PackedImage, region: Rect, bounds: Rect, min_row_gap: int, min_column_gap: int,
+         blocks: list[tuple[Rect, Rect]]) -> None:
+    """Recursively cut the region in two along its widest blank gap (rows
+    or columns, relative to the minimal gap of each), and add the regions
+    that cannot be cut to the blocks - with their bounds, the area between
+    the middles of the gaps they were cut along (their margins stay in it)."""
+    region_page = crop(page, region)
+    rows = content_runs(row_projection(region_page), min_row_gap)
+    if not rows:
+        return  # blank region
+    columns = content_runs(column_projection(region_page), min_column_gap)
+    top, bottom = rows[0][0], rows[-1][1]
+    left, right = columns[0][0], columns[-1][1]
+
+    row_gap, row_split = _widest_gap(rows)
+    column_gap, column_split = _widest_gap(columns)
+    if row_gap and row_gap / min_row_gap >= column_gap / min_column_gap:
+        parts = [Rect(left, top, right - left, rows[row_split][1] - top),
+                 Rect(left, rows[row_split + 1][0], right - left,
+                      bottom - rows[row_split + 1][0])]
+        middle = region.y + rows[row_split][1] + row_gap // 2
+        parts_bounds = [Rect(bounds.x, bounds.y, bounds.w, middle - bounds.y),
+                        Rect(bounds.x, middle, bounds.w, bounds.y + bounds.h - middle)]
+    elif column_gap:
+        parts = [Rect(left, top, columns[column_split][1] - left, bottom - top),
+                 Rect(columns[column_split + 1][0], top,
+                      right - columns[column_split + 1][0], bottom - top)]
+        middle = region.x + columns[column_split][1] + column_gap // 2
+        parts_bounds = [Rect(bounds.x, bounds.y, middle - bounds.x, bounds.h),
+                        Rect(middle, bounds.y, bounds.x + bounds.w - middle, bounds.h)]
+    else:
+        blocks.append((Rect(region.x + left, region.y + top, right - left, bottom - top), bounds))
+        return
+    for part, part_bounds in zip(parts, parts_bounds):
+        _cut(page, Rect(region.x + part.x, region.y + part.y, part.w, part.h), part_bounds,
+             min_row_gap, min_column_gap, blocks)
+
+
+def _widest_gap(runs: list[tuple[int, int]]) -> tuple[int, int]:
+    """Get the width of the widest gap between the runs, and the index of
+    the run before it (the width is 0 if there is only one run)."""
+    gaps = [next_start - end for (_, end), (next_start, _) in zip(runs[:-1], runs[1:])]
+    if not gaps:
+        return 0, 0
+    widest = int(np.argmax(gaps))
+    return gaps[widest], widest
+
+
+def content_runs(has_ink: np.ndarray, min_gap: int) -> list[tuple[int, int]]:
+    """
+    Get the (start, end) of the runs of lines (rows or columns) with ink,
+    merging runs separated by fewer than `min_gap` blank lines.
+    """
+    indices = np.flatnonzero(has_ink)
+    if not len(indices):
+        return []
+    # positions where the blank gap between two lines with ink is wide enough
+    breaks = np.flatnonzero(np.diff(indices) > min_gap)
+    starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+    ends = np.concatenate((indices[breaks] + 1, [indices[-1] + 1]))
+    return [(int(start), int(end)) for start, end in zip(starts, ends)]
+
+
+def _add_margin(block: Rect, bounds: Rect) -> Rect:
+    """Add the margin around the block, within its bounds - so the blocks
+    never overlap, however narrow the gaps between them."""
+    x, y = max(bounds.x, block.x - BLOCK_MARGIN), max(bounds.y, block.y - BLOCK_MARGIN)
+    right = min(bounds.x + bounds.w, block.x + block.w + BLOCK_MARGIN)
+    bottom = min(bounds.y + bounds.h, block.y + block.h + BLOCK_MARGIN)
+    return Rect(x, y, right - x, bottom - y)
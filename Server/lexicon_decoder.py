@@ -0,0 +1,105 @@
+"""
+Module for decoding the predictions of the characters of a word into an
+in-vocabulary word, using the full probabilities the model computed for
+every character (instead of only the most probable character), and the
+frequencies of the words as priors.
+"""
+import heapq
+from typing import Optional
+
+import numpy as np
+
+import consts
+from frequency_dictionary import FrequencyDictionary
+
+
+class LexiconDecoder:
+    """
+    Decodes words with a beam search over the trie of the words of a
+    `FrequencyDictionary` (the ranges of its sorted string table). Every
+    character of the word extends the best prefixes with the most probable
+    characters, keeping only prefixes of dictionary words, ranked by the
+    probabilities of their characters and the frequency of the most
+    frequent word they may still become. That frequency is the maximum over
+    the range of the prefix, answered in constant time from a sparse table
+    of the maximums of the ranges of every power-of-two length, built once
+    per dictionary.
+    """
+
+    def __init__(self, dictionary: FrequencyDictionary,
+                 beam_width: int = consts.LEXICON_BEAM_WIDTH,
+                 branching: int = consts.LEXICON_BRANCHING,
+                 prior_weight: float = consts.LEXICON_PRIOR_WEIGHT):
+        self._dictionary = dictionary
+        self._beam_width = beam_width
+        self._branching = branching
+        self._prior_weight = prior_weight
+        self._log_total = np.log(np.sum(dictionary.word_frequencies, dtype=np.float64))
+        self._range_maxima = build_range_maxima(dictionary.word_frequencies)
+
+    def decode(self, predictions: np.ndarray) -> Optional[tuple[str, float]]:
+        """
+        Decode the most probable in-vocabulary word.
+
+        Args:
+            predictions (np.ndarray): The probabilities of the classes of every
+              character of the word, of shape `(characters, len(CLASSES))`.
+        Returns:
+            Optional[tuple[str, float]]: The word and the confidence in it (its
+              share of the probability of all the words left in the beam), or
+              None if no dictionary word fits the characters.
+        """
+        if not len(predictions):
+            return None
+        log_probabilities = np.log(np.clip(predictions, 1e-12, 1.0))
+        beam = [('', 0.0)]  # the prefixes, and the log-probability of their characters
+        for i, step in enumerate(log_probabilities):
+            top_classes = np.argsort(step)[::-1][:self._branching]
+            prefixes = [prefix + consts.CLASSES[c] for prefix, _ in beam for c in top_classes]
+            scores = [score + step[c] for _, score in beam for c in top_classes]
+            if i == len(log_probabilities) - 1:
+                # whole words only, with their own frequencies
+                priors = self._dictionary.frequencies(prefixes)
+            else:
+                priors = range_max(self._range_maxima, *self._dictionary.prefix_ranges(prefixes))
+            candidates = [(score + self._prior_weight * (np.log(prior) - self._log_total),
+                           prefix, score)
+                          for prefix, score, prior in zip(prefixes, scores, priors) if prior]
+            if not candidates:
+                return None
+            candidates = heapq.nlargest(self._beam_width, candidates)
+            beam = [(prefix, score) for _, prefix, score in candidates]
+
+        totals = np.array([total for total, _, _ in candidates])
+        confidence = 1 / np.sum(np.exp(totals - totals[0]))
+        return candidates[0][1], float(confidence)
+
+
+def build_range_maxima(values: np.ndarray) -> list[np.ndarray]:
+    """
+    Build the sparse table of the range maximums of the values: the k-th
+    level holds the maximum of every range of length `2 ** k`, by its first
+    index (the first level is the values themselves).
+    """
+    levels = [np.asarray(values)]
+    length = 1
+    while 2 * length <= len(values):
+        previous = levels[-1]
+        levels.append(np.maximum(previous[:-length], previous[length:]))
+        length *= 2
+    return levels
+
+
+def range_max(levels: list[np.ndarray], first: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """
+    Get the maximum of the values in every range `[first, last)`, from the
+    sparse table built by `build_range_maxima` - the maximum of the two
+    (overlapping) ranges of the longest power-of-two length that fits, at
+    both ends of the range. Empty ranges are 0.
+    """
+    first, last = np.asarray(first, dtype=np.int64), np.asarray(last, dtype=np.int64)
+    maxima = np.zeros(len(first), dtype=levels[0].dtype)
+    for i in np.flatnonzero(first < last):
+        k = int(last[i] - first[i]).bit_length() - 1
+        maxima[i] = max(levels[k][first[i]], levels[k][last[i] - (1 << k)])
+    return maxima
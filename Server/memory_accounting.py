@@ -0,0 +1,119 @@
+"""
+Module for accounting the memory used by requests, to find the requests
+(and the stages of the pipeline) that cause memory spikes. A sample of
+the requests (`consts.MEMORY_SAMPLE_RATE`) is traced with tracemalloc,
+which sees the allocations of Python and NumPy, and the change in the
+resident memory of the process (RSS) is recorded as well - for memory
+allocated outside of Python, such as by TensorFlow.
+Only one request is traced at a time, and tracing is off between traced
+requests, so the overhead stays low enough for production.
+"""
+import contextvars
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import consts
+
+_lock = threading.Lock()  # held while a request is traced
+_current_record = contextvars.ContextVar('memory_record', default=None)
+_recent_records = deque(maxlen=consts.MEMORY_RECENT_REQUESTS)
+
+
+def current_rss() -> Optional[int]:
+    """Get the resident memory of the process in bytes (None if it is
+    unavailable on this platform)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class MemoryRecord:
+    """The memory used by a single traced request, and by each of its stages."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.time = time.time()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        self._rss_start = current_rss()
+        self.peak_bytes = 0  # above the memory traced when the request started
+        self.rss_delta_bytes = None
+        self.stages: dict[str, int] = {}  # the peak of every stage, above its start
+
+    def record_stage(self, name: str, peak_bytes: int, absolute_peak: int) -> None:
+        self.stages[name] = max(self.stages.get(name, 0), peak_bytes)
+        self.peak_bytes = max(self.peak_bytes, absolute_peak - self._baseline)
+
+    def finish(self) -> None:
+        self.peak_bytes = max(self.peak_bytes,
+                              tracemalloc.get_traced_memory()[1] - self._baseline)
+        if self._rss_start is not None:
+            self.rss_delta_bytes = current_rss() - self._rss_start
+
+    def headers(self) -> dict[str, str]:
+        """The memory used, as headers of the response."""
+        headers = {'X-Memory-Peak-Bytes': str(self.peak_bytes),
+                   'X-Memory-Stages': ';'.join(f'{name}={peak}'
+                                               for name, peak in self.stages.items())}
+        if self.rss_delta_bytes is not None:
+            headers['X-Memory-RSS-Delta-Bytes'] = str(self.rss_delta_bytes)
+        return headers
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'time': self.time, 'peak_bytes': self.peak_bytes,
+                'rss_delta_bytes': self.rss_delta_bytes, 'stages': dict(self.stages)}
+
+
+@contextmanager
+def track_request(name: str):
+    """
+    Context manager that traces the memory used inside the block, if the
+    request is sampled (and no other request is being traced). Yields the
+    `MemoryRecord` of the request, or None if it is not traced.
+    """
+    if random.random() >= consts.MEMORY_SAMPLE_RATE or not _lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        tracemalloc.start()
+        record = MemoryRecord(name)
+        token = _current_record.set(record)
+        try:
+            yield record
+        finally:
+            record.finish()
+            _current_record.reset(token)
+            tracemalloc.stop()
+            _recent_records.append(record)
+    finally:
+        _lock.release()
+
+
+@contextmanager
+def stage(name: str):
+    """Context manager that records the peak memory of a stage of the
+    pipeline, in the request being traced (if any)."""
+    record = _current_record.get()
+    if record is None or not tracemalloc.is_tracing():
+        yield
+        return
+    start = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        record.record_stage(name, peak - start, peak)
+
+
+def heaviest_requests(count: int) -> list[dict]:
+    """Get the recent traced requests with the highest peaks, heaviest first."""
+    records = sorted(list(_recent_records), key=lambda record: record.peak_bytes, reverse=True)
+    return [record.to_dict() for record in records[:count]]
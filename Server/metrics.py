@@ -0,0 +1,57 @@
+"""
+Module for collecting runtime statistics of the server (counters and
+timings), such as cache hit rates, so the cost of every stage can be
+checked on real traffic.
+Statistics are kept per process.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_counters: dict[str, int] = defaultdict(int)
+_timings: dict[str, list[float]] = defaultdict(lambda: [0, 0.0])  # [count, total seconds]
+
+
+def increment(name: str, amount: int = 1) -> None:
+    """Increase the counter `name` by `amount`."""
+    with _lock:
+        _counters[name] += amount
+
+
+def record_time(name: str, seconds: float) -> None:
+    """Record a single measurement of the duration of `name`."""
+    with _lock:
+        timing = _timings[name]
+        timing[0] += 1
+        timing[1] += seconds
+
+
+@contextmanager
+def timed(name: str):
+    """Context manager that records the time spent inside the block."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start)
+
+
+def ratio(numerator: str, denominator: str) -> float:
+    """Get the ratio between two counters (0.0 if the denominator is zero)."""
+    with _lock:
+        total = _counters[denominator]
+        return _counters[numerator] / total if total else 0.0
+
+
+def snapshot() -> dict[str, dict]:
+    """Get a copy of all of the counters and timings collected so far."""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'timings': {name: {'count': count,
+                               'total_seconds': total,
+                               'mean_seconds': total / count if count else 0.0}
+                        for name, (count, total) in _timings.items()},
+        }
@@ -0,0 +1,17 @@
+"""
+Module for the errors of the models - apart from `base_model.py`, so the
+modules which do not run the models themselves (e.g. the client of the
+inference daemon) can handle them without importing TensorFlow.
+"""
+
+
+class ModelError(Exception):
+    """Base model exception"""
+
+
+class ModelNotLoadedError(ModelError):
+    """Exception raised when trying to predict on an unloaded model."""
+
+
+class ModelNotBuiltError(ModelError):
+    """Exception raised when trying to train an un built model."""
@@ -96,3 +96,18 @@ class ModelEvaluator:
         self._calc_accuracy()
         self._show_cm()
         self._print_cr()
+
+
+def load_labeled_images(folder_path: str) -> tuple[np.ndarray, np.ndarray]:
+    """Load the images (scaled between 0.0 and 1.0) and their class indices."""
+    img_gen = ImageDataGenerator(rescale=1 / 255)
+    images = img_gen.flow_from_directory(
+        directory=folder_path,
+        target_size=consts.IMAGE_SIZE,
+        classes=consts.CLASSES,
+        shuffle=False,
+        color_mode='grayscale',
+        class_mode='sparse'
+    )
+    imgs = np.concatenate([images[i][0] for i in range(len(images))])
+    return imgs, images.classes
@@ -0,0 +1,244 @@
+"""
+Module for the versions of the models, so a retrained model can be
+deployed without restarting the server. Every version is a directory in
+`consts.MODELS_DIR` (e.g. `models/2024-06-01/`), holding the files of the
+models (`ocr_model.h5`, `noise_remover.h5`, and optionally
+`fast_ocr_model.h5`, `crnn_model.h5` and `slim_noise_remover.h5`). The
+version to serve is written to the `current` file of the directory, which
+every worker checks periodically: a new version is loaded and warmed up
+in the background, and then swapped in. Every request uses the version
+that was current when it started, until it finishes.
+Without a models directory, the models are loaded from their fixed file
+names, as the 'default' version.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+
+import consts
+import metrics
+from denoising import MorphologicalDenoiser
+from glyph_cache import GlyphCache
+
+if not consts.INFERENCE_DAEMON_ENABLED:
+    # with the inference daemon, the daemon owns the models, and the workers
+    # do not import TensorFlow at all
+    from base_model import new_instance
+    from crnn_model import CRNNModel
+    from fast_ocr_model import FastOCRModel
+    from noise_remover import DenoisingAutoencoder
+    from ocr_model import OCRModel
+    from slim_noise_remover import SlimDenoisingAutoencoder
+
+DEFAULT_VERSION = 'default'
+CURRENT_FILE = 'current'  # holds the name of the version to serve
+# the classifier of the full tier, without denoising the glyphs first - used
+# when the deadline of the request is too close for denoising
+RAW_TIER = 'raw'
+
+
+class UnknownModelVersionError(Exception):
+    """Exception raised when a version of the models does not exist."""
+
+
+class ReloadNotSupportedError(Exception):
+    """Exception raised when reloading the models with the inference daemon,
+    which loads its version only when it starts."""
+
+
+class ModelSet:
+    """
+    The models of a single version, with the caches of their predictions
+    (the predictions of one version are not valid for another).
+    """
+
+    def __init__(self, version: str, directory: str = ''):
+        self.version = version
+        self._directory = directory
+        # the denoising backends of the full tier, by name (see `denoising.py`)
+        self.denoisers = {'classical': MorphologicalDenoiser()}
+        # with the inference daemon, the glyphs are predicted (and denoised, except
+        # by the classical denoiser) by the daemon
+        self.model: Optional['OCRModel'] = None
+        self.denoiser: Optional['DenoisingAutoencoder'] = None
+        self.fast_model: Optional['FastOCRModel'] = None
+        self.crnn_model: Optional['CRNNModel'] = None
+        self.slim_denoiser: Optional['SlimDenoisingAutoencoder'] = None
+        if not consts.INFERENCE_DAEMON_ENABLED:
+            self.model = new_instance(OCRModel)
+            self.denoiser = new_instance(DenoisingAutoencoder)
+            self.fast_model = new_instance(FastOCRModel)
+            self.crnn_model = new_instance(CRNNModel)
+            self.slim_denoiser = new_instance(SlimDenoisingAutoencoder)
+            self.denoisers.update(autoencoder=self.denoiser, slim=self.slim_denoiser)
+        # glyphs of different tiers (and denoisers) are normalized or predicted
+        # differently, cache them separately
+        self.glyph_caches: dict[str, GlyphCache] = defaultdict(GlyphCache)
+
+    def path(self, model_class: type) -> str:
+        return os.path.join(self._directory, model_class.MODEL_NAME)
+
+    def load(self) -> None:
+        """Load the models of the version. With the inference daemon, the
+        characters are predicted by the daemon, which owns the models, so
+        there is nothing to load. The fast tier, the CRNN engine and the slim
+        denoiser are optional, they are available only after training them."""
+        if consts.INFERENCE_DAEMON_ENABLED:
+            return
+        self.model.load_model(self.path(OCRModel))
+        self.denoiser.load_model(self.path(DenoisingAutoencoder))
+        if os.path.exists(self.path(FastOCRModel)):
+            self.fast_model.load_model(self.path(FastOCRModel))
+        if os.path.exists(self.path(CRNNModel)):
+            self.crnn_model.load_model(self.path(CRNNModel))
+        if os.path.exists(self.path(SlimDenoisingAutoencoder)):
+            self.slim_denoiser.load_model(self.path(SlimDenoisingAutoencoder))
+
+    def warm_up(self) -> None:
+        """Predict a batch of blank images with every loaded model, so the first
+        requests do not pay for building TensorFlow's graphs."""
+        if consts.INFERENCE_DAEMON_ENABLED:
+            return
+        batch_size = consts.MODELS_WARM_UP_BATCH
+        if self.model.model_loaded:
+            glyphs = np.ones((batch_size,) + self.model.IMAGE_SIZE)
+            self.model.predict_batch(self.denoiser.denoise_batch(glyphs))
+        if self.fast_model.model_loaded:
+            self.fast_model.predict_batch(np.ones((batch_size,) + self.fast_model.IMAGE_SIZE))
+        if self.crnn_model.model_loaded:
+            self.crnn_model.read_words(np.ones((1, self.crnn_model.HEIGHT, self.crnn_model.WIDTH)))
+        if self.slim_denoiser.model_loaded:
+            self.slim_denoiser.denoise_batch(np.ones((batch_size,) + consts.IMAGE_SIZE))
+
+
+class ModelRegistry:
+    """
+    The versions of the models in a directory, and the version served by
+    this worker (`current`). Replacing the current version is a single
+    assignment, so requests always see a whole version.
+    """
+
+    def __init__(self, root: str = consts.MODELS_DIR):
+        self._root = root
+        self._lock = threading.Lock()  # held while a version is loaded
+        self.current: Optional[ModelSet] = None
+        self.loading: Optional[str] = None  # the version being loaded, if any
+        self.failed: Optional[str] = None  # the last version that failed to load
+        self.error: Optional[str] = None
+
+    def versions(self) -> list[str]:
+        """Get the names of the versions, sorted from the oldest to the latest
+        (by name - e.g. dates or zero-padded numbers)."""
+        if not os.path.isdir(self._root):
+            return []
+        return sorted(name for name in os.listdir(self._root)
+                      if os.path.isdir(os.path.join(self._root, name)))
+
+    def requested_version(self) -> str:
+        """Get the version that should be served - the one in the `current`
+        file, or the latest version if there is no such file."""
+        try:
+            with open(os.path.join(self._root, CURRENT_FILE)) as f:
+                return f.read().strip()
+        except OSError:
+            versions = self.versions()
+            return versions[-1] if versions else DEFAULT_VERSION
+
+    def startup_version(self) -> str:
+        """Get the version to load when starting - the requested version, or
+        the latest version (or the default one) if it does not exist. The
+        missing version is recorded as failed, so it is not checked again."""
+        version = self.requested_version()
+        if version == DEFAULT_VERSION or version in self.versions():
+            return version
+        self.failed = version
+        self.error = f'There is no version {version!r} of the models.'
+        fallback = (self.versions() or [DEFAULT_VERSION])[-1]
+        print(f'{self.error} Loading version {fallback!r} instead.')
+        return fallback
+
+    def directory(self, version: str) -> str:
+        """Get the directory of the files of the version's models."""
+        return '' if version == DEFAULT_VERSION else os.path.join(self._root, version)
+
+    def load(self, version: str) -> ModelSet:
+        """Load the models of the version, and warm them up."""
+        if version != DEFAULT_VERSION and version not in self.versions():
+            raise UnknownModelVersionError(f'There is no version {version!r} of the models.')
+        models = ModelSet(version, self.directory(version))
+        start = time.perf_counter()
+        models.load()
+        models.warm_up()
+        print(f'Loaded version {version!r} of the models in {time.perf_counter() - start:.1f}s')
+        return models
+
+    def start(self) -> None:
+        """Load the requested version (see `startup_version`), and start
+        checking for a new one in the background (every
+        `consts.MODELS_POLL_INTERVAL` seconds). With the inference daemon,
+        the daemon loads the same version, and keeps it until it restarts."""
+        self.current = self.load(self.startup_version())
+        if os.path.isdir(self._root) and not consts.INFERENCE_DAEMON_ENABLED:
+            threading.Thread(target=self._poll, daemon=True).start()
+
+    def reload(self, version: Optional[str] = None) -> str:
+        """
+        Make the version (the latest by default) the one served by all of the
+        workers, and start loading it in this worker in the background.
+
+        Returns:
+            str: The version.
+        Raises:
+            UnknownModelVersionError: If there is no such version.
+            ReloadNotSupportedError: With the inference daemon - restart the
+              daemon and the server to deploy a version instead.
+        """
+        if consts.INFERENCE_DAEMON_ENABLED:
+            raise ReloadNotSupportedError('The models are owned by the inference daemon, restart '
+                                          'it and the server to deploy a new version.')
+        version = version or (self.versions() or [None])[-1]
+        if version is None or version not in self.versions():
+            raise UnknownModelVersionError(f'There is no version {version!r} of the models.')
+        # replace the file at once, so the other workers never read half of it
+        temp_path = os.path.join(self._root, f'{CURRENT_FILE}.{os.getpid()}')
+        with open(temp_path, 'w') as f:
+            f.write(version)
+        os.replace(temp_path, os.path.join(self._root, CURRENT_FILE))
+        self.failed = None
+        self._load_in_background(version)
+        return version
+
+    def status(self) -> dict:
+        return {'current': self.current.version, 'loading': self.loading,
+                'versions': self.versions(), 'error': self.error}
+
+    def _load_in_background(self, version: str) -> None:
+        if not self._lock.acquire(blocking=False):
+            return  # another version is being loaded, the next check picks this one up
+        self.loading = version
+        threading.Thread(target=self._swap, args=(version,), daemon=True).start()
+
+    def _swap(self, version: str) -> None:
+        try:
+            models = self.load(version)
+            self.current = models
+            self.error = None
+            metrics.increment('models.swaps')
+        except Exception as e:  # keep serving the current version
+            self.failed, self.error = version, f'{type(e).__name__}: {e}'
+            metrics.increment('models.failed_loads')
+            print(f'Loading version {version!r} of the models failed: {self.error}')
+        finally:
+            self.loading = None
+            self._lock.release()
+
+    def _poll(self) -> None:
+        while True:
+            time.sleep(consts.MODELS_POLL_INTERVAL)
+            version = self.requested_version()
+            if version not in (self.current.version, self.loading, self.failed):
+                self._load_in_background(version)
@@ -2,6 +2,7 @@
 Module used to train the noise remover model,save it to HDF5 format, and later use it.
 """
 import glob
+from typing import Optional
 
 import PIL
 import cv2
@@ -11,12 +12,39 @@ from tensorflow.keras.layers import InputLayer, Conv2D, MaxPooling2D, UpSampling
 from tensorflow.keras.losses import binary_crossentropy
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.activations import relu, sigmoid
+from tensorflow.keras.callbacks import Callback
 
 import config_tf
 import consts
 from base_model import ModelNotLoadedError, BaseTFModel, singleton, ModelNotBuiltError
 
 
+def load_images(image_paths: list[str]) -> np.ndarray:
+    """
+    Load the images, resize them, convert to grayscale and scale them to
+    be between 0.0 and 1.0 (skipping files which are not images).
+
+    Args:
+        image_paths (list[str]): The paths of the images to be loaded.
+
+    Returns:
+        np.ndarray: array containing the images.
+    """
+
+    X_imgs = []
+
+    for image_path in image_paths:
+        try:
+            # convert to grayscale and resize to predefined image size
+            img = PIL.Image.open(image_path).convert('L').resize(consts.IMAGE_SIZE)
+        except PIL.UnidentifiedImageError:
+            continue
+        img_arr = np.asarray(img).astype(np.float32)  # convert to numpy array
+        img_arr = img_arr / 255  # change scale to be between 0.0 and 1.0
+        X_imgs.append(img_arr)
+    return np.array(X_imgs)
+
+
 @singleton
 class ImageLoader:
     def __init__(self):
@@ -36,18 +64,7 @@ class ImageLoader:
             np.ndarray: array containing the images.
         """
 
-        X_imgs = []
-
-        for image_path in glob.glob(path + '\\*'):
-            try:
-                # convert to grayscale and resize to predefined image size
-                img = PIL.Image.open(image_path).convert('L').resize(consts.IMAGE_SIZE)
-            except PIL.UnidentifiedImageError:
-                continue
-            img_arr = np.asarray(img).astype(np.float32)  # convert to numpy array
-            img_arr = img_arr / 255  # change scale to be between 0.0 and 1.0
-            X_imgs.append(img_arr)
-        return np.array(X_imgs)
+        return load_images(glob.glob(path + '\\*'))
 
     def load_training_validation(self):
         """
@@ -55,7 +72,7 @@ class ImageLoader:
         to fit the model specifications.
         """
 
-        if self._X_train and self._X_valid:
+        if self._X_train is not None and self._X_valid is not None:
             # images are already loaded
             return
 
@@ -162,11 +179,19 @@ class DenoisingAutoencoder(BaseTFModel):
         self._model = model
         self._model_built = True
 
-    def train_model(self) -> None:
+    def train_model(self, training_data=None, validation_data=None,
+                    callbacks: Optional[list[Callback]] = None) -> None:
         """
         Train the autoencoder with the train and validation sets of images
         and log training progress to disk.
 
+        Args:
+            training_data: Batches of (noisy, original) images to train on,
+              instead of loading the training set and adding noise to it
+              (e.g. the shard of a worker in distributed training, see
+              `distributed_training.py`).
+            validation_data: Batches of (noisy, original) validation images.
+            callbacks (Optional[list[Callback]]): The training callbacks.
         Raises:
             ModelNotBuiltError: when trying to train an un built model.
         """
@@ -174,6 +199,15 @@ class DenoisingAutoencoder(BaseTFModel):
         if not self._model_built:
             raise ModelNotBuiltError('The model has to be built before training it.')
 
+        if training_data is not None:
+            self._model.fit(training_data,
+                            epochs=self.EPOCHS,
+                            verbose=1,
+                            validation_data=validation_data,
+                            callbacks=callbacks)
+            self._model_loaded = True
+            return
+
         # load training and validation data from disk and preprocess them
         self._image_loader.load_training_validation()
         X_train, X_valid = self._image_loader.X_train, self._image_loader.X_valid
@@ -188,14 +222,15 @@ class DenoisingAutoencoder(BaseTFModel):
                         verbose=1,
                         batch_size=self.BATCH_SIZE,
                         validation_data=(X_valid_noisy, X_valid))
+        self._model_loaded = True
 
-    def save_model(self) -> None:
-        """Save the model to disk as a HDF5 file."""
-        self._model.save(self.MODEL_NAME)
+    def save_model(self, path: Optional[str] = None) -> None:
+        """Save the model to disk as a HDF5 file (`MODEL_NAME` by default)."""
+        self._model.save(path or self.MODEL_NAME)
 
-    def load_model(self) -> None:
-        """Load the model from disk into memory."""
-        self._model = load_model(self.MODEL_NAME)
+    def load_model(self, path: Optional[str] = None) -> None:
+        """Load the model from disk into memory (`MODEL_NAME` by default)."""
+        self._model = load_model(path or self.MODEL_NAME)
         self._model_loaded = True
 
     def denoise_image(self, img: np.array) -> np.array:
@@ -237,6 +272,34 @@ class DenoisingAutoencoder(BaseTFModel):
 
         return denoised
 
+    def denoise_batch(self, imgs: np.ndarray) -> np.ndarray:
+        """
+        Remove the noise from multiple images at once.
+
+        Args:
+            imgs (np.ndarray): The images to denoise, of shape
+             `(n, *consts.IMAGE_SIZE)` or `(n, *consts.IMAGE_SIZE, 1)`.
+        Returns:
+            np.ndarray: The denoised images, of shape `(n, *consts.IMAGE_SIZE, 1)`.
+        Raises:
+            ModelNotLoadedError: If the autoencoder was not loaded before
+              trying to denoise the images.
+            ValueError: In case the specified images have incorrect shape.
+        """
+        if not self._model_loaded:
+            raise ModelNotLoadedError('You have to load the model before'
+                                      ' trying to denoise image')
+        if imgs.shape[1:] != consts.IMAGE_SIZE and imgs.shape[1:] != consts.IMAGE_SIZE + (1,):
+            raise ValueError(f'Images shape must be (n, *{consts.IMAGE_SIZE}) '
+                             f'or (n, *{consts.IMAGE_SIZE + (1,)})')
+        if len(imgs) == 0:
+            return np.empty((0,) + consts.IMAGE_SIZE + (1,))
+
+        if imgs.max() > 1.0:
+            imgs = imgs / 255
+        batch = imgs.reshape((len(imgs),) + consts.IMAGE_SIZE + (1,))
+        return self._model.predict(batch, batch_size=config_tf.predict_batch_size)
+
     def evaluate(self, images):
         """Evaluate the model and calculate accuracy and loss."""
         return self._model.evaluate(images)
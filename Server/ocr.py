@@ -1,24 +1,53 @@
 """
 Module for extracting the text from an image using optical-character-recognition.
 """
+import functools
+import os
 import string
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, Union
 
 import cv2
 import numpy as np
 from spellchecker import SpellChecker
 
 import consts
-from ocr_model import OCRModel
-from noise_remover import DenoisingAutoencoder
-from bounding_rects import get_letters_bounding_rects_as_words, Rect
+import memory_accounting
+import metrics
+from bounding_rects import (get_letters_bounding_rects_table, split_lines, split_words,
+                            table_to_words, word_starts, RECT_DTYPE, Rect)
+from layout import find_text_blocks
+from packed_image import PackedImage, as_packed, crop, unpack
+from preprocessing import downscale_glyphs
+from cascade import cascade_predict
+from frequency_dictionary import FrequencyDictionary
+from lexicon_decoder import LexiconDecoder
+from inference_daemon import InferenceClient, SLIM_DAEMON_TIER
+from deadline import Deadline, allows
+from model_errors import ModelNotLoadedError
+from model_registry import ModelRegistry, ModelSet, RAW_TIER
 
-# load the models
-model = OCRModel()
-denoiser = DenoisingAutoencoder()
-model.load_model()
-denoiser.load_model()
+if consts.INFERENCE_DAEMON_ENABLED:
+    # the characters are predicted by the inference daemon, which owns the models
+    inference_client = InferenceClient(consts.INFERENCE_SOCKET_PATH)
+else:
+    inference_client = None
+# load the models (the current version, see `model_registry.py`)
+model_registry = ModelRegistry()
+model_registry.start()
 
-spellchecker = SpellChecker()
+# segmentation is mostly done by NumPy and OpenCV, which release the GIL
+layout_executor = ThreadPoolExecutor(max_workers=consts.LAYOUT_WORKERS)
+
+# the memory-mapped dictionary is shared by all of the workers, fall back to
+# loading pyspellchecker's dictionary into every worker if it was not built
+if os.path.exists(consts.DICTIONARY_PATH):
+    spellchecker = FrequencyDictionary(consts.DICTIONARY_PATH)
+else:
+    spellchecker = SpellChecker()
+# decoding over the lexicon needs the binary dictionary
+lexicon_decoder = LexiconDecoder(spellchecker) \
+    if isinstance(spellchecker, FrequencyDictionary) else None
 common_mistakes = {
     'ls': 'is',
     'lt': 'it',
@@ -29,34 +58,231 @@ common_mistakes = {
 }
 
 
-def text_from_image(img: np.ndarray) -> str:
+def text_from_image(img: Union[np.ndarray, PackedImage], tier: str = consts.DEFAULT_MODEL_TIER,
+                    engine: str = consts.DEFAULT_RECOGNITION_ENGINE,
+                    deadline: Optional[Deadline] = None,
+                    models: Optional[ModelSet] = None,
+                    denoiser: str = consts.DEFAULT_DENOISER) -> str:
     """
     Extract the text from an image. Works best if the image is preprocessed
     before applying the model.
 
     Args:
-        img (np.ndarray): The image (preprocessed).
+        img (Union[np.ndarray, PackedImage]): The image (preprocessed), or the
+          packed image - it is packed for segmentation (see `packed_image.py`).
+        tier (str): The tier of models to use - 'full' (denoising autoencoder
+          and `OCRModel`) or 'fast' (only the distilled `FastOCRModel`).
+        engine (str): The recognition engine - 'character' (classify every
+          character separately, using the models of the tier) or 'crnn'
+          (read every word in a single pass, using `CRNNModel`).
+        deadline (Optional[Deadline]): The deadline of the request - denoising
+          and spellchecking are skipped if it is too close (see `Deadline`).
+        models (Optional[ModelSet]): The version of the models to use (by
+          default, the current version when the call starts).
+        denoiser (str): The denoising backend of the full tier - 'autoencoder',
+          'classical' or 'slim' (see `denoising.py`).
 
     Returns:
         str: The extracted text.
     """
-
-    words = get_letters_bounding_rects_as_words(img)
-    text = ' '.join([characters_from_word(img, word) for word in words])
+    models = models or model_registry.current
+    with memory_accounting.stage('segmentation'):
+        page = as_packed(img)
+        rects = get_rects_by_blocks(page)
+    with memory_accounting.stage('recognition'):
+        text = ' '.join(recognize_words(page, rects, tier, engine, deadline, models, denoiser))
     print(f'Before spellchecking: {text}')
-    return perform_spellchecking(text)
+    if not allows(deadline, 'spellcheck'):
+        return text
+    with memory_accounting.stage('spellcheck'):
+        return perform_spellchecking(text)
+
+
+def iter_text_from_image(img: Union[np.ndarray, PackedImage], tier: str = consts.DEFAULT_MODEL_TIER,
+                         engine: str = consts.DEFAULT_RECOGNITION_ENGINE,
+                         models: Optional[ModelSet] = None,
+                         denoiser: str = consts.DEFAULT_DENOISER) -> Iterator[dict]:
+    """
+    Extract the text from an image progressively - the same as
+    `text_from_image`, but the text is recognized line by line, and an
+    event is yielded as soon as each line is recognized:
+    `{'event': 'line', 'index': ..., 'text': ...}`. After all the lines, the
+    corrections made by spellchecking are yielded, with the final text and
+    the version of the models:
+    `{'event': 'corrections', 'corrections': [...], 'text': ..., 'model_version': ...}`.
+    """
+    models = models or model_registry.current
+    page = as_packed(img)
+    rects = get_rects_by_blocks(page)
+    recognized = []
+    for index, line in enumerate(split_lines(rects)):
+        line_words = recognize_words(page, line, tier, engine, models=models, denoiser=denoiser)
+        recognized += line_words
+        yield {'event': 'line', 'index': index, 'text': ' '.join(line_words)}
 
+    corrected = spellcheck_words(recognized)
+    corrections = [{'index': index, 'original': original, 'corrected': correction}
+                   for index, (original, correction) in enumerate(zip(recognized, corrected))
+                   if original != correction]
+    yield {'event': 'corrections', 'corrections': corrections, 'text': ' '.join(corrected),
+           'model_version': models.version}
+
+
+def recognize_words(img: Union[np.ndarray, PackedImage], rects: np.ndarray,
+                    tier: str = consts.DEFAULT_MODEL_TIER,
+                    engine: str = consts.DEFAULT_RECOGNITION_ENGINE,
+                    deadline: Optional[Deadline] = None,
+                    models: Optional[ModelSet] = None,
+                    denoiser: str = consts.DEFAULT_DENOISER) -> list[str]:
+    """Recognize the words of the table of rects (before spellchecking, see
+    `RECT_DTYPE`) with the given engine, tier and denoiser, and version of
+    the models (the current one by default). The classical denoiser is cheap
+    enough to run whatever the deadline."""
+    models = models or model_registry.current
+    if engine == 'crnn':
+        return [common_mistakes.get(word, word) for word in read_words(img, rects, models)]
+    if tier == 'full' and denoiser != 'classical' and not allows(deadline, 'denoiser'):
+        tier = RAW_TIER
+    predictions = predict_words(img, rects, tier, models, denoiser)
+    if consts.LEXICON_DECODING_ENABLED and lexicon_decoder is not None:
+        return [decode_word(word_predictions) for word_predictions in predictions]
+    return [characters_from_predictions(word_predictions) for word_predictions in predictions]
+
+
+def get_rects_by_blocks(img: Union[np.ndarray, PackedImage]) -> np.ndarray:
+    """
+    Split the page into blocks of text (see `find_text_blocks`), get the
+    bounding rects of the characters of every block in parallel, and join
+    the rects of all of the blocks in reading order. The page and its
+    blocks are segmented packed (see `packed_image.py`).
+
+    Returns:
+        np.ndarray: The table of the rects (see `RECT_DTYPE`), positioned
+          within the page, with the rows and the words numbered over the page.
+    """
+    page = as_packed(img)
+    blocks = find_text_blocks(page)
+
+    def block_rects(block: Rect) -> np.ndarray:
+        table = get_letters_bounding_rects_table(crop(page, block), page_height=page.shape[0])
+        table['x'] += block.x
+        table['y'] += block.y
+        return table
+
+    tables = list(layout_executor.map(block_rects, blocks))
+    rows = words = 0
+    for table in tables:
+        if len(table):
+            table['row'] += rows
+            table['word'] += words
+            rows, words = table['row'][-1] + 1, table['word'][-1] + 1
+    rects = np.concatenate(tables) if tables else np.empty(0, RECT_DTYPE)
+    print(f'Layout: {len(blocks)} blocks, {words} words')
+    return rects
+
+
+def get_words_by_blocks(img: Union[np.ndarray, PackedImage]) -> list[list[Rect]]:
+    """The same as `get_rects_by_blocks`, with the words as lists of `Rect`."""
+    return table_to_words(get_rects_by_blocks(img))
+
+
+def predict_words(img: Union[np.ndarray, PackedImage], rects: np.ndarray,
+                  tier: str = consts.DEFAULT_MODEL_TIER,
+                  models: Optional[ModelSet] = None,
+                  denoiser: str = consts.DEFAULT_DENOISER) -> list[np.ndarray]:
+    """
+    Predict the probabilities of every character of every word. Cut every
+    rect from the image, add padding and resize to `consts.IMAGE_SIZE` (and
+    for the fast tier, downscale to its input size the way it was trained,
+    see `downscale_glyphs`), and pass only the unique glyphs through the models
+    (see `GlyphCache`). The raw tier is the full tier without denoising.
 
-def characters_from_word(img: np.ndarray, word: list[Rect]) -> str:
-    """Predict the word one letter at a time. Cut rect from image, add
-    padding, resize, de-noise, and predict."""
+    Returns:
+        list[np.ndarray]: The predictions of the characters, for every word.
+    """
+    models = models or model_registry.current
+    if inference_client is not None:
+        if tier == 'full' and denoiser == 'classical':
+            # the daemon only classifies the glyphs, they are denoised here
+            classify = functools.partial(inference_client.predict, tier=RAW_TIER)
+            predict_fn = functools.partial(predict_glyphs, models=models, denoiser=denoiser,
+                                           classify=classify)
+        else:
+            # the full tier with the slim denoiser is the 'slim' tier of the daemon
+            daemon_tier = SLIM_DAEMON_TIER if tier == 'full' and denoiser == 'slim' else tier
+            predict_fn = functools.partial(inference_client.predict, tier=daemon_tier)
+    elif tier == 'fast':
+        predict_fn = models.fast_model.predict_batch
+    elif tier == RAW_TIER:
+        predict_fn = models.model.predict_batch
+    else:
+        predict_fn = functools.partial(predict_glyphs, models=models, denoiser=denoiser)
+    glyphs = prepare_characters_for_prediction(img, rects)
+    if tier == 'fast':
+        glyphs = downscale_glyphs(glyphs, consts.FAST_IMAGE_SIZE)
+    # the predictions of the full tier depend on the denoiser
+    cache_name = f'{tier}.{denoiser}' if tier == 'full' else tier
+    predictions = models.glyph_caches[cache_name].predict(glyphs, predict_fn)
+    # split the predictions back into words
+    if not len(rects):
+        return []
+    return np.split(predictions, word_starts(rects)[1:])
+
+
+def predict_glyphs(glyphs: np.ndarray, models: Optional[ModelSet] = None,
+                   denoiser: str = consts.DEFAULT_DENOISER,
+                   classify: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> np.ndarray:
+    """
+    Predict the probabilities of a batch of glyphs. In cascade mode, only
+    the glyphs the model is not confident about are de-noised and
+    predicted again, otherwise every glyph is de-noised before predicting.
+    The glyphs are de-noised by the given backend (see `denoising.py`), and
+    classified by `classify` (by default, the `OCRModel` of the models).
+    """
+    models = models or model_registry.current
+    denoise = models.denoisers[denoiser].denoise_batch
+    classify = classify or models.model.predict_batch
+    if consts.CASCADE_ENABLED:
+        return cascade_predict(glyphs, classify, denoise)
+    return classify(denoise(glyphs))
+
+
+def read_words(img: Union[np.ndarray, PackedImage], rects: np.ndarray,
+               models: Optional[ModelSet] = None) -> list[str]:
+    """Cut every word (the rect enclosing all of its characters) from the
+    image, and read all of the words with the CRNN, one pass per word."""
+    crnn_model = (models or model_registry.current).crnn_model
+    if crnn_model is None:
+        raise ModelNotLoadedError('The CRNN is not available with the inference daemon.')
+    # the CRNN is loaded, so TensorFlow is imported anyway
+    from crnn_model import fit_word_image
+    page = as_packed(img)
+    words = split_words(rects)
+    crops = [fit_word_image(crop_word(page, word), crnn_model.HEIGHT, crnn_model.WIDTH)
+             for word in words]
+    metrics.increment('crnn.words', len(words))
+    metrics.increment('crnn.characters', len(rects))
+    print(f'CRNN: {len(words)} word predictions, instead of {len(rects)} '
+          f'character predictions')
+    return crnn_model.read_words(np.array(crops))
+
+
+def crop_word(img: Union[np.ndarray, PackedImage], word: np.ndarray) -> np.ndarray:
+    """Cut the rect enclosing all of the characters of the word (a table of
+    rects) from the image, unpacked."""
+    left, top = word['x'].min(), word['y'].min()
+    right, bottom = (word['x'] + word['w']).max(), (word['y'] + word['h']).max()
+    return unpack(as_packed(img), (left, top, right - left, bottom - top))
+
+
+def characters_from_predictions(predictions: np.ndarray) -> str:
+    """Get the characters of a word from the predictions of the model,
+    one letter at a time, and correct the words the model commonly
+    mistakes (see `common_mistakes`)."""
     first_character_of_word = True
     is_word_letters = True  # whether the word starts with a letter or a number
     text = ''
-    for rect in word:
-        char = prepare_character_for_prediction(img, rect)
-        # predict the character
-        prediction = model.predict(char)
+    for prediction in predictions:
         predicted_letter = consts.CLASSES[np.argmax(prediction)]
 
         if first_character_of_word and predicted_letter in string.digits:
@@ -67,20 +293,52 @@ def characters_from_word(img: np.ndarray, word: list[Rect]) -> str:
 
         text += predicted_letter
         first_character_of_word = False
-    return text
+    return common_mistakes.get(text, text)
+
+
+def decode_word(predictions: np.ndarray) -> str:
+    """
+    Decode the word over the lexicon (see `LexiconDecoder`). If no
+    dictionary word fits, or the decoder is not confident enough (e.g.
+    numbers and names), fall back to the most probable characters, which
+    are spellchecked later. Decoded words are in the dictionary, so
+    spellchecking leaves them as they are - and so does `common_mistakes`,
+    which only corrects the words read character by character.
+    """
+    if (decoded := lexicon_decoder.decode(predictions)) is not None \
+            and decoded[1] >= consts.LEXICON_MIN_CONFIDENCE:
+        metrics.increment('lexicon.decoded')
+        return decoded[0]
+    metrics.increment('lexicon.fallback')
+    return characters_from_predictions(predictions)
 
 
-def prepare_character_for_prediction(img: np.ndarray, rect: Rect) -> np.ndarray:
+def prepare_character_for_prediction(img: np.ndarray, rect: Rect,
+                                     image_size: tuple[int, int] = consts.IMAGE_SIZE) \
+        -> np.ndarray:
     """Cut the character from the image according to the given rect,
-    add padding and scale the image appropriately."""
+    add padding and scale the image to the given size."""
     # crop the bounding rect of the character from the original image
     character = img[rect.y:rect.y + rect.h, rect.x:rect.x + rect.w]
     # add white padding around the character and center it in the frame
     character = add_padding(character)
     # resize the image, and rescale pixel values to be between 0.0 and 1.0
-    scaled = cv2.resize(character, consts.IMAGE_SIZE) / 255
-    denoised = denoiser.denoise_image(scaled)
-    return denoised
+    scaled = cv2.resize(character, image_size) / 255
+    return scaled
+
+
+def prepare_characters_for_prediction(img: Union[np.ndarray, PackedImage], rects: np.ndarray,
+                                      image_size: tuple[int, int] = consts.IMAGE_SIZE) \
+        -> np.ndarray:
+    """The same as `prepare_character_for_prediction`, for all of the rects of
+    the table at once, gathered into a single array of shape `(n, *image_size)`.
+    Only the characters are unpacked from the (packed) image."""
+    page = as_packed(img)
+    glyphs = np.empty((len(rects), image_size[1], image_size[0]))
+    for glyph, rect in zip(glyphs, rects[['x', 'y', 'w', 'h']].tolist()):
+        glyph[:] = cv2.resize(add_padding(unpack(page, rect)), image_size)
+    glyphs /= 255
+    return glyphs
 
 
 def add_padding(img: np.ndarray) -> np.ndarray:
@@ -129,8 +387,11 @@ def perform_spellchecking(text: str) -> str:
     the wrong character, by replacing misspelled words, with other words
     which are lexicographically close, and are used often.
     """
-    words = text.split(' ')
-    words = [common_mistakes.get(word, word) for word in words]
-    corrected_words = [spellchecker.correction(word) for word in words]
+    corrected_words = spellcheck_words(text.split(' '))
     print(f'After spellchecking: {" ".join(corrected_words)}')
     return ' '.join(corrected_words)
+
+
+def spellcheck_words(words: list[str]) -> list[str]:
+    """Correct every word (see `perform_spellchecking`)."""
+    return [spellchecker.correction(word) for word in words]
@@ -2,6 +2,7 @@
 Module for building OCR model, training it and performing predictions.
 """
 from datetime import datetime
+from typing import Optional
 
 import numpy as np
 from tensorflow.keras.models import Sequential, load_model
@@ -29,6 +30,9 @@ class OCRModel(BaseTFModel):
     MAX_EPOCHS = 35
     MODEL_NAME = 'ocr_model.h5'
     LOG_DIR = 'logs\\training-history'
+    IMAGE_SIZE = consts.IMAGE_SIZE
+    # the random augmentation of the training images (see `ImageDataGenerator`)
+    AUGMENTATION = dict(shear_range=0.15, zoom_range=0.15, rotation_range=0.15)
 
     def __init__(self):
         super().__init__()
@@ -45,7 +49,7 @@ class OCRModel(BaseTFModel):
         model = Sequential()
 
         # add input layer that receives a gray-scale image of predefined size
-        model.add(InputLayer(input_shape=consts.IMAGE_SIZE + (1,)))
+        model.add(InputLayer(input_shape=self.IMAGE_SIZE + (1,)))
         # add convolutional layers with zero-padding (in order to retain
         # image size) and rectified linear unit activations
         model.add(Conv2D(filters=32, kernel_size=(3, 3), activation=relu, padding='same'))
@@ -89,32 +93,43 @@ class OCRModel(BaseTFModel):
         self._model = model
         self._model_built = True
 
-    def train_model(self) -> None:
+    def train_model(self, training_data=None, validation_data=None,
+                    callbacks: Optional[list[Callback]] = None) -> None:
         """
         Train the model using training set and validation set and log training
         progress to disk.
 
+        Args:
+            training_data: The training set, instead of loading the one in
+              `consts.TRAIN_CATEGORICAL_PATH` (e.g. the shard of a worker in
+              distributed training, see `distributed_training.py`).
+            validation_data: The validation set, instead of loading the one in
+              `consts.VALIDATION_CATEGORICAL_PATH`.
+            callbacks (Optional[list[Callback]]): The training callbacks,
+              instead of logging to disk and stopping early.
         Raises:
             ModelNotBuiltError: when trying to train an un built model.
         """
         if not self._model_built:
             raise ModelNotBuiltError('The model has to be built before training it.')
 
-        training_data, validation_data = self._load_data()
+        if training_data is None:
+            training_data, validation_data = self._load_data()
         self._model.fit(training_data,
                         epochs=self.MAX_EPOCHS,
                         verbose=1,
                         validation_data=validation_data,
-                        callbacks=self._setup_training_callbacks())
+                        callbacks=self._setup_training_callbacks() if callbacks is None
+                        else callbacks)
         self._model_loaded = True
 
-    def save_model(self) -> None:
-        """Save the model to disk as a HDF5 file."""
-        self._model.save(self.MODEL_NAME)
+    def save_model(self, path: Optional[str] = None) -> None:
+        """Save the model to disk as a HDF5 file (`MODEL_NAME` by default)."""
+        self._model.save(path or self.MODEL_NAME)
 
-    def load_model(self) -> None:
-        """Load the model from disk into memory."""
-        self._model = load_model(self.MODEL_NAME)
+    def load_model(self, path: Optional[str] = None) -> None:
+        """Load the model from disk into memory (`MODEL_NAME` by default)."""
+        self._model = load_model(path or self.MODEL_NAME)
         self._model_loaded = True
 
     def predict(self, img: np.array) -> np.array:
@@ -124,7 +139,7 @@ class OCRModel(BaseTFModel):
 
         Args:
             img (np.array): An image of a character of which to perform the
-                prediction (image shape needs to be the size defined in consts,
+                prediction (image shape needs to be the size of the model input,
                 yet the image does not have to include a grayscale color channel).
         Returns:
             np.array: The probabilities of the image being of any character.
@@ -136,9 +151,9 @@ class OCRModel(BaseTFModel):
         if not self._model_loaded:
             raise ModelNotLoadedError('You have to load the model before'
                                       ' performing predictions')
-        if img.shape != consts.IMAGE_SIZE and img.shape != consts.IMAGE_SIZE + (1,):
-            raise ValueError(f'Image shape must be {consts.IMAGE_SIZE}'
-                             f'or {consts.IMAGE_SIZE + (1,)}')
+        if img.shape != self.IMAGE_SIZE and img.shape != self.IMAGE_SIZE + (1,):
+            raise ValueError(f'Image shape must be {self.IMAGE_SIZE}'
+                             f'or {self.IMAGE_SIZE + (1,)}')
 
         if img.max() > 1.0:
             # assuming that if values are not between 0.0 and 1.0,
@@ -146,13 +161,41 @@ class OCRModel(BaseTFModel):
             img = img / 255
 
         # reshape the image to fit into the model
-        img = img.reshape(consts.IMAGE_SIZE + (1,))
+        img = img.reshape(self.IMAGE_SIZE + (1,))
         # define batch with only one image
         batch = np.expand_dims(img, axis=0)
         # perform prediction
         predictions = self._model.predict(batch)
         return predictions
 
+    def predict_batch(self, imgs: np.ndarray) -> np.ndarray:
+        """
+        Predict the probabilities of multiple images of characters at once,
+        which is much faster than predicting them one at a time.
+
+        Args:
+            imgs (np.ndarray): The images of the characters, of shape
+                `(n, *self.IMAGE_SIZE)` or `(n, *self.IMAGE_SIZE, 1)`.
+        Returns:
+            np.ndarray: The probabilities, of shape `(n, len(consts.CLASSES))`.
+        Raises:
+            ModelNotLoadedError: If model was not loaded before trying to predict.
+            ValueError: In case the specified images have incorrect shape.
+        """
+        if not self._model_loaded:
+            raise ModelNotLoadedError('You have to load the model before'
+                                      ' performing predictions')
+        if imgs.shape[1:] != self.IMAGE_SIZE and imgs.shape[1:] != self.IMAGE_SIZE + (1,):
+            raise ValueError(f'Images shape must be (n, *{self.IMAGE_SIZE}) '
+                             f'or (n, *{self.IMAGE_SIZE + (1,)})')
+        if len(imgs) == 0:
+            return np.empty((0, len(consts.CLASSES)))
+
+        if imgs.max() > 1.0:
+            imgs = imgs / 255
+        batch = imgs.reshape((len(imgs),) + self.IMAGE_SIZE + (1,))
+        return self._model.predict(batch, batch_size=config_tf.predict_batch_size)
+
     def evaluate(self, *, images: np.ndarray = None, folder_path: str = None) -> None:
         """
         Evaluate the model: calculate accuracy, show confusion matrix
@@ -170,10 +213,7 @@ class OCRModel(BaseTFModel):
         # use the ImageDataGenerator class to rescale pixel values to be between
         # 0.0 and 1.0 and randomly augment some percentage of images to decrease
         # overfitting and improve model performance over new test sets
-        train_generator = ImageDataGenerator(rescale=1 / 255,
-                                             shear_range=0.15,
-                                             zoom_range=0.15,
-                                             rotation_range=0.15)
+        train_generator = ImageDataGenerator(rescale=1 / 255, **self.AUGMENTATION)
 
         # load images from disk, convert to grayscale, resize them
         # and assign them appropriate labels
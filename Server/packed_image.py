@@ -0,0 +1,129 @@
+"""
+Module for the bit-packed form of the thresholded page, which is carried
+through segmentation: a bit per pixel (1 - ink) instead of a byte, so the
+page takes 8 times less memory, and the rows and columns of the page are
+tested for ink a 64-bit word (64 pixels) at a time. Only the small crops of
+the characters and words are unpacked back into images.
+"""
+from collections import namedtuple
+from typing import Optional, Union
+
+import numpy as np
+
+WORD_BYTES = 8  # every row is padded to whole 64-bit words
+PACK_ROWS = 256  # rows packed at once, so the page is never unpacked whole
+
+
+class PackedImage(namedtuple('PackedImage', 'bits width')):
+    """
+    A binary image, packed with `np.packbits` row by row (the first pixel of
+    every byte is its most significant bit). `bits` is of shape
+    `(height, stride)` - the stride is a whole number of 64-bit words, and
+    the bits after the width of the image are always 0.
+    """
+    __slots__ = ()
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.bits.shape[0], self.width
+
+
+def _stride(width: int) -> int:
+    """Get the bytes of a packed row of the given width, in whole words."""
+    return -(-width // (8 * WORD_BYTES)) * WORD_BYTES
+
+
+def _valid_bits(width: int) -> np.ndarray:
+    """Get the mask of the bits of the pixels of a packed row (without the
+    bits after the width), of the bytes holding any of them."""
+    valid = np.full((width + 7) // 8, 0xFF, np.uint8)
+    if width % 8:
+        valid[-1] = (0xFF << (8 - width % 8)) & 0xFF
+    return valid
+
+
+def pack(img: np.ndarray) -> PackedImage:
+    """Pack the thresholded image (black ink over white) - the black pixels
+    are the set bits."""
+    h, w = img.shape
+    bits = np.zeros((h, _stride(w)), np.uint8)
+    for start in range(0, h, PACK_ROWS):
+        bits[start:start + PACK_ROWS, :(w + 7) // 8] = \
+            np.packbits(img[start:start + PACK_ROWS] == 0, axis=1)
+    return PackedImage(bits, w)
+
+
+def as_packed(img: Union[np.ndarray, PackedImage]) -> PackedImage:
+    """Pack the thresholded image, if it is not packed already."""
+    return img if isinstance(img, PackedImage) else pack(img)
+
+
+def unpack(page: PackedImage, rect: Optional[tuple[int, int, int, int]] = None) -> np.ndarray:
+    """Unpack the image (or only the rect of it - x, y, w, h) back into a
+    grayscale image - 0 for ink and 255 for the rest."""
+    if rect is not None:
+        page = crop(page, rect)
+    ink = np.unpackbits(page.bits, axis=1, count=page.width)
+    return (ink ^ 1) * 255
+
+
+def crop(page: PackedImage, rect: tuple[int, int, int, int]) -> PackedImage:
+    """Cut the rect (x, y, w, h) from the packed image - shifting the bits of
+    every row so the rect starts at the first bit of a word."""
+    x, y, w, h = (int(value) for value in rect)
+    first, shift = divmod(x, 8)
+    n_bytes = (w + 7) // 8
+    # every byte of the crop is made of the end of one byte and the start of the next
+    source = np.zeros((len(page.bits[y:y + h]), n_bytes + 1), np.uint16)
+    window = page.bits[y:y + h, first:first + n_bytes + 1]
+    source[:, :window.shape[1]] = window
+    bits = np.zeros((len(source), _stride(w)), np.uint8)
+    bits[:, :n_bytes] = (source[:, :-1] << shift) | (source[:, 1:] >> (8 - shift))
+    if n_bytes:
+        bits[:, :n_bytes] &= _valid_bits(w)
+    return PackedImage(bits, w)
+
+
+def erode(page: PackedImage) -> PackedImage:
+    """
+    Keep only the ink pixels whose 3x3 neighbourhood (within the image) is
+    all ink. On a thresholded image, this is the same as blurring it with a
+    3x3 gaussian and keeping the pixels that are still black - the
+    neighbours beyond the border are reflected back into the neighbourhood.
+    """
+    h, w = page.shape
+    n_bytes = (w + 7) // 8
+    valid = _valid_bits(w)
+    # the pixels beyond the right border are counted as ink, so they do not erode
+    bits = page.bits[:, :n_bytes] | ~valid
+    before = np.full_like(bits, 0xFF)
+    before[:, 1:] = bits[:, :-1]
+    after = np.full_like(bits, 0xFF)
+    after[:, :-1] = bits[:, 1:]
+    # the left neighbour of every bit is the bit before it, across bytes
+    horizontal = bits & ((bits >> 1) | (before << 7)) & ((bits << 1) | (after >> 7))
+    eroded = horizontal.copy()
+    eroded[1:] &= horizontal[:-1]
+    eroded[:-1] &= horizontal[1:]
+    result = np.zeros_like(page.bits)
+    result[:, :n_bytes] = eroded & valid
+    return PackedImage(result, w)
+
+
+def row_projection(page: PackedImage, from_col: int = 0, to_col: Optional[int] = None) \
+        -> np.ndarray:
+    """Get whether every row of the image (from column `from_col` to column
+    `to_col`) has any ink in it."""
+    if from_col or to_col is not None:
+        h, w = page.shape
+        to_col = w if to_col is None else to_col
+        page = crop(page, (from_col, 0, to_col - from_col, h))
+    return page.bits.view(np.uint64).any(axis=1)
+
+
+def column_projection(page: PackedImage, from_row: int = 0, to_row: Optional[int] = None) \
+        -> np.ndarray:
+    """Get whether every column of the image (from row `from_row` to row
+    `to_row`) has any ink in it."""
+    words = np.bitwise_or.reduce(page.bits[from_row:to_row].view(np.uint64), axis=0)
+    return np.unpackbits(words.view(np.uint8), count=page.width).astype(bool)
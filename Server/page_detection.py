@@ -0,0 +1,104 @@
+"""
+Module for finding the page (region-of-interest) in the image, using a
+cascade of detectors from the cheapest to the most expensive: first a
+search for a quadrilateral contour on a downscaled edge map, then the
+Hough Line Transform method (see `hough_rect.py`). Every candidate is
+given a quality score, and the cascade stops at the first good enough one.
+"""
+from typing import Callable, Optional
+
+import numpy as np
+import cv2
+
+import consts
+import metrics
+from deadline import Deadline, allows
+from hough_rect import find_hough_rect, rect_area, order_points
+
+
+def find_contour_rect(img: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Find the page as the largest contour, in a downscaled edge map of the
+    image, that can be approximated by a convex quadrilateral. Returning
+    the ordered four points (in the coordinates of the original image),
+    or None if no such contour is found.
+    """
+    scale = min(1.0, consts.PAGE_DETECTION_WIDTH / img.shape[1])
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small = cv2.GaussianBlur(small, (5, 5), 0)
+    edged = cv2.Canny(small, 50, 200)
+    # close small breaks in the edges of the page
+    edged = cv2.dilate(edged, np.ones((3, 3), np.uint8))
+
+    contours, _ = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        perimeter = cv2.arcLength(contour, closed=True)
+        approx = cv2.approxPolyDP(contour, 0.02 * perimeter, closed=True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return order_points(approx.reshape((4, 2)) / scale)
+    return None
+
+
+def rect_quality(rect: np.ndarray, img_shape: tuple[int, int]) -> float:
+    """
+    Score how likely the ordered four points are to be the page, between
+    0.0 and 1.0: zero if the area they enclose is too small, otherwise
+    higher the closer their angles are to right angles.
+    """
+    if rect_area(rect) < consts.MIN_PAGE_AREA_RATIO * img_shape[0] * img_shape[1]:
+        return 0.0
+    cosines = []
+    for i in range(4):
+        prev_side = rect[i - 1] - rect[i]
+        next_side = rect[(i + 1) % 4] - rect[i]
+        norms = np.linalg.norm(prev_side) * np.linalg.norm(next_side)
+        if norms == 0:
+            return 0.0
+        cosines.append(abs(np.dot(prev_side, next_side)) / norms)
+    return float(1 - np.mean(cosines))
+
+
+# the detectors, from the cheapest to the most expensive
+DETECTORS: list[tuple[str, Callable[[np.ndarray], Optional[np.ndarray]]]] = [
+    ('contour', find_contour_rect),
+    ('hough', find_hough_rect),
+]
+
+
+def detect_page(img: np.ndarray, deadline: Optional[Deadline] = None) -> Optional[np.ndarray]:
+    """
+    Run the detectors one after the other, until one of them finds a rect
+    whose quality is at least `consts.PAGE_QUALITY_THRESHOLD`. If none of
+    them does, return the best rect found (if any), as long as it encloses
+    a large enough area. The runs, hits (good enough rects) and timings of
+    every detector are recorded in `metrics`. The expensive detectors are
+    optional stages, skipped if the deadline is too close.
+
+    Args:
+        img (np.ndarray): The original (grayscale) image.
+        deadline (Optional[Deadline]): The deadline of the request, if any.
+    Returns:
+        Optional[np.ndarray]: The ordered four points defining the page,
+          or None if no page was found.
+    """
+    best_rect, best_quality = None, 0.0
+    for name, detector in DETECTORS:
+        if name in consts.STAGE_MIN_REMAINING_TIME and not allows(deadline, name):
+            break
+        metrics.increment(f'page_detection.{name}.runs')
+        with metrics.timed(f'page_detection.{name}'):
+            rect = detector(img)
+        if rect is None:
+            continue
+        quality = rect_quality(rect, img.shape)
+        if quality >= consts.PAGE_QUALITY_THRESHOLD:
+            metrics.increment(f'page_detection.{name}.hits')
+            return rect
+        if quality > best_quality:
+            best_rect, best_quality = rect, quality
+
+    if best_rect is None:
+        metrics.increment('page_detection.not_found')
+    else:
+        metrics.increment('page_detection.low_quality')
+    return best_rect
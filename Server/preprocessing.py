@@ -8,39 +8,121 @@ import numpy as np
 import cv2
 from scipy.spatial import distance
 
-from hough_rect import find_hough_rect, rect_area, order_points
+import consts
+from hough_rect import order_points
+from layout import content_runs
+from page_detection import detect_page
+from deadline import Deadline
 
 
 def preprocess_image(img: np.ndarray,
-                     points: Optional[list[tuple[int, int]]] = None) -> np.ndarray:
+                     points: Optional[list[tuple[int, int]]] = None,
+                     find_page: bool = True,
+                     deadline: Optional[Deadline] = None) -> np.ndarray:
     """
     Perform preprocessing on the input image. If no such given, try to
     find corners of the page and transform the image to enlarge and
     rotate the region-of-interest.
-    If no ROI is found, only do thresholding.
+    If no ROI is found, the whole image is transformed (scaled) and
+    thresholded. Either way, the result is at a normalized resolution (see
+    `normalization_scale`), whatever the resolution of the camera.
 
     Args:
         points (Optional[list[tuple[int, int]]]): The four points (x and y)
           defining the region-of-interest.
         img (np.ndarray): The original image which needs to be processed.
+        find_page (bool): Whether to try to find the corners of the page
+          if no points are given (e.g. if they were already searched for).
+        deadline (Optional[Deadline]): The deadline of the request - the
+          expensive ways of finding the page are skipped if it is too close.
     Returns:
         np.ndarray: The preprocessed image.
     """
-    original = img.copy()
     if not points:
-        if (points := find_hough_rect(img)) is None \
-                or rect_area(points) < 0.1 * img.shape[0] * img.shape[1]:
+        if not find_page or (points := find_page_rect(img, deadline)) is None:
             # can't process image, no rect found or rect is too small, return
-            # original image, after thresholding
-            _, threshed = cv2.threshold(original, 100, 255, cv2.THRESH_BINARY)
-            return threshed
+            # the whole image, normalized and thresholded
+            return warp_and_threshold(img, np.array(rect_to_points(img, None), np.float32), 100)
     points = order_points(np.array(points))
-    # rotate the image and transform it around the ROI
-    warped = four_point_transform(original, points)
+    # rotate the image and transform it around the ROI, and threshold it
+    return warp_and_threshold(img, points, 255 // 2)
 
-    # final step of preprocessing - threshing
-    _, threshed = cv2.threshold(warped, 255 // 2, 255, cv2.THRESH_BINARY)
-    return threshed
+
+def warp_and_threshold(img: np.ndarray, rect: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Warp the image around the (ordered) points of its region-of-interest,
+    straight to the normalized resolution, and threshold the warped image
+    in place - so no stage after the warp works at the resolution of the photo.
+    """
+    # only the bounding box of the ROI is needed
+    left, top = np.floor(rect.min(axis=0)).astype(int).clip(0)
+    right, bottom = np.ceil(rect.max(axis=0)).astype(int) + 1
+    img, rect = img[top:bottom, left:right], rect - (left, top)
+
+    scale = normalization_scale(img, rect)
+    # shrink large photos by halves first (a gaussian pyramid), so thin
+    # strokes are not lost by sampling them sparsely in the warp
+    while scale < 0.5:
+        img, rect, scale = cv2.pyrDown(img), rect / 2, scale * 2
+    warped = four_point_transform(img, rect.astype(np.float32), scale)
+    cv2.threshold(warped, threshold, 255, cv2.THRESH_BINARY, dst=warped)
+    return warped
+
+
+def normalization_scale(img: np.ndarray, rect: np.ndarray) -> float:
+    """
+    Get the scale of the warped region-of-interest, relative to its size in
+    the image, by `consts.WARP_NORMALIZATION`: 'line_height' - so the lines
+    of text are `consts.WARP_TARGET_LINE_HEIGHT` pixels high (estimated on a
+    small warp of the ROI, as if by 'dpi' if they cannot be estimated),
+    'dpi' - as if the page was scanned at `consts.WARP_TARGET_DPI`, or
+    None - the resolution of the image. The page is never shrunk below
+    `consts.WARP_MIN_DPI`, nor enlarged more than `consts.WARP_MAX_SCALE`.
+    """
+    if consts.WARP_NORMALIZATION is None:
+        return 1.0
+    width, _ = calc_dimensions(rect)
+    scale = consts.WARP_TARGET_DPI * consts.PAGE_WIDTH_INCHES / max(width, 1)
+    if consts.WARP_NORMALIZATION == 'line_height':
+        probe_scale = min(1.0, consts.WARP_PROBE_WIDTH / max(width, 1))
+        probe = four_point_transform(img, rect.astype(np.float32), probe_scale)
+        if line_height := estimate_line_height(probe):
+            scale = consts.WARP_TARGET_LINE_HEIGHT * probe_scale / line_height
+    min_scale = consts.WARP_MIN_DPI * consts.PAGE_WIDTH_INCHES / max(width, 1)
+    return min(max(scale, min_scale), consts.WARP_MAX_SCALE)
+
+
+def estimate_line_height(img: np.ndarray) -> Optional[float]:
+    """
+    Estimate the height of the lines of text in the (grayscale) image - the
+    median height of the runs of rows with ink, ignoring the margins (where
+    the background may show) and the columns with ink in most of the rows
+    (rules, the edges of figures or a dark background). None if there are
+    fewer than `consts.LINE_HEIGHT_MIN_LINES` runs, or if they are higher
+    than `consts.LINE_HEIGHT_MAX_RATIO` of the image - they are not lines
+    of text then.
+    """
+    h, w = img.shape
+    inner = img[h // 20:h - h // 20, w // 20:w - w // 20]
+    if not inner.size:
+        return None
+    ink = inner < 255 // 2
+    has_ink = ink[:, ink.mean(axis=0) < 0.5].any(axis=1)
+    heights = [end - start for start, end in content_runs(has_ink, 1) if end - start > 1]
+    if len(heights) < consts.LINE_HEIGHT_MIN_LINES:
+        return None
+    line_height = float(np.median(heights))
+    return line_height if line_height <= consts.LINE_HEIGHT_MAX_RATIO * h else None
+
+
+def find_page_rect(img: np.ndarray, deadline: Optional[Deadline] = None) \
+        -> Optional[np.ndarray]:
+    """
+    Find the ordered four points defining the page (region-of-interest),
+    or None if no such points found, or the area they enclose is too small
+    (see `page_detection.py`).
+    """
+    return detect_page(img, deadline)
 
 
 def find_page_points(img: np.ndarray) -> list[tuple[int, int]]:
@@ -48,16 +130,22 @@ def find_page_points(img: np.ndarray) -> list[tuple[int, int]]:
     Find the four points defining the page (region-of-interest).
     If no such points found, return the edges of the image.
     """
-    if (rect := find_hough_rect(img)) is None \
-            or rect_area(rect) < 0.1 * img.shape[0] * img.shape[1]:
+    return rect_to_points(img, find_page_rect(img))
+
+
+def rect_to_points(img: np.ndarray, rect: Optional[np.ndarray]) -> list[tuple[int, int]]:
+    """Convert the rect found by `find_page_rect` into a list of points,
+    or the edges of the image if no rect was found."""
+    if rect is None:
         return [(0, 0), (img.shape[1], 0), (img.shape[1], img.shape[0]), (0, img.shape[0])]
     return [tuple(pt) for pt in rect]
 
 
-def four_point_transform(img: np.ndarray, rect: np.ndarray) -> np.ndarray:
-    """Warp the image around it's region-of-interest."""
+def four_point_transform(img: np.ndarray, rect: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """Warp the image around it's region-of-interest (resized by the scale)."""
     # obtain a consistent order of the points
     width, height = calc_dimensions(rect)
+    width, height = max(1, round(width * scale)), max(1, round(height * scale))
 
     dst = np.array([
         [0, 0],
@@ -89,3 +177,18 @@ def calc_dimensions(ordered_pts: np.ndarray) -> tuple[int, int]:
     max_height = max(int(height1), int(height2))
 
     return max_width, max_height
+
+
+def downscale_glyphs(glyphs: np.ndarray, image_size: tuple[int, int]) -> np.ndarray:
+    """
+    Downscale a batch of glyphs (of shape `(n, h, w)` or `(n, h, w, 1)`) to
+    the given size, by averaging the areas of the pixels. Used both for
+    training the fast tier and for serving it, so the classifier sees
+    glyphs downscaled the same way.
+    """
+    resized = np.empty((len(glyphs), image_size[1], image_size[0]) + glyphs.shape[3:],
+                       dtype=glyphs.dtype)
+    for glyph, small in zip(glyphs, resized):
+        small.reshape(image_size[1], image_size[0])[:] = \
+            cv2.resize(glyph.reshape(glyph.shape[:2]), image_size, interpolation=cv2.INTER_AREA)
+    return resized
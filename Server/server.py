@@ -2,25 +2,49 @@
 Module for running the server that communicates with the clients and
 answers their requests.
 """
+import asyncio
 import base64
 import io
 import binascii
-from typing import Optional
+import os
+from collections import namedtuple
+from typing import Optional, Literal
 
 import numpy as np
 from PIL import Image, ImageOps, UnidentifiedImageError
 import uvicorn
-from fastapi import FastAPI, Request, Response
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
-from docx import Document
-from docx.shared import Pt
+from fastapi import (FastAPI, Header, HTTPException, Request, Response, WebSocket,
+                     WebSocketDisconnect)
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, root_validator
+from starlette.concurrency import run_in_threadpool
 
 import consts
-from ocr import text_from_image
-from preprocessing import preprocess_image, find_page_points
+import memory_accounting
+import metrics
+import tf_profile
+from model_errors import ModelNotLoadedError
+from corner_tracking import CornerTracker
+from deadline import Deadline
+from inference_daemon import InferenceError
+from docx_export import pages_to_docx
+from model_registry import UnknownModelVersionError, ReloadNotSupportedError
+from ocr import text_from_image, iter_text_from_image, model_registry
+from packed_image import pack
+from preprocessing import preprocess_image, find_page_rect, rect_to_points
+from triage import triage, EMPTY, PRECROPPED, BLURRY
+from ttl_store import SharedTTLStore
 
 app = FastAPI()
+# the extracted texts, kept for exporting them without uploading them again (by any worker)
+results = SharedTTLStore(os.path.join(consts.SHARED_STORE_DIR, 'results'),
+                         ttl=consts.RESULTS_TTL_SECONDS, max_items=consts.RESULTS_MAX_ITEMS)
+# the decoded images uploaded once and used by later requests, with the page found in them -
+# shared by the workers, as the requests of a client may reach any of them
+ImageSession = namedtuple('ImageSession', 'image page_rect')
+sessions = SharedTTLStore(os.path.join(consts.SHARED_STORE_DIR, 'sessions'),
+                          ttl=consts.SESSIONS_TTL_SECONDS, max_items=consts.SESSIONS_MAX_ITEMS,
+                          max_bytes=consts.SESSIONS_MAX_BYTES)
 
 
 class Point(BaseModel):
@@ -29,8 +53,30 @@ class Point(BaseModel):
 
 
 class Data(BaseModel):
-    b64image: str
+    b64image: Optional[str] = None
+    session_id: Optional[str] = None
     points: Optional[list[Point]] = Field(None, min_items=4, max_items=4)
+    tier: Optional[Literal[consts.MODEL_TIERS]] = None
+    engine: Optional[Literal[consts.RECOGNITION_ENGINES]] = None
+    denoiser: Optional[Literal[consts.DENOISERS]] = None
+
+    @root_validator
+    def check_image_source(cls, values):
+        if not values.get('b64image') and not values.get('session_id'):
+            raise ValueError('Either b64image or session_id must be provided.')
+        return values
+
+
+class ImageUpload(BaseModel):
+    b64image: str
+
+
+class DocxExport(BaseModel):
+    """The text to export - either the text itself, a list of pages,
+    or the ids of results returned by `/image_to_text` (a page for each)."""
+    text: Optional[str] = None
+    pages: Optional[list[str]] = Field(None, min_items=1)
+    result_ids: Optional[list[str]] = Field(None, min_items=1)
 
 
 class InvalidBase64StringError(Exception):
@@ -41,6 +87,18 @@ class InvalidImageStringError(Exception):
     """Exception raised when an image file cannot be identified from decoded base64."""
 
 
+class SessionNotFoundError(Exception):
+    """Exception raised when an image session does not exist (or has expired)."""
+
+
+class ModelReload(BaseModel):
+    version: Optional[str] = None  # the latest version by default
+
+
+class ImageTooBlurryError(Exception):
+    """Exception raised when the image is too blurred to extract the text from it."""
+
+
 @app.exception_handler(InvalidBase64StringError)
 async def invalid_b64_str_handler(request: Request,
                                   exc: InvalidBase64StringError) -> JSONResponse:
@@ -59,6 +117,60 @@ async def invalid_b64_img_handler(request: Request,
     )
 
 
+@app.exception_handler(SessionNotFoundError)
+async def session_not_found_handler(request: Request,
+                                    exc: SessionNotFoundError) -> JSONResponse:
+    return JSONResponse(
+        status_code=404,
+        content={'message': 'The image session was not found (it may have expired).'},
+    )
+
+
+@app.exception_handler(ImageTooBlurryError)
+async def image_too_blurry_handler(request: Request,
+                                   exc: ImageTooBlurryError) -> JSONResponse:
+    return JSONResponse(
+        status_code=422,
+        content={'message': 'The image is too blurry to extract the text from it.'},
+    )
+
+
+@app.exception_handler(UnknownModelVersionError)
+async def unknown_model_version_handler(request: Request,
+                                        exc: UnknownModelVersionError) -> JSONResponse:
+    return JSONResponse(
+        status_code=404,
+        content={'message': str(exc)},
+    )
+
+
+@app.exception_handler(ReloadNotSupportedError)
+async def reload_not_supported_handler(request: Request,
+                                       exc: ReloadNotSupportedError) -> JSONResponse:
+    return JSONResponse(
+        status_code=409,
+        content={'message': str(exc)},
+    )
+
+
+@app.exception_handler(ModelNotLoadedError)
+async def model_not_loaded_handler(request: Request,
+                                   exc: ModelNotLoadedError) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={'message': 'The requested model is not available on the server.'},
+    )
+
+
+@app.exception_handler(InferenceError)
+async def inference_error_handler(request: Request, exc: InferenceError) -> JSONResponse:
+    print(exc)
+    return JSONResponse(
+        status_code=503,
+        content={'message': 'The inference service is not available.'},
+    )
+
+
 def decode_image(b64image: str) -> np.ndarray:
     """Try decoding the image from base64 string, into numpy array."""
     try:
@@ -75,45 +187,301 @@ def decode_image(b64image: str) -> np.ndarray:
     return np_image
 
 
-@app.post('/image_to_text')
-async def image_to_text(data: Data) -> dict[str, str]:
-    """Extract the text from an image, and preprocess it using the received points."""
-    np_image = decode_image(data.b64image)
+def get_session(session_id: str) -> ImageSession:
+    """Get the image session with the given id."""
+    if (session := sessions.get(session_id)) is None:
+        raise SessionNotFoundError()
+    return session
 
-    if data.points:
-        points = [(pt.x, pt.y) for pt in data.points]
+
+def get_image_and_points(data: Data) -> tuple[np.ndarray, Optional[list[tuple[int, int]]], bool]:
+    """
+    Get the image (decoded, or of the image session), and the points to
+    preprocess it with - the received points, or else the points found
+    when the session was created.
+
+    Returns:
+        tuple[np.ndarray, Optional[list[tuple[int, int]]], bool]: The image,
+          the points, and whether the page still needs to be searched for.
+    """
+    if data.session_id:
+        session = get_session(data.session_id)
+        np_image, page_rect, page_searched = session.image, session.page_rect, True
     else:
-        points = None
-    preprocessed = preprocess_image(np_image, points)
+        with memory_accounting.stage('decoding'):
+            np_image = decode_image(data.b64image)
+        page_rect, page_searched = None, False
 
-    text = text_from_image(preprocessed)
-    return {'result': text}
+    if data.points:
+        return np_image, [(pt.x, pt.y) for pt in data.points], False
+    points = None if page_rect is None else rect_to_points(np_image, page_rect)
+    return np_image, points, not page_searched
+
+
+def points_to_json(points: list[tuple[int, int]]) -> list[dict[str, int]]:
+    return [{'x': int(pt[0]), 'y': int(pt[1])} for pt in points]
+
+
+@app.post('/sessions')
+def create_session(data: ImageUpload) -> dict:
+    """
+    Upload an image once, for later requests to refer to by the returned
+    session id. The points of the region-of-interest are found and returned
+    immediately, and kept for the later requests.
+    """
+    np_image = decode_image(data.b64image)
+    page_rect = find_page_rect(np_image)
+    session_id = sessions.add(ImageSession(np_image, page_rect))
+    return {'session_id': session_id,
+            'points': points_to_json(rect_to_points(np_image, page_rect))}
+
+
+@app.delete('/sessions/{session_id}')
+async def delete_session(session_id: str) -> dict:
+    """Remove the image session (when the client no longer needs it)."""
+    if sessions.pop(session_id) is None:
+        raise SessionNotFoundError()
+    return {}
+
+
+@app.post('/image_to_text')
+def image_to_text(data: Data, x_time_budget_ms: Optional[float] = Header(None, gt=0)) -> dict:
+    """
+    Extract the text from an image, and preprocess it using the received points.
+    The request has to be answered within the time budget (the X-Time-Budget-Ms
+    header, or `consts.DEFAULT_TIME_BUDGET`) - the optional stages skipped to
+    meet it are listed in the response. The image is triaged first (see
+    `triage.py`): blank images get an empty text, pre-cropped scans skip
+    finding the page, and blurred images are rejected. The whole request
+    uses the version of the models that is current when it starts. The
+    pipeline is CPU-bound, so it runs in the threadpool (a plain function),
+    not on the event loop - where it would hold up every other request.
+    """
+    models = model_registry.current
+    deadline = Deadline(consts.DEFAULT_TIME_BUDGET if x_time_budget_ms is None
+                        else x_time_budget_ms / 1000)
+    np_image, points, detect_page = get_image_and_points(data)
+    if consts.TRIAGE_ENABLED:
+        route = triage(np_image)
+        if route == EMPTY:
+            return {'result': '', 'result_id': results.add(''), 'skipped_stages': [],
+                    'model_version': models.version}
+        if route == BLURRY:
+            raise ImageTooBlurryError()
+        if route == PRECROPPED:
+            detect_page = False
+    with memory_accounting.stage('preprocessing'):
+        # only the packed page is kept for the rest of the request (see `packed_image.py`)
+        page = pack(preprocess_image(np_image, points, detect_page, deadline))
+
+    text = text_from_image(page, data.tier or consts.DEFAULT_MODEL_TIER,
+                           data.engine or consts.DEFAULT_RECOGNITION_ENGINE, deadline, models,
+                           data.denoiser or consts.DEFAULT_DENOISER)
+    return {'result': text, 'result_id': results.add(text), 'skipped_stages': deadline.skipped,
+            'model_version': models.version}
 
 
 @app.post('/find_page_points')
-async def find_points(data: Data) -> dict[str, list[dict[str, int]]]:
+def find_points(data: Data) -> dict[str, list[dict[str, int]]]:
     """Find the points of the region-of-interest in the image."""
-    np_image = decode_image(data.b64image)
-    points = find_page_points(np_image)
-    return {'points': [{'x': int(pt[0]), 'y': int(pt[1])} for pt in points]}
+    if data.session_id:
+        session = get_session(data.session_id)
+        np_image, page_rect = session.image, session.page_rect
+    else:
+        np_image = decode_image(data.b64image)
+        page_rect = find_page_rect(np_image)
+    return {'points': points_to_json(rect_to_points(np_image, page_rect))}
+
+
+@app.websocket('/ws/image_to_text')
+async def image_to_text_progressive(websocket: WebSocket) -> None:
+    """
+    Extract the text from an image progressively. Receives the same JSON
+    object as `/image_to_text`, and sends events as the pipeline moves
+    forward: the points of the region-of-interest, every recognized line,
+    and finally the spellchecking corrections (with the final text).
+    """
+    await websocket.accept()
+    try:
+        data = Data(**await websocket.receive_json())
+        np_image, points, detect_page = get_image_and_points(data)
+    except (ValidationError, ValueError):
+        await send_error_and_close(websocket, 'The received JSON object is invalid.')
+        return
+    except InvalidBase64StringError:
+        await send_error_and_close(websocket, 'The received base64 string is invalid.')
+        return
+    except InvalidImageStringError:
+        await send_error_and_close(websocket, 'Cannot identify image file from decoded '
+                                              'base64 string.')
+        return
+    except SessionNotFoundError:
+        await send_error_and_close(websocket, 'The image session was not found '
+                                              '(it may have expired).')
+        return
+
+    if detect_page:
+        rect = await run_in_threadpool(find_page_rect, np_image)
+        points = None if rect is None else rect_to_points(np_image, rect)
+    await websocket.send_json({'event': 'points',
+                               'points': points_to_json(points or rect_to_points(np_image, None))})
+
+    page = await run_in_threadpool(
+        pack, await run_in_threadpool(preprocess_image, np_image, points, False))
+    events = iter_text_from_image(page, data.tier or consts.DEFAULT_MODEL_TIER,
+                                  data.engine or consts.DEFAULT_RECOGNITION_ENGINE,
+                                  denoiser=data.denoiser or consts.DEFAULT_DENOISER)
+    try:
+        while (event := await run_in_threadpool(next, events, None)) is not None:
+            await websocket.send_json(event)
+    except ModelNotLoadedError:
+        await send_error_and_close(websocket, 'The requested model is not available '
+                                              'on the server.')
+        return
+    except InferenceError:
+        await send_error_and_close(websocket, 'The inference service is not available.')
+        return
+    await websocket.close()
+
+
+@app.websocket('/ws/track_page')
+async def track_page(websocket: WebSocket) -> None:
+    """
+    Track the page along a stream of (low resolution) preview frames, for
+    showing its border live. Every frame is a JSON object like the one
+    sent to `/sessions`, and is answered with the points of the page in it.
+    Only the newest frame is processed - frames that arrive while another
+    frame is being processed replace each other, and the stale ones are
+    dropped. The frames are decoded and tracked in the threadpool, so they
+    are not held up behind other requests on the event loop.
+    """
+    await websocket.accept()
+    tracker = CornerTracker()
+    pending = []  # the newest frame that was not processed yet (at most one)
+    frame_received = asyncio.Event()
+    disconnected = False
+
+    async def receive_frames() -> None:
+        nonlocal disconnected
+        try:
+            while True:
+                try:
+                    message = await websocket.receive_json()
+                except (ValueError, KeyError):
+                    # not JSON, or a binary frame (KeyError), answered with an error
+                    message = None
+                if pending:
+                    metrics.increment('tracking.dropped_frames')
+                pending[:] = [message]
+                frame_received.set()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            # whatever stopped the receiver, the main loop must not wait for frames
+            disconnected = True
+            frame_received.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            await frame_received.wait()
+            frame_received.clear()
+            if disconnected:
+                await receiver  # raises the error the receiver failed with, if any
+                return
+            message = pending.pop()
+            try:
+                frame = await run_in_threadpool(decode_image, ImageUpload(**message).b64image)
+            except (TypeError, ValidationError, InvalidBase64StringError,
+                    InvalidImageStringError):
+                await websocket.send_json({'event': 'error',
+                                           'message': 'The received frame is invalid.'})
+                continue
+            rect, keyframe = await run_in_threadpool(tracker.update, frame)
+            await websocket.send_json({'event': 'points',
+                                       'points': points_to_json(rect_to_points(frame, rect)),
+                                       'found': rect is not None,
+                                       'keyframe': keyframe})
+    finally:
+        receiver.cancel()
+
+
+async def send_error_and_close(websocket: WebSocket, message: str) -> None:
+    """Send an error event, and close the connection."""
+    await websocket.send_json({'event': 'error', 'message': message})
+    await websocket.close()
 
 
 @app.get('/text_to_docx/{text}')
 async def text_to_docx(text: str):
     """Put the text in a docx document."""
-    document = Document()
-    paragraph = document.add_paragraph(text)
-    style = document.styles['Normal']
-    font = style.font
-    font.name = 'Calibri'
-    font.size = Pt(12)
-    paragraph.style = document.styles['Normal']
-
-    stream = io.BytesIO()
-    document.save(stream)
+    stream = pages_to_docx([text])
     return Response(content=stream.getvalue(),
                     media_type=consts.DOCX_MIME_TYPE)
 
 
+@app.post('/export/docx')
+def export_docx(export: DocxExport) -> StreamingResponse:
+    """Put the text, the pages, or the results with the given ids in a
+    docx document, every page starting on a new page."""
+    if export.result_ids:
+        pages = [results.get(result_id) for result_id in export.result_ids]
+        if None in pages:
+            raise HTTPException(status_code=404, detail='Result not found (it may have expired).')
+    elif export.pages:
+        pages = export.pages
+    elif export.text is not None:
+        pages = [export.text]
+    else:
+        raise HTTPException(status_code=400,
+                            detail='Either text, pages or result_ids must be provided.')
+
+    with metrics.timed('export_docx'):
+        stream = pages_to_docx(pages)
+    return StreamingResponse(stream, media_type=consts.DOCX_MIME_TYPE,
+                             headers={'Content-Disposition': 'attachment; filename="Editable.docx"'})
+
+
+@app.middleware('http')
+async def account_memory(request: Request, call_next):
+    """Trace the memory used by a sample of the requests (see `memory_accounting`),
+    and add it to the headers of their responses."""
+    with memory_accounting.track_request(f'{request.method} {request.url.path}') as record:
+        response = await call_next(request)
+    if record is not None:
+        response.headers.update(record.headers())
+    return response
+
+
+@app.get('/admin/memory')
+async def heaviest_requests(count: int = 20) -> dict[str, list]:
+    """Get the recent requests traced by this worker with the highest memory peaks."""
+    return {'requests': memory_accounting.heaviest_requests(count)}
+
+
+@app.get('/admin/models')
+async def model_versions() -> dict:
+    """Get the version of the models served by this worker, the version being
+    loaded (if any) and all of the available versions."""
+    return model_registry.status()
+
+
+@app.post('/admin/models/reload')
+async def reload_models(data: ModelReload) -> dict:
+    """
+    Deploy a version of the models (the latest by default): every worker
+    loads and warms it up in the background, and then swaps it in - the
+    requests in progress finish with the previous version. Not supported
+    with the inference daemon, which loads its version when it starts.
+    """
+    return {'version': model_registry.reload(data.version), **model_registry.status()}
+
+
+@app.get('/stats')
+async def stats() -> dict[str, dict]:
+    """Get the runtime statistics collected by this worker (e.g. cache hit rates)."""
+    return metrics.snapshot()
+
+
 if __name__ == '__main__':
-    uvicorn.run('server:app', host='0.0.0.0', port=80)
+    uvicorn.run('server:app', host='0.0.0.0', port=80, workers=tf_profile.workers)
@@ -0,0 +1,80 @@
+"""
+Module for the slim denoising autoencoders - a family of much smaller
+variants of `DenoisingAutoencoder`, which downsample the glyph in their
+first layer and split the inner convolutions into a depthwise and a
+pointwise convolution. The smallest variant which is accurate enough is
+chosen by `train_slim_denoiser.py`.
+"""
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.layers import (InputLayer, Conv2D, SeparableConv2D, MaxPooling2D,
+                                     UpSampling2D)
+from tensorflow.keras.losses import binary_crossentropy
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.activations import relu, sigmoid
+
+import config_tf
+import consts
+from noise_remover import DenoisingAutoencoder
+
+
+class SlimDenoisingAutoencoder(DenoisingAutoencoder):
+    """
+    Class for building, training, and loading a slim denoising autoencoder.
+    The architecture is the same for every variant, only the number of
+    filters differs (see `VARIANTS`). Use `base_model.new_instance` to build
+    several variants at once.
+    """
+    EPOCHS = 4
+    MODEL_NAME = 'slim_noise_remover.h5'
+    # the filters of the full-resolution layers and of the downsampled layers,
+    # by the name of the variant - from the smallest to the largest
+    VARIANTS = {
+        'tiny': (8, 16),
+        'small': (16, 32),
+        'medium': (32, 64),
+        'large': (64, 128),
+    }
+
+    def __init__(self, variant: str = 'small'):
+        super().__init__()
+        if variant not in self.VARIANTS:
+            raise ValueError(f'Unknown variant {variant!r}, '
+                             f'the variants are {", ".join(self.VARIANTS)}')
+        self.variant = variant
+
+    def build_model(self) -> None:
+        """
+        Build and compile the autoencoder of the variant. The first convolution
+        already downsamples the glyph to half its size (a 64x64 binary glyph
+        carries little detail), and the rest of the convolutions, except the
+        last, are depthwise separable.
+        """
+        filters, downsampled_filters = self.VARIANTS[self.variant]
+        height, width = consts.IMAGE_SIZE
+
+        # build encoder - reducing image features
+        encoder = Sequential([
+            InputLayer(input_shape=consts.IMAGE_SIZE + (1,)),
+            Conv2D(filters=filters, kernel_size=(3, 3), strides=2, activation=relu, padding='same'),
+            SeparableConv2D(filters=downsampled_filters, kernel_size=(3, 3), activation=relu,
+                            padding='same'),
+            MaxPooling2D(pool_size=(2, 2), padding='same'),
+            SeparableConv2D(filters=downsampled_filters, kernel_size=(3, 3), activation=relu,
+                            padding='same'),
+        ])
+
+        # build decoder - upscaling back to original size
+        decoder = Sequential([
+            InputLayer(input_shape=(height // 4, width // 4, downsampled_filters)),
+            UpSampling2D((2, 2)),
+            SeparableConv2D(filters=filters, kernel_size=(3, 3), activation=relu, padding='same'),
+            UpSampling2D((2, 2)),
+            Conv2D(filters=1, kernel_size=(3, 3), activation=sigmoid, padding='same')
+        ])
+
+        model = Sequential([encoder, decoder])
+        model.compile(loss=binary_crossentropy,
+                      optimizer=Adam(learning_rate=self.LR),
+                      metrics=['accuracy'])
+        self._model = model
+        self._model_built = True
@@ -0,0 +1,74 @@
+"""
+Tests for splitting the page into blocks of text (see `layout.py`).
+"""
+import numpy as np
+
+from bounding_rects import Rect
+from layout import content_runs, find_text_blocks
+from packed_image import pack
+
+
+def page_with_blocks(h: int, w: int, blocks: list[Rect]) -> np.ndarray:
+    """A white page, with every block filled with lines of ink."""
+    img = np.full((h, w), 255, np.uint8)
+    for x, y, bw, bh in blocks:
+        img[y:y + bh, x:x + bw] = 0
+        img[y + 4:y + bh:8, x:x + bw] = 255  # thin gaps between the lines
+    return img
+
+
+def contains(outer: Rect, inner: Rect) -> bool:
+    return outer.x <= inner.x and outer.y <= inner.y \
+        and inner.x + inner.w <= outer.x + outer.w and inner.y + inner.h <= outer.y + outer.h
+
+
+def overlap(a: Rect, b: Rect) -> bool:
+    return a.x < b.x + b.w and b.x < a.x + a.w and a.y < b.y + b.h and b.y < a.y + a.h
+
+
+def test_content_runs_merges_narrow_gaps():
+    has_ink = np.array([0, 1, 1, 0, 1, 0, 0, 0, 1, 1, 0], bool)
+    assert content_runs(has_ink, 1) == [(1, 3), (4, 5), (8, 10)]
+    assert content_runs(has_ink, 2) == [(1, 5), (8, 10)]
+    assert content_runs(np.zeros(5, bool), 1) == []
+
+
+def test_blank_page_is_single_block():
+    assert find_text_blocks(np.full((100, 80), 255, np.uint8)) == [Rect(0, 0, 80, 100)]
+
+
+def test_columns_read_left_to_right():
+    columns = [Rect(300, 50, 200, 400), Rect(40, 50, 200, 400)]
+    blocks = find_text_blocks(page_with_blocks(500, 540, columns))
+    assert len(blocks) == 2
+    assert contains(blocks[0], columns[1]) and contains(blocks[1], columns[0])
+
+
+def test_paragraphs_read_top_to_bottom():
+    paragraphs = [Rect(40, 300, 400, 100), Rect(40, 50, 400, 100)]
+    blocks = find_text_blocks(page_with_blocks(500, 480, paragraphs))
+    assert len(blocks) == 2
+    assert contains(blocks[0], paragraphs[1]) and contains(blocks[1], paragraphs[0])
+
+
+def test_packed_page_splits_the_same():
+    img = page_with_blocks(500, 540, [Rect(40, 50, 200, 150), Rect(300, 50, 200, 150),
+                                      Rect(40, 300, 460, 150)])
+    assert find_text_blocks(pack(img)) == find_text_blocks(img)
+
+
+def test_blocks_never_overlap():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        # small pages, so the gaps between the blocks are narrower than the margins
+        h, w = (int(size) for size in rng.integers(40, 120, 2))
+        img = np.where(rng.random((h, w)) < 0.01, 0, 255).astype(np.uint8)
+        blocks = find_text_blocks(img)
+        for i, block in enumerate(blocks):
+            assert contains(Rect(0, 0, w, h), block)
+            assert not any(overlap(block, other) for other in blocks[i + 1:])
+        # every pixel of ink is in a block
+        covered = np.zeros((h, w), bool)
+        for x, y, bw, bh in blocks:
+            covered[y:y + bh, x:x + bw] = True
+        assert covered[img == 0].all()
@@ -0,0 +1,70 @@
+"""
+Tests for the bit-packed page (see `packed_image.py`), against the same
+operations on the unpacked image.
+"""
+import numpy as np
+import pytest
+
+from packed_image import (PackedImage, as_packed, column_projection, crop, erode, pack,
+                          row_projection, unpack)
+
+WIDTHS = [1, 7, 8, 9, 63, 64, 65, 130]
+
+
+def random_page(h: int, w: int, seed: int = 0, ink: float = 0.3) -> np.ndarray:
+    """A thresholded page - 0 for ink and 255 for the background."""
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random((h, w)) < ink, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('w', WIDTHS)
+def test_unpack_restores_packed_page(w):
+    img = random_page(300, w, seed=w)  # more rows than are packed at once
+    page = pack(img)
+    assert page.shape == img.shape
+    assert page.bits.shape[1] % 8 == 0
+    np.testing.assert_array_equal(unpack(page), img)
+
+
+def test_as_packed_keeps_packed_page():
+    page = pack(random_page(10, 20))
+    assert as_packed(page) is page
+    assert isinstance(as_packed(random_page(10, 20)), PackedImage)
+
+
+@pytest.mark.parametrize('w', WIDTHS)
+def test_crop_is_slice_of_page(w):
+    img = random_page(40, w, seed=w)
+    page = pack(img)
+    rng = np.random.default_rng(w)
+    for _ in range(50):
+        x, y = int(rng.integers(0, w)), int(rng.integers(0, 40))
+        cw, ch = int(rng.integers(0, w - x + 1)), int(rng.integers(0, 40 - y + 1))
+        cropped = crop(page, (x, y, cw, ch))
+        assert cropped.shape == (ch, cw)
+        np.testing.assert_array_equal(unpack(cropped), img[y:y + ch, x:x + cw])
+        np.testing.assert_array_equal(unpack(page, (x, y, cw, ch)), img[y:y + ch, x:x + cw])
+
+
+@pytest.mark.parametrize('w', WIDTHS)
+def test_projections_match_page(w):
+    img = random_page(50, w, seed=w, ink=0.02)
+    ink = img == 0
+    page = pack(img)
+    np.testing.assert_array_equal(row_projection(page), ink.any(axis=1))
+    np.testing.assert_array_equal(column_projection(page), ink.any(axis=0))
+    np.testing.assert_array_equal(row_projection(page, w // 3, w - w // 4),
+                                  ink[:, w // 3:w - w // 4].any(axis=1))
+    np.testing.assert_array_equal(column_projection(page, 10, 30), ink[10:30].any(axis=0))
+
+
+@pytest.mark.parametrize('w', WIDTHS)
+def test_erode_keeps_pixels_surrounded_by_ink(w):
+    img = random_page(30, w, seed=w, ink=0.8)
+    # the neighbours beyond the border are reflected, so they never erode the pixel
+    ink = np.pad(img == 0, 1, constant_values=True)
+    expected = np.ones(img.shape, bool)
+    for dy in range(3):
+        for dx in range(3):
+            expected &= ink[dy:dy + img.shape[0], dx:dx + w]
+    np.testing.assert_array_equal(unpack(erode(pack(img))) == 0, expected)
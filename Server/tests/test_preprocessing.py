@@ -0,0 +1,69 @@
+"""
+Tests for estimating the resolution of the page (see `preprocessing.py`).
+"""
+import numpy as np
+import pytest
+
+import consts
+from preprocessing import downscale_glyphs, estimate_line_height, normalization_scale
+
+LINE_HEIGHT = 20
+
+
+def page_with_lines(h: int = 1000, w: int = 800, lines: int = 20,
+                    line_height: int = LINE_HEIGHT) -> np.ndarray:
+    """A white page with lines of "text" - runs of ink of the given height,
+    made of words separated by blank columns."""
+    img = np.full((h, w), 255, np.uint8)
+    top = h // 10
+    spacing = (h - 2 * top) // lines
+    for line in range(lines):
+        y = top + line * spacing
+        for x in range(w // 10, w - w // 10, 60):
+            img[y:y + line_height, x:x + 45] = 0
+    return img
+
+
+def test_line_height_of_plain_page():
+    assert estimate_line_height(page_with_lines()) == LINE_HEIGHT
+
+
+def test_line_height_ignores_rule():
+    img = page_with_lines()
+    img[:, 400:403] = 0  # a vertical rule across the whole page
+    assert estimate_line_height(img) == LINE_HEIGHT
+
+
+def test_line_height_ignores_dark_background():
+    img = page_with_lines(w=1200)
+    img[:, :300] = 0  # the dark background next to the page
+    assert estimate_line_height(img) == LINE_HEIGHT
+
+
+@pytest.mark.parametrize('img', [
+    np.full((1000, 800), 255, np.uint8),  # blank
+    page_with_lines(lines=2),  # too few lines
+    np.where(np.arange(1000)[:, None] % 400 < 300, 0, 255).astype(np.uint8).repeat(800, 1),
+])
+def test_line_height_unknown(img):
+    assert estimate_line_height(img) is None
+
+
+def test_normalization_scale_never_below_min_dpi():
+    # a 300 dpi scan of a page with a rule, whose lines are already higher than the target
+    width = int(300 * consts.PAGE_WIDTH_INCHES)
+    img = page_with_lines(int(width * 11 / 8.5), width, lines=40,
+                          line_height=2 * consts.WARP_TARGET_LINE_HEIGHT)
+    img[:, width // 2:width // 2 + 4] = 0
+    rect = np.array([[0, 0], [width - 1, 0], [width - 1, img.shape[0] - 1],
+                     [0, img.shape[0] - 1]])
+    scale = normalization_scale(img, rect)
+    assert scale * width >= consts.WARP_MIN_DPI * consts.PAGE_WIDTH_INCHES - 1
+    assert scale <= consts.WARP_MAX_SCALE
+
+
+def test_downscale_glyphs_averages_areas():
+    glyphs = np.random.default_rng(0).random((3, 64, 64))
+    small = downscale_glyphs(glyphs, (32, 32))
+    np.testing.assert_allclose(small, glyphs.reshape(3, 32, 2, 32, 2).mean(axis=(2, 4)))
+    assert downscale_glyphs(glyphs[..., np.newaxis], (32, 32)).shape == (3, 32, 32, 1)
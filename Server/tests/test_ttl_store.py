@@ -0,0 +1,116 @@
+"""
+Tests for the bounded stores whose entries expire (see `ttl_store.py`).
+"""
+import os
+import time
+
+import pytest
+
+import ttl_store
+from ttl_store import SharedTTLStore, TTLStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """The monotonic time of the in-memory store, advanced by the tests."""
+    now = [1000.0]
+    monkeypatch.setattr(ttl_store.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_get_returns_stored_value():
+    store = TTLStore(ttl=60, max_items=10)
+    key = store.add({'text': 'hello'})
+    assert store.get(key) == {'text': 'hello'}
+    assert store.get('missing') is None
+    assert len(store) == 1
+
+
+def test_put_replaces_value():
+    store = TTLStore(ttl=60, max_items=10, max_bytes=100, size_of=len)
+    store.put('key', 'a' * 60)
+    store.put('key', 'b' * 60)
+    assert store.get('key') == 'b' * 60
+    assert len(store) == 1
+
+
+def test_pop_removes_value():
+    store = TTLStore(ttl=60, max_items=10)
+    key = store.add('value')
+    assert store.pop(key) == 'value'
+    assert store.pop(key) is None
+    assert store.get(key) is None
+
+
+def test_entries_expire_after_last_access(clock):
+    store = TTLStore(ttl=10, max_items=10)
+    key = store.add('value')
+    clock[0] += 8
+    assert store.get(key) == 'value'  # refreshes the entry
+    clock[0] += 8
+    assert store.get(key) == 'value'
+    clock[0] += 11
+    assert store.get(key) is None
+    assert len(store) == 0
+
+
+def test_least_recently_used_evicted_over_max_items():
+    store = TTLStore(ttl=60, max_items=2)
+    first, second = store.add(1), store.add(2)
+    store.get(first)
+    third = store.add(3)
+    assert store.get(second) is None
+    assert store.get(first) == 1 and store.get(third) == 3
+
+
+def test_evicted_over_max_bytes():
+    store = TTLStore(ttl=60, max_items=10, max_bytes=10, size_of=len)
+    first = store.add('a' * 6)
+    second = store.add('b' * 6)
+    assert store.get(first) is None
+    assert store.get(second) == 'b' * 6
+    # an entry larger than the bound is kept, as long as it is the only one
+    third = store.add('c' * 20)
+    assert store.get(third) == 'c' * 20
+    assert len(store) == 1
+
+
+def test_shared_store_round_trip(tmp_path):
+    store = SharedTTLStore(str(tmp_path), ttl=60, max_items=10)
+    key = store.add({'text': 'hello'})
+    # another worker sees the same entries
+    other = SharedTTLStore(str(tmp_path), ttl=60, max_items=10)
+    assert other.get(key) == {'text': 'hello'}
+    assert other.pop(key) == {'text': 'hello'}
+    assert store.get(key) is None
+    assert store.pop(key) is None
+    assert len(store) == 0
+
+
+def test_shared_store_rejects_invalid_ids(tmp_path):
+    store = SharedTTLStore(str(tmp_path), ttl=60, max_items=10)
+    with pytest.raises(ValueError):
+        store.put('../escape', 'value')
+    assert store.get('../escape') is None
+    assert store.pop('not-an-id') is None
+
+
+def test_shared_store_expires_entries(tmp_path):
+    store = SharedTTLStore(str(tmp_path), ttl=10, max_items=10)
+    key = store.add('value')
+    past = time.time() - 11
+    os.utime(tmp_path / key, (past, past))
+    assert store.get(key) is None
+    assert len(store) == 0
+
+
+def test_shared_store_evicts_least_recently_used(tmp_path):
+    store = SharedTTLStore(str(tmp_path), ttl=60, max_items=2)
+    first, second = store.add(1), store.add(2)
+    now = time.time()
+    os.utime(tmp_path / first, (now - 2, now - 2))
+    os.utime(tmp_path / second, (now - 1, now - 1))
+    store.get(first)
+    third = store.add(3)
+    assert store.get(second) is None
+    assert store.get(first) == 1 and store.get(third) == 3
@@ -0,0 +1,19 @@
+"""
+Module for the profile of the CPU threading settings found by
+`autotune_tf.py` (if any), read without importing TensorFlow - so the
+server can start its workers without it. The settings of TensorFlow
+itself are applied by `config_tf.py`.
+"""
+import json
+import os
+
+import consts
+
+PROFILE_PATH = os.environ.get('TF_PROFILE_PATH', consts.TF_PROFILE_PATH)
+profile = {}
+if os.path.exists(PROFILE_PATH):
+    with open(PROFILE_PATH) as f:
+        profile = json.load(f)
+# the number of workers of the server - the SERVER_WORKERS environment variable
+# overrides the profile
+workers = int(os.environ.get('SERVER_WORKERS', profile.get('workers', 1)))
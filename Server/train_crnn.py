@@ -0,0 +1,13 @@
+"""
+Module for training the word-level CRNN model (see `crnn_model.py`) on
+words rendered from the fonts in `consts.FONTS_DIR`.
+Only need run once, before using the 'crnn' recognition engine.
+"""
+import config_tf
+from crnn_model import CRNNModel
+
+crnn_model = CRNNModel()
+crnn_model.build_model()
+crnn_model.train_model()
+crnn_model.save_model()
+crnn_model.evaluate()
@@ -0,0 +1,118 @@
+"""
+Module for choosing the slim denoising autoencoder (see
+`slim_noise_remover.py`): the variants are trained from the smallest to the
+largest, and the first one whose end-to-end accuracy meets the target is
+saved - the accuracy of `OCRModel` on the validation set, after denoising
+the glyphs with the variant (both the clean glyphs and glyphs with added
+noise). By default, the target is the accuracy with `DenoisingAutoencoder`,
+minus the tolerance.
+The FLOPs, parameters, accuracy and CPU latency per glyph of every trained
+variant (and of the autoencoder) are printed and saved as a CSV file in the
+evaluation results.
+
+Usage: python train_slim_denoiser.py [--target ACCURACY] [--tolerance POINTS] [--all]
+"""
+import argparse
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+import config_tf
+import consts
+from base_model import new_instance
+from benchmark_denoisers import measure_latency, THROUGHPUT_BATCH_SIZE
+from model_evaluator import load_labeled_images
+from noise_remover import DenoisingAutoencoder
+from ocr_model import OCRModel
+from slim_noise_remover import SlimDenoisingAutoencoder
+
+
+def measure(model: OCRModel, denoiser: DenoisingAutoencoder, imgs: np.ndarray,
+            noisy: np.ndarray, labels: np.ndarray) -> dict:
+    """Measure the size, cost, end-to-end accuracy and CPU latency of the denoiser."""
+    row = {'parameters': denoiser.count_params(),
+           'MFLOPs per glyph': denoiser.count_flops() / 1e6}
+    for condition, condition_imgs in [('clean', imgs), ('noisy', noisy)]:
+        predictions = model.predict_batch(denoiser.denoise_batch(condition_imgs))
+        row[f'accuracy, {condition} (%)'] = np.mean(np.argmax(predictions, axis=1) == labels) * 100
+    with tf.device('/CPU:0'):
+        single, batched = measure_latency(denoiser, imgs)
+    row['CPU latency, single glyph (ms)'] = single
+    row[f'CPU latency per glyph, batch of {THROUGHPUT_BATCH_SIZE} (ms)'] = batched
+    return row
+
+
+def choose_variant(model: OCRModel, target: Optional[float] = None, tolerance: float = 0.5,
+                   train_all: bool = False) -> Optional[SlimDenoisingAutoencoder]:
+    """
+    Train the variants from the smallest to the largest, until one meets the
+    target accuracy (in percent, on both the clean and the noisy glyphs).
+
+    Args:
+        model (OCRModel): The (loaded) classifier the accuracy is measured with.
+        target (Optional[float]): The target accuracy - by default, the
+          accuracy with `DenoisingAutoencoder`, minus `tolerance` points.
+        tolerance (float): The accuracy points the slim denoiser may lose.
+        train_all (bool): Whether to train all of the variants for the
+          report, even after one meets the target.
+    Returns:
+        Optional[SlimDenoisingAutoencoder]: The smallest variant which meets
+          the target, or None if none of them does.
+    """
+    imgs, labels = load_labeled_images(consts.VALIDATION_CATEGORICAL_PATH)
+    imgs = imgs.reshape((len(imgs),) + consts.IMAGE_SIZE)
+    noisy = DenoisingAutoencoder._add_gaussian_noise(imgs)
+
+    autoencoder = DenoisingAutoencoder()
+    autoencoder.load_model()
+    baseline = measure(model, autoencoder, imgs, noisy, labels)
+    if target is None:
+        target = min(baseline['accuracy, clean (%)'], baseline['accuracy, noisy (%)']) - tolerance
+    print(f'Target accuracy: {target:.2f}%')
+
+    rows = [dict(variant='autoencoder', **baseline)]
+    chosen = None
+    for variant, (filters, downsampled_filters) in SlimDenoisingAutoencoder.VARIANTS.items():
+        denoiser = new_instance(SlimDenoisingAutoencoder, variant)
+        denoiser.build_model()
+        denoiser.train_model()
+        row = measure(model, denoiser, imgs, noisy, labels)
+        row['meets target'] = min(row['accuracy, clean (%)'], row['accuracy, noisy (%)']) >= target
+        rows.append(dict(variant=f'{variant} ({filters}/{downsampled_filters} filters)', **row))
+        print(f'Variant {variant!r}: {row}')
+        if row['meets target'] and chosen is None:
+            chosen = denoiser
+            if not train_all:
+                break
+
+    df = pd.DataFrame(rows).set_index('variant')
+    print(df.T)
+    df.to_csv(f'{consts.EVALUATION_RESULTS_DIR}\\slim_denoisers_report.csv')
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the smallest accurate slim denoiser.')
+    parser.add_argument('--target', type=float, default=None,
+                        help='the target accuracy, in percent (by default the accuracy '
+                             'with the autoencoder, minus the tolerance)')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='the accuracy points the slim denoiser may lose')
+    parser.add_argument('--all', action='store_true',
+                        help='train all of the variants for the report')
+    args = parser.parse_args()
+
+    model = OCRModel()
+    model.load_model()
+    denoiser = choose_variant(model, args.target, args.tolerance, args.all)
+    if denoiser is None:
+        print('None of the variants meets the target accuracy.')
+        return
+    denoiser.save_model()
+    print(f'Saved the {denoiser.variant!r} variant to {denoiser.MODEL_NAME}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Module for triaging the images before the full pipeline, on a small
+thumbnail: blank images have no text to extract, scans that are already
+cropped to the page have no page to find, and blurred photos cannot be
+read - none of them should pay for finding the page, warping it and
+cutting the characters.
+"""
+from collections import namedtuple
+
+import numpy as np
+import cv2
+
+import consts
+import metrics
+
+EMPTY = 'empty'  # no ink - the text is empty
+PRECROPPED = 'precropped'  # the image is the page itself - skip finding the page
+BLURRY = 'blurry'  # too blurred to be read
+FULL = 'full'  # the full pipeline
+
+TriageResult = namedtuple('TriageResult', 'route ink_coverage sharpness border_ink border_brightness')
+
+
+def thumbnail(img: np.ndarray) -> np.ndarray:
+    scale = min(1.0, consts.TRIAGE_WIDTH / img.shape[1])
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def ink_mask(thumb: np.ndarray) -> np.ndarray:
+    """Get the pixels of the (grayscale) thumbnail which are darker than their
+    surroundings by at least `consts.TRIAGE_INK_CONTRAST` - the ink, whatever
+    the lighting of the photo."""
+    return cv2.adaptiveThreshold(thumb, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV,
+                                 consts.TRIAGE_BLOCK_SIZE, consts.TRIAGE_INK_CONTRAST)
+
+
+def edge_sharpness(thumb: np.ndarray, around_ink: np.ndarray) -> float:
+    """
+    Measure how sharp the edges of the ink are: the magnitude of the
+    Laplacian relative to the magnitude of the gradient, over the steeper
+    half of the pixels around the ink. The ratio is about the inverse of
+    the width of the edges (in pixels of the thumbnail), whatever their
+    contrast, the lighting, or the amount of text.
+    """
+    if not around_ink.any():
+        return 0.0
+    thumb = thumb.astype(np.float32)
+    gradient = cv2.magnitude(cv2.Sobel(thumb, cv2.CV_32F, 1, 0),
+                             cv2.Sobel(thumb, cv2.CV_32F, 0, 1))[around_ink]
+    laplacian = np.abs(cv2.Laplacian(thumb, cv2.CV_32F))[around_ink]
+    edges = gradient >= np.median(gradient)
+    return float(laplacian[edges].sum() / max(gradient[edges].sum(), 1e-6))
+
+
+def measure(img: np.ndarray) -> TriageResult:
+    """
+    Measure the (grayscale) image on a thumbnail of it, and choose its route:
+    the share of ink in it (`EMPTY` if too low), the sharpness of the edges
+    of the ink (`BLURRY` if too low - only if `consts.TRIAGE_MIN_SHARPNESS`
+    is set, see `edge_sharpness`), and the ink in the border of the image
+    and how bright the border is relative to the paper (`PRECROPPED` if the
+    border is blank paper - there is no background around the page).
+    """
+    thumb = thumbnail(img)
+    ink = ink_mask(thumb)
+    ink_coverage = float(ink.mean())
+
+    # only around the ink, so the amount of text does not change the measure
+    around_ink = cv2.dilate(ink, np.ones((3, 3), np.uint8)).astype(bool)
+    sharpness = edge_sharpness(thumb, around_ink)
+
+    h, w = thumb.shape
+    size = max(1, round(consts.TRIAGE_BORDER_RATIO * min(h, w)))
+    border = np.ones((h, w), bool)
+    border[size:h - size, size:w - size] = False
+    border_ink = float(ink[border].mean())
+    # how much darker the border is than the paper (the brightest part of the image)
+    paper = np.percentile(thumb, 90)
+    border_brightness = float(np.median(thumb[border]) / max(paper, 1))
+
+    if ink_coverage < consts.TRIAGE_MIN_INK_COVERAGE:
+        route = EMPTY
+    elif consts.TRIAGE_MIN_SHARPNESS is not None and sharpness < consts.TRIAGE_MIN_SHARPNESS:
+        route = BLURRY
+    elif (border_ink <= consts.TRIAGE_MAX_BORDER_INK
+          and border_brightness >= consts.TRIAGE_MIN_BORDER_BRIGHTNESS):
+        route = PRECROPPED
+    else:
+        route = FULL
+    return TriageResult(route, ink_coverage, sharpness, border_ink, border_brightness)
+
+
+def triage(img: np.ndarray) -> str:
+    """Choose the route of the image through the pipeline (see `measure`),
+    recording the outcome in `metrics` (`triage.{route}`)."""
+    with metrics.timed('triage'):
+        result = measure(img)
+    metrics.increment(f'triage.{result.route}')
+    return result.route
+
+
+def calibrate_sharpness(sharp: np.ndarray, blurry: np.ndarray,
+                        max_rejected: float) -> tuple[float, float, float]:
+    """
+    Find the highest sharpness threshold (the one that rejects the most
+    blurred images) which rejects at most `max_rejected` of the sharp images.
+
+    Args:
+        sharp (np.ndarray): The sharpness of images which can be read.
+        blurry (np.ndarray): The sharpness of images too blurred to be read.
+        max_rejected (float): The fraction of the sharp images that may be
+          rejected (between 0.0 and 1.0).
+
+    Returns:
+        tuple[float, float, float]: The threshold, the fraction of the sharp
+          images it rejects and the fraction of the blurred images it rejects.
+    """
+    # the images below the threshold are rejected - at most k of the sharp ones
+    sorted_sharp = np.sort(sharp)
+    k = int(max_rejected * len(sorted_sharp))
+    threshold = float(sorted_sharp[min(k, len(sorted_sharp) - 1)])
+    return threshold, float(np.mean(sharp < threshold)), float(np.mean(blurry < threshold))
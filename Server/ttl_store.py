@@ -0,0 +1,194 @@
+"""
+Module for bounded stores, whose entries expire after a while, used for
+keeping the results of requests (and other per-client state) so clients
+can refer to them by id instead of uploading them again. `TTLStore` is kept
+in the memory of a single process, `SharedTTLStore` is shared by all of the
+workers of the server (a client's requests may reach any of them).
+"""
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+KEY_PATTERN = re.compile('[0-9a-f]{32}')  # the ids given by `add`
+
+
+class TTLStore:
+    """
+    A thread-safe store of values by random ids. Entries expire `ttl`
+    seconds after they were last accessed, and the least recently used
+    entries are evicted when there are more than `max_items` of them, or
+    when their total size (measured by `size_of`) is over `max_bytes`.
+    """
+
+    def __init__(self, ttl: float, max_items: int, max_bytes: Optional[int] = None,
+                 size_of: Callable[[Any], int] = lambda value: 0):
+        self._ttl = ttl
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._size_of = size_of
+        self._entries: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, value: Any) -> str:
+        """Store the value, and return its new id."""
+        key = uuid.uuid4().hex
+        self.put(key, value)
+        return key
+
+    def put(self, key: str, value: Any) -> None:
+        """Store the value under the given id (replacing the previous value)."""
+        size = self._size_of(value)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self._ttl, size, value)
+            self._total_bytes += size
+            self._evict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get the value stored under the id, or None if there is no such
+        value (or it has expired)."""
+        with self._lock:
+            self._evict()
+            if key not in self._entries:
+                return None
+            _, size, value = self._entries.pop(key)
+            self._entries[key] = (time.monotonic() + self._ttl, size, value)
+            return value
+
+    def pop(self, key: str) -> Optional[Any]:
+        """Remove the value stored under the id, and return it."""
+        with self._lock:
+            return self._remove(key)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key: str) -> Optional[Any]:
+        if key not in self._entries:
+            return None
+        _, size, value = self._entries.pop(key)
+        self._total_bytes -= size
+        return value
+
+    def _evict(self) -> None:
+        """Remove the expired entries, and then the least recently used
+        entries, until the store is within its bounds."""
+        now = time.monotonic()
+        # entries are ordered by their last access, so the expired ones come first
+        while self._entries and next(iter(self._entries.values()))[0] < now:
+            self._remove(next(iter(self._entries)))
+        while len(self._entries) > self._max_items \
+                or (self._max_bytes is not None and self._total_bytes > self._max_bytes
+                    and len(self._entries) > 1):
+            self._remove(next(iter(self._entries)))
+
+
+class SharedTTLStore:
+    """
+    The same as `TTLStore`, but shared by processes: every entry is a
+    pickled file in the directory (its size is the size of the entry), and
+    the time it was last modified is the time it was last accessed. Files
+    are replaced and removed atomically, so the processes need no lock - at
+    worst, an entry read while another process evicts it is still returned.
+    The ids are the hex strings given by `add`, any other id is not found.
+    """
+
+    def __init__(self, directory: str, ttl: float, max_items: int,
+                 max_bytes: Optional[int] = None):
+        self._directory = directory
+        self._ttl = ttl
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, value: Any) -> str:
+        """Store the value, and return its new id."""
+        key = uuid.uuid4().hex
+        self.put(key, value)
+        return key
+
+    def put(self, key: str, value: Any) -> None:
+        """Store the value under the given id (replacing the previous value)."""
+        if not KEY_PATTERN.fullmatch(key):
+            raise ValueError(f'Invalid id {key!r}, the ids are 32 hex digits.')
+        temp_path = self._temp_path(key)
+        with open(temp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, os.path.join(self._directory, key))
+        self._evict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get the value stored under the id, or None if there is no such
+        value (or it has expired)."""
+        if not KEY_PATTERN.fullmatch(key):
+            return None
+        path = os.path.join(self._directory, key)
+        try:
+            if os.path.getmtime(path) + self._ttl < time.time():
+                os.remove(path)
+                return None
+            os.utime(path)
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def pop(self, key: str) -> Optional[Any]:
+        """Remove the value stored under the id, and return it."""
+        if not KEY_PATTERN.fullmatch(key):
+            return None
+        # the file is renamed first, so only one process gets the value
+        claimed_path = self._temp_path(key)
+        try:
+            os.rename(os.path.join(self._directory, key), claimed_path)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(claimed_path, 'rb') as f:
+                return pickle.load(f)
+        finally:
+            os.remove(claimed_path)
+
+    def __len__(self) -> int:
+        return len(self._entries())
+
+    def _temp_path(self, key: str) -> str:
+        # names starting with a dot are not entries (see `_entries`)
+        return os.path.join(self._directory, f'.{key}.{os.getpid()}.{threading.get_ident()}')
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        """Get the (last access, size, path) of every entry."""
+        entries = []
+        for entry in os.scandir(self._directory):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self) -> None:
+        """Remove the expired entries, and then the least recently used
+        entries, until the store is within its bounds."""
+        entries = sorted(self._entries())
+        now = time.time()
+        total_bytes = sum(size for _, size, _ in entries)
+        for index, (accessed, size, path) in enumerate(entries):
+            count = len(entries) - index
+            if accessed + self._ttl >= now and count <= self._max_items \
+                    and (self._max_bytes is None or total_bytes <= self._max_bytes or count == 1):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size